@@ -0,0 +1,112 @@
+"""
+Allocation benchmark for the metrics hot path.
+
+Measures, with tracemalloc, the memory allocated while recording one request:
+
+* `record (labels)`: recording into the request metrics with a `.labels()` call per
+  metric, as `RequestRecorder.record` did before the metric children were cached
+* `record (bound)`: `RequestRecorder.record` with cached metric children
+* `middleware`: a complete request through `MetricsMiddleware`, with the access log
+  disabled
+
+Peak is the largest amount of memory allocated at once while handling a request, and
+retained is what is still allocated after all of the requests.
+
+Run with:
+    python benchmarks/metrics_allocations.py [--requests N]
+"""
+
+import argparse
+import asyncio
+import logging
+import tracemalloc
+from typing import Callable
+
+from metrics_middleware import make_app, run
+from prometheus_client import CollectorRegistry
+
+from fastapi_batteries_included.helpers import metrics
+from fastapi_batteries_included.helpers.metrics import (
+    UNMATCHED_ROUTE,
+    RequestMeasurement,
+    RequestRecorder,
+    _method_label,
+)
+
+MEASUREMENT = RequestMeasurement(
+    method="GET",
+    route="/patient/{patient_id}",
+    status_code=200,
+    latency=0.012,
+    ttfb=0.01,
+    response_size=512,
+    phases={"app": 0.01, "db": 0.005},
+)
+
+
+def record_with_labels(
+    recorder: RequestRecorder, measurement: RequestMeasurement
+) -> None:
+    method, route, status = recorder.label_set_limiter.limit(
+        _method_label(measurement.method),
+        measurement.route or UNMATCHED_ROUTE,
+        str(measurement.status_code),
+    )
+    assert recorder.latency and recorder.count and recorder.processing_time
+    assert recorder.ttfb and recorder.response_size
+    recorder.latency.labels(method, route).observe(measurement.latency)
+    recorder.count.labels(method, route, status).inc()
+    recorder.processing_time.labels(method, route).observe(measurement.latency)
+    recorder.ttfb.labels(method, route).observe(measurement.ttfb or 0)
+    recorder.response_size.labels(method, route).observe(measurement.response_size or 0)
+    for phase, duration in (measurement.phases or {}).items():
+        recorder.phase_latency.labels(route, phase).observe(duration)
+
+
+def measure(requests: int, handle_request: Callable[[], None]) -> tuple[float, int]:
+    """Return the mean peak and the total retained bytes over `requests` calls."""
+    handle_request()  # create label sets and metric children
+    tracemalloc.start()
+    peak_total = 0
+    start, _ = tracemalloc.get_traced_memory()
+    for _ in range(requests):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        handle_request()
+        _, peak = tracemalloc.get_traced_memory()
+        peak_total += peak - before
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak_total / requests, end - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    # Measure the metrics, not the log handlers.
+    logging.disable(logging.CRITICAL)
+
+    recorder = RequestRecorder(
+        recorders=metrics.metrics_settings.METRICS_REQUEST_RECORDERS,
+        buckets=metrics.metrics_settings.METRICS_LATENCY_BUCKETS,
+        size_buckets=metrics.metrics_settings.METRICS_SIZE_BUCKETS,
+        max_label_sets=1000,
+        registry=CollectorRegistry(),
+    )
+    app = make_app(metrics.MetricsMiddleware)
+    loop = asyncio.new_event_loop()
+
+    for name, handle_request in [
+        ("record (labels)", lambda: record_with_labels(recorder, MEASUREMENT)),
+        ("record (bound)", lambda: recorder.record(MEASUREMENT)),
+        ("middleware", lambda: loop.run_until_complete(run(app, 1))),
+    ]:
+        peak, retained = measure(args.requests, handle_request)
+        print(f"{name:>16}: {peak:8.0f} B peak/request, {retained:6d} B retained")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
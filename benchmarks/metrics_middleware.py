@@ -0,0 +1,182 @@
+"""
+Throughput benchmark for the metrics middleware.
+
+Compares the pure ASGI `MetricsMiddleware` against the previous implementation built
+on Starlette's `BaseHTTPMiddleware`. Requests are driven straight through the ASGI
+interface so the numbers reflect middleware overhead rather than an HTTP client.
+
+Run with:
+    python benchmarks/metrics_middleware.py [--requests N]
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from fastapi import FastAPI, Request, Response
+from prometheus_client import CollectorRegistry, Counter, Histogram, Summary
+from she_logging import logger
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.types import Message
+
+from fastapi_batteries_included.helpers import metrics
+
+# The metrics of 1.2.4, in their own registry as the names are still in use
+legacy_registry = CollectorRegistry()
+LEGACY_REQUEST_LATENCY = Histogram(
+    "fastapi_request_latency_seconds",
+    "FastAPI Request Latency",
+    ["method", "url"],
+    registry=legacy_registry,
+)
+LEGACY_REQUEST_COUNT = Counter(
+    "fastapi_request_count",
+    "FastAPI Request Count",
+    ["method", "url", "http_status"],
+    registry=legacy_registry,
+)
+LEGACY_REQUEST_TIME = Summary(
+    "request_processing_seconds",
+    "Time spent processing request",
+    ["method", "endpoint"],
+    registry=legacy_registry,
+)
+
+
+def legacy_after_request(
+    start_time: float, request: Request, response: Response
+) -> Response:
+    """`after_request` as it was in 1.2.4."""
+    response = metrics.add_no_cache_headers(response)
+
+    # Skip logging and metrics for app monitoring probes
+    if not request.state.enable_metrics:
+        return response
+
+    request_latency: float = time.time() - start_time
+    endpoint = request.base_url
+    LEGACY_REQUEST_LATENCY.labels(request.method, endpoint).observe(request_latency)
+    LEGACY_REQUEST_COUNT.labels(request.method, endpoint, response.status_code).inc()
+    LEGACY_REQUEST_TIME.labels(request.method, endpoint).observe(request_latency)
+
+    content_length = response.headers.get("content-length")
+
+    request_details = {
+        "status": response.status_code,
+        "requestUrl": str(request.url),
+        "requestMethod": request.method,
+        "remoteIp": request.client.host if request.client else None,
+        "responseSize": content_length,
+        "userAgent": str(request.headers.get("User-Agent", None)),
+        "latency": f"{request_latency:.4f}s",
+    }
+    additional_details = {
+        "requestXHeaders": {
+            k: v for k, v in request.headers.items() if k.lower().startswith("x-")
+        },
+        "requestQueryParams": dict(request.query_params or {}),
+        "requestPathParams": dict(request.path_params or {}),
+    }
+    additional_details = {k: v for k, v in additional_details.items() if v}
+    additional_detail_keys = {item for v in additional_details.values() for item in v}
+    logger.info(
+        '%s "%s" %s',
+        request.method,
+        request.url,
+        response.status_code,
+        extra={"httpRequest": request_details},
+    )
+    if additional_detail_keys:
+        logger.debug(
+            "Request has additional details %s",
+            ", ".join(additional_detail_keys),
+            extra={"httpRequest": additional_details},
+        )
+    return response
+
+
+class LegacyMetricsMiddleware(BaseHTTPMiddleware):
+    """The BaseHTTPMiddleware implementation this library used up to 1.2.4."""
+
+    async def dispatch(
+        self, request: Request, call_next: RequestResponseEndpoint
+    ) -> Response:
+        start_time = time.time()
+        request.state.enable_metrics = True
+        response = await call_next(request)
+        return legacy_after_request(start_time, request, response)
+
+
+def make_app(middleware: type) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/hello-world")
+    async def hello_world() -> dict:
+        return {"greeting": "hello"}
+
+    app.add_middleware(middleware)
+    return app
+
+
+async def run(app: FastAPI, requests: int) -> float:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "server": ("bench", 80),
+        "client": ("127.0.0.1", 12345),
+        "root_path": "",
+        "path": "/hello-world",
+        "raw_path": b"/hello-world",
+        "query_string": b"",
+        "headers": [(b"host", b"bench")],
+    }
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        # Behave like a server: the client only disconnects once the response is done
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+        response_complete = asyncio.Event()
+
+        async def receive() -> Message:
+            if messages:
+                return messages.pop()
+            await response_complete.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message: Message) -> None:
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                response_complete.set()
+
+        await app(dict(scope), receive, send)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    # Measure the middleware, not the log handlers.
+    logging.disable(logging.CRITICAL)
+
+    for name, middleware in [
+        ("BaseHTTPMiddleware", LegacyMetricsMiddleware),
+        ("pure ASGI", metrics.MetricsMiddleware),
+    ]:
+        app = make_app(middleware)
+        asyncio.run(run(app, 500))  # warm up
+        elapsed = asyncio.run(run(app, args.requests))
+        print(
+            f"{name:>20}: {args.requests / elapsed:10.0f} req/s "
+            f"({elapsed / args.requests * 1e6:.1f} µs/request)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,10 @@ from fastapi import FastAPI
 from she_logging import logger
 from she_logging.fastapi_request_id import RequestContextMiddleware
 
+from .helpers.drain import init_drain
 from .helpers.error_handler import init_error_handler
+from .helpers.load_shedding import init_load_shedding
+from .helpers.loop_monitor import init_event_loop_monitor
 from .helpers.metrics import init_metrics
 from .router_monitoring import init_monitoring
 
@@ -56,7 +59,11 @@ def augment_app(
     # Add in monitoring endpoints and metrics if not testing
     if not testing:
         init_monitoring(app)
+        # Added before the metrics middleware so that it records shed requests
+        init_load_shedding(app)
+        init_drain(app)
         init_metrics(app)
+        init_event_loop_monitor(app)
 
     # Add in X-Request-ID handling
     app.add_middleware(RequestContextMiddleware)
@@ -1,8 +1,8 @@
 import urllib
 from functools import lru_cache
-from typing import Optional, Union
+from typing import Any, Optional, Union
 
-from pydantic import BaseSettings, Field, validator
+from pydantic import BaseSettings, Field, root_validator, validator
 from pydantic.fields import ModelField
 
 
@@ -34,6 +34,164 @@ class GeneralSettings(BaseSettings):
     )
 
 
+REQUEST_RECORDERS = {
+    "histogram",
+    "counter",
+    "summary",
+    "ttfb",
+    "response_size",
+    "quantiles",
+}
+DEFAULT_REQUEST_RECORDERS = REQUEST_RECORDERS - {"quantiles"}
+
+
+class MetricsSettings(GeneralSettings):
+    METRICS_INSTRUMENTATOR_ENABLED: bool = True
+    METRICS_REQUEST_RECORDERS: set[str] = DEFAULT_REQUEST_RECORDERS
+    METRICS_LATENCY_BUCKETS: list[float] = [
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.075,
+        0.1,
+        0.25,
+        0.5,
+        0.75,
+        1.0,
+        2.5,
+        5.0,
+        7.5,
+        10.0,
+    ]
+    METRICS_SIZE_BUCKETS: list[float] = [
+        100,
+        1_000,
+        10_000,
+        100_000,
+        1_000_000,
+        10_000_000,
+    ]
+    METRICS_MAX_LABEL_SETS: int = 1000
+    METRICS_EXEMPLARS_ENABLED: bool = True
+    # Observations of at least this latency carry the request ID as an exemplar
+    METRICS_EXEMPLAR_MIN_SECONDS: float = 1.0
+    METRICS_QUANTILES: list[float] = [0.5, 0.9, 0.99, 0.999]
+    METRICS_QUANTILE_WINDOW_SECONDS: float = Field(default=300.0, gt=0)
+    METRICS_QUANTILE_SUBWINDOWS: int = Field(default=5, gt=0)
+    METRICS_QUANTILE_RELATIVE_ACCURACY: float = Field(default=0.01, gt=0, lt=1)
+    METRICS_EXPOSITION_CACHE_SECONDS: float = 1.0
+    RUNTIME_METRICS_ENABLED: bool = True
+    REQUEST_QUEUE_TIME_ENABLED: bool = False
+    REQUEST_QUEUE_TIME_HEADERS: list[str] = ["X-Request-Start", "X-Queue-Start"]
+    # 5 minutes, 30 minutes, 1 hour and 6 hours
+    SLO_BURN_RATE_WINDOWS: list[float] = [300, 1800, 3600, 21600]
+    SLO_BUCKET_SECONDS: float = Field(default=60.0, gt=0)
+    HEAVY_HITTERS_ENABLED: bool = False
+    HEAVY_HITTERS_CAPACITY: int = Field(default=100, gt=0)
+    HEAVY_HITTERS_TOP_N: int = Field(default=10, gt=0)
+    # Defaults to enabled outside production
+    SERVER_TIMING_ENABLED: Optional[bool] = None
+
+    @validator("METRICS_REQUEST_RECORDERS")
+    def known_request_recorders(cls, v: set[str]) -> set[str]:
+        unknown = v - REQUEST_RECORDERS
+        if unknown:
+            raise ValueError(
+                f"Unknown request recorders {sorted(unknown)}, "
+                f"expected some of {sorted(REQUEST_RECORDERS)}"
+            )
+        return v
+
+    @validator("SLO_BURN_RATE_WINDOWS")
+    def slo_burn_rate_windows(cls, v: list[float]) -> list[float]:
+        if not v:
+            raise ValueError("At least one SLO burn rate window is needed")
+        if min(v) <= 0:
+            raise ValueError(f"SLO burn rate windows must be positive: {v}")
+        return sorted(v)
+
+    @validator("SERVER_TIMING_ENABLED", always=True)
+    def server_timing_default(cls, v: Optional[bool], values: dict[str, str]) -> bool:
+        if v is None:
+            return not is_production_environment(environment=values["ENVIRONMENT"])
+        return v
+
+
+class AccessLogSettings(GeneralSettings):
+    ACCESS_LOG_ASYNC: bool = False
+    ACCESS_LOG_QUEUE_SIZE: int = 10000
+    ACCESS_LOG_BATCH_SIZE: int = 100
+    ACCESS_LOG_SUCCESS_SAMPLE_RATE: float = Field(default=1.0, ge=0.0, le=1.0)
+    ACCESS_LOG_SLOW_REQUEST_SECONDS: Optional[float] = None
+
+
+class MonitoringSettings(GeneralSettings):
+    EVENT_LOOP_MONITOR_ENABLED: bool = False
+    EVENT_LOOP_MONITOR_INTERVAL_SECONDS: float = 0.25
+    EVENT_LOOP_BLOCKING_THRESHOLD_SECONDS: float = 0.5
+    PROFILER_SAMPLE_INTERVAL_SECONDS: float = Field(default=0.005, ge=0.001)
+    PROFILER_MAX_SECONDS: float = 60.0
+    # Requests running longer than this have their stack captured
+    SLOW_REQUEST_CAPTURE_SECONDS: Optional[float] = Field(default=None, gt=0)
+    SLOW_REQUEST_MAX_CAPTURED: int = Field(default=20, gt=0)
+    TRACEMALLOC_FRAMES: int = Field(default=1, gt=0)
+    TRACEMALLOC_MAX_SNAPSHOTS: int = Field(default=5, gt=0)
+    # Holds build-circleci.txt and build-githash.txt
+    BUILD_INFO_DIRECTORY: str = "/app"
+    READINESS_CHECK_INTERVAL_SECONDS: float = Field(default=10.0, gt=0)
+    READINESS_CHECK_TIMEOUT_SECONDS: float = Field(default=5.0, gt=0)
+    # Needs the JwtSettings environment variables
+    READINESS_JWKS_CHECK: bool = False
+
+
+class LoadSheddingSettings(GeneralSettings):
+    # Requests are only shed when a limit is set
+    LOAD_SHEDDING_MAX_IN_FLIGHT: Optional[int] = Field(default=None, gt=0)
+    LOAD_SHEDDING_LOW_PRIORITY_MAX_IN_FLIGHT: Optional[int] = Field(default=None, gt=0)
+    LOAD_SHEDDING_LOW_PRIORITY_TAGS: set[str] = set()
+    LOAD_SHEDDING_RETRY_AFTER_SECONDS: int = 1
+    LOAD_SHEDDING_MAX_QUEUE_SECONDS: Optional[float] = Field(default=None, gt=0)
+    ADAPTIVE_CONCURRENCY_ENABLED: bool = False
+    ADAPTIVE_CONCURRENCY_INITIAL_LIMIT: int = Field(default=20, gt=0)
+    ADAPTIVE_CONCURRENCY_MIN_LIMIT: int = Field(default=1, gt=0)
+    ADAPTIVE_CONCURRENCY_MAX_LIMIT: int = Field(default=200, gt=0)
+    # Latency above the route's baseline latency times this is treated as congestion
+    ADAPTIVE_CONCURRENCY_LATENCY_TOLERANCE: float = Field(default=2.0, gt=1.0)
+    ADAPTIVE_CONCURRENCY_BACKOFF_RATIO: float = Field(default=0.9, gt=0.0, lt=1.0)
+
+    @root_validator(skip_on_failure=True)
+    def consistent_limits(cls, values: dict[str, Any]) -> dict[str, Any]:
+        max_in_flight = values["LOAD_SHEDDING_MAX_IN_FLIGHT"]
+        low_priority_max_in_flight = values["LOAD_SHEDDING_LOW_PRIORITY_MAX_IN_FLIGHT"]
+        if (
+            max_in_flight is not None
+            and low_priority_max_in_flight is not None
+            and low_priority_max_in_flight > max_in_flight
+        ):
+            raise ValueError(
+                "LOAD_SHEDDING_LOW_PRIORITY_MAX_IN_FLIGHT must not be more than "
+                "LOAD_SHEDDING_MAX_IN_FLIGHT"
+            )
+        if not (
+            values["ADAPTIVE_CONCURRENCY_MIN_LIMIT"]
+            <= values["ADAPTIVE_CONCURRENCY_INITIAL_LIMIT"]
+            <= values["ADAPTIVE_CONCURRENCY_MAX_LIMIT"]
+        ):
+            raise ValueError(
+                "ADAPTIVE_CONCURRENCY_INITIAL_LIMIT must be between "
+                "ADAPTIVE_CONCURRENCY_MIN_LIMIT and ADAPTIVE_CONCURRENCY_MAX_LIMIT"
+            )
+        return values
+
+
+class DrainSettings(GeneralSettings):
+    DRAIN_ON_SIGTERM: bool = False
+    # Time for the load balancer to notice /ready failing before requests are rejected
+    DRAIN_GRACE_SECONDS: float = Field(default=5.0, ge=0)
+    DRAIN_TIMEOUT_SECONDS: float = Field(default=20.0, ge=0)
+
+
 class JwtSettings(GeneralSettings):
     HS_KEY: str
     AUTH_PROVIDER_JWKS_URL: str
@@ -48,6 +206,7 @@ class JwtSettings(GeneralSettings):
     AUTH_PROVIDER_HS_KEY: Optional[str] = None
     JWKS_CACHE_EXPIRY_SECONDS: int = 3600
     JWKS_CACHE_SIZE: int = 10
+    JWKS_FETCH_TIMEOUT_SECONDS: float = 5.0
 
     IGNORE_JWT_VALIDATION: bool = False
     PROXY_URL: str
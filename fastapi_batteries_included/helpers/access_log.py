@@ -0,0 +1,207 @@
+"""
+Access logging for requests handled by `MetricsMiddleware`.
+
+By default each access log line is written on the request path. With ACCESS_LOG_ASYNC
+the request path only enqueues a compact `AccessLogRecord`, and a background thread
+formats and writes the records in batches. The queue is bounded: when it is full
+records are dropped and counted rather than slowing requests down.
+
+Successful requests can be sampled with ACCESS_LOG_SUCCESS_SAMPLE_RATE; error responses
+and requests slower than ACCESS_LOG_SLOW_REQUEST_SECONDS are always logged. No record is
+built for a request that will not be logged.
+"""
+
+import logging
+import queue
+import random
+import threading
+from typing import Any, NamedTuple, Optional
+
+from fastapi import Request
+from prometheus_client import Counter
+from she_logging import logger
+from she_logging.request_id import current_request_id, reset_request_id, set_request_id
+from starlette.types import Scope
+
+from fastapi_batteries_included import config
+
+access_log_settings = config.AccessLogSettings()
+
+ACCESS_LOG_DROPPED = Counter(
+    "fastapi_access_log_dropped",
+    "Access log records dropped because the access log queue was full",
+)
+
+# The parts of the ASGI scope needed to format an access log line
+_SCOPE_KEYS = (
+    "type",
+    "method",
+    "scheme",
+    "server",
+    "client",
+    "root_path",
+    "path",
+    "query_string",
+    "headers",
+    "path_params",
+)
+
+
+class AccessLogRecord(NamedTuple):
+    scope: Scope
+    status_code: int
+    latency: float
+    response_size: Optional[int]
+    request_id: Optional[str]
+
+
+def make_access_log_record(
+    scope: Scope, status_code: int, latency: float, response_size: Optional[int]
+) -> AccessLogRecord:
+    # Copy only the top level of the scope: the values are not changed once the
+    # response is complete, and this avoids building any strings on the request path.
+    return AccessLogRecord(
+        scope={key: scope[key] for key in _SCOPE_KEYS if key in scope},
+        status_code=status_code,
+        latency=latency,
+        response_size=response_size,
+        request_id=current_request_id(),
+    )
+
+
+def should_log_request(status_code: int, latency: float) -> bool:
+    if not logger.isEnabledFor(logging.INFO):
+        return False
+    if status_code >= 400:
+        return True
+    slow_request_seconds = access_log_settings.ACCESS_LOG_SLOW_REQUEST_SECONDS
+    if slow_request_seconds is not None and latency >= slow_request_seconds:
+        return True
+    sample_rate = access_log_settings.ACCESS_LOG_SUCCESS_SAMPLE_RATE
+    # Not used for security purposes
+    return sample_rate >= 1.0 or random.random() < sample_rate  # nosec
+
+
+def emit_access_log(record: AccessLogRecord) -> None:
+    request = Request(record.scope)
+    request_details = {
+        "status": record.status_code,
+        "requestUrl": str(request.url),
+        "requestMethod": request.method,
+        "remoteIp": request.client.host if request.client else None,
+        "responseSize": record.response_size,
+        "userAgent": str(request.headers.get("User-Agent", None)),
+        "latency": f"{record.latency:.4f}s",
+    }
+    logger.info(
+        '%s "%s" %s',
+        request.method,
+        request.url,
+        record.status_code,
+        extra={"httpRequest": request_details},
+    )
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+
+    additional_details: dict[str, Any] = {
+        "requestXHeaders": {
+            k: v for k, v in request.headers.items() if k.lower().startswith("x-")
+        },
+        "requestQueryParams": dict(request.query_params or {}),
+        "requestPathParams": dict(request.path_params or {}),
+    }
+    additional_details = {k: v for k, v in additional_details.items() if v}
+    additional_detail_keys = {item for v in additional_details.values() for item in v}
+    if additional_detail_keys:
+        logger.debug(
+            "Request has additional details %s",
+            ", ".join(additional_detail_keys),
+            extra={"httpRequest": additional_details},
+        )
+
+
+class AccessLogQueue:
+    """
+    Bounded queue of access log records drained by a background thread, which
+    writes up to `batch_size` records at a time. The thread is started by the first
+    record; `close()` writes everything still queued and stops it.
+    """
+
+    _STOP = object()
+
+    def __init__(self, max_size: int, batch_size: int) -> None:
+        self.batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue(maxsize=max_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def put(self, record: AccessLogRecord) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            ACCESS_LOG_DROPPED.inc()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="access-log", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is self._STOP:
+                    return
+                self._emit(item)
+
+    @staticmethod
+    def _emit(record: AccessLogRecord) -> None:
+        # Log records pick up the request ID from a context variable
+        token = (
+            set_request_id(record.request_id) if record.request_id is not None else None
+        )
+        try:
+            emit_access_log(record)
+        except Exception:
+            logger.exception("Failed to write access log record")
+        finally:
+            if token is not None:
+                reset_request_id(token)
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        """Write all queued records and stop the background thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        # Block rather than drop: the stop marker must follow the queued records
+        self._queue.put(self._STOP)
+        thread.join(timeout)
+
+
+access_log_queue = AccessLogQueue(
+    max_size=access_log_settings.ACCESS_LOG_QUEUE_SIZE,
+    batch_size=access_log_settings.ACCESS_LOG_BATCH_SIZE,
+)
+
+
+def log_request(
+    scope: Scope, status_code: int, latency: float, response_size: Optional[int]
+) -> None:
+    if not should_log_request(status_code, latency):
+        return
+    record = make_access_log_record(scope, status_code, latency, response_size)
+    if access_log_settings.ACCESS_LOG_ASYNC:
+        access_log_queue.put(record)
+    else:
+        emit_access_log(record)
@@ -0,0 +1,77 @@
+"""
+Build information of the running app.
+
+The CircleCI build number and git hash are written to `build-circleci.txt` and
+`build-githash.txt` in BUILD_INFO_DIRECTORY when the image is built. They are read once,
+at startup (or on first use if the app was not started), and served from memory by
+`/version` with an ETag so that pollers can revalidate cheaply. They are also exported in
+the `build_info` gauge, always 1, so dashboards don't need to call `/version` at all.
+
+Call `build_info.reload()` to pick up new files without restarting the app.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Optional
+
+from aiofile import async_open
+from prometheus_client import Gauge
+
+from fastapi_batteries_included import config
+from fastapi_batteries_included.helpers import multiprocess
+
+monitoring_settings = config.MonitoringSettings()
+
+BUILD_INFO = Gauge(
+    "build_info",
+    "Build information of the app, always 1",
+    ["circle", "hash"],
+    multiprocess_mode=multiprocess.GAUGE_MAX,
+)
+
+# Key in the /version response -> file in BUILD_INFO_DIRECTORY
+BUILD_INFO_FILES = {
+    "circle": "build-circleci.txt",
+    "hash": "build-githash.txt",
+}
+UNKNOWN = "unknown"
+
+
+class BuildInfo:
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.version: Optional[dict[str, str]] = None
+        self.etag = ""
+
+    async def _read(self, filename: str) -> str:
+        try:
+            async with async_open(self.directory / filename, "r") as afp:
+                return (await afp.read()).strip()
+        except OSError:
+            return UNKNOWN
+
+    async def reload(self) -> dict[str, str]:
+        """Read the build information files again."""
+        version = {
+            key: await self._read(filename)
+            for key, filename in BUILD_INFO_FILES.items()
+        }
+        digest = hashlib.sha256(json.dumps(version, sort_keys=True).encode())
+        previous, self.version = self.version, version
+        self.etag = f'"{digest.hexdigest()[:16]}"'
+
+        if previous is not None and previous != version:
+            # Set to 0 first: removing a child has no effect in multiprocess mode
+            BUILD_INFO.labels(**previous).set(0)
+            BUILD_INFO.remove(*previous.values())
+        BUILD_INFO.labels(**version).set(1)
+        return version
+
+    async def get(self) -> dict[str, str]:
+        if self.version is None:
+            return await self.reload()
+        return self.version
+
+
+build_info = BuildInfo(Path(monitoring_settings.BUILD_INFO_DIRECTORY))
@@ -0,0 +1,156 @@
+"""
+Graceful drain before shutdown.
+
+During a rolling deployment a pod is sent SIGTERM while it is still receiving and
+handling requests. With DRAIN_ON_SIGTERM the app drains before the server's own SIGTERM
+handling starts shutting it down:
+
+1. `/ready` reports not ready straight away, so the pod is taken out of the service
+2. after DRAIN_GRACE_SECONDS, the time the load balancer takes to notice, new non-infra
+   requests are rejected by `LoadSheddingMiddleware` with a 503 and `Connection: close`
+3. requests already in flight are given up to DRAIN_TIMEOUT_SECONDS to complete
+4. the previous SIGTERM handler is called
+
+Requests completed while draining are counted in `fastapi_drain_completed_requests`,
+requests still in flight at the timeout in `fastapi_drain_aborted_requests` and rejected
+requests in `fastapi_drain_rejected_requests`.
+
+The SIGTERM handler is installed at startup with `signal.signal`, chaining to the handler
+installed by the server. Servers that handle signals through the event loop instead
+(uvicorn before 0.29) start shutting down at the same time as the drain.
+`Drain.drain()` can also be awaited directly.
+"""
+
+import asyncio
+import os
+import signal
+from types import FrameType
+from typing import Any, NamedTuple, Optional
+
+from fastapi import FastAPI
+from prometheus_client import Counter
+from she_logging import logger
+
+from fastapi_batteries_included import config
+from fastapi_batteries_included.router_monitoring.readiness import readiness_checks
+
+drain_settings = config.DrainSettings()
+
+DRAIN_COMPLETED = Counter(
+    "fastapi_drain_completed_requests",
+    "Requests that completed while the app was draining",
+)
+DRAIN_ABORTED = Counter(
+    "fastapi_drain_aborted_requests",
+    "Requests still in flight when draining timed out",
+)
+DRAIN_REJECTED = Counter(
+    "fastapi_drain_rejected_requests",
+    "Requests rejected because the app was draining",
+)
+
+
+class DrainResult(NamedTuple):
+    completed: int
+    aborted: int
+
+
+class Drain:
+    def __init__(self, grace_seconds: float, timeout_seconds: float) -> None:
+        self.grace_seconds = grace_seconds
+        self.timeout_seconds = timeout_seconds
+        self.draining = False
+        # New non-infra requests are rejected
+        self.rejecting = False
+        # Non-infra requests in flight, only changed on the event loop thread
+        self.in_flight = 0
+        self.completed = 0
+        self._idle: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._previous_handler: Any = signal.SIG_DFL
+
+    def request_started(self) -> None:
+        self.in_flight += 1
+
+    def request_finished(self) -> None:
+        self.in_flight -= 1
+        if self.draining:
+            self.completed += 1
+            DRAIN_COMPLETED.inc()
+            if self.in_flight == 0 and self._idle is not None:
+                self._idle.set()
+
+    async def drain(self) -> DrainResult:
+        """Stop taking traffic and wait for the requests in flight to complete."""
+        if self.draining:
+            raise RuntimeError("Already draining")
+        self.draining = True
+        self._idle = asyncio.Event()
+        readiness_checks.set_draining(True)
+        logger.info(
+            "Draining: rejecting new requests in %ss, %d in flight",
+            self.grace_seconds,
+            self.in_flight,
+        )
+
+        await asyncio.sleep(self.grace_seconds)
+        self.rejecting = True
+        if self.in_flight > 0:
+            try:
+                await asyncio.wait_for(self._idle.wait(), self.timeout_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+        result = DrainResult(completed=self.completed, aborted=self.in_flight)
+        DRAIN_ABORTED.inc(result.aborted)
+        if result.aborted:
+            logger.warning(
+                "Drain timed out: %d requests completed, %d still in flight",
+                result.completed,
+                result.aborted,
+            )
+        else:
+            logger.info("Drained: %d requests completed", result.completed)
+        return result
+
+    def install_signal_handler(self) -> None:
+        """Drain on SIGTERM, then pass the signal on to the previous handler."""
+        loop = asyncio.get_running_loop()
+        self._previous_handler = signal.getsignal(signal.SIGTERM)
+
+        def handle_sigterm(signum: int, frame: Optional[FrameType]) -> Any:
+            # The handler can run in the middle of the event loop's own code: only
+            # schedule the drain, in a way that is safe there and wakes the loop up
+            loop.call_soon_threadsafe(self._start_drain, signum, frame)
+
+        try:
+            signal.signal(signal.SIGTERM, handle_sigterm)
+        except ValueError:
+            logger.warning("Cannot drain on SIGTERM outside the main thread")
+
+    def _start_drain(self, signum: int, frame: Optional[FrameType]) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain_then_exit(signum, frame))
+
+    async def _drain_then_exit(self, signum: int, frame: Optional[FrameType]) -> None:
+        try:
+            await self.drain()
+        finally:
+            previous = self._previous_handler
+            signal.signal(signal.SIGTERM, previous)
+            if callable(previous):
+                previous(signum, frame)
+            elif previous == signal.SIG_DFL:
+                os.kill(os.getpid(), signum)
+
+
+drain = Drain(
+    grace_seconds=drain_settings.DRAIN_GRACE_SECONDS,
+    timeout_seconds=drain_settings.DRAIN_TIMEOUT_SECONDS,
+)
+
+
+def init_drain(app: FastAPI) -> None:
+    if drain_settings.DRAIN_ON_SIGTERM:
+        app.add_event_handler("startup", drain.install_signal_handler)
+        logger.debug("Draining on SIGTERM enabled")
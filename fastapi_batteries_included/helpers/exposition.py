@@ -0,0 +1,95 @@
+import gzip
+import threading
+import time
+from typing import Callable, Optional
+
+from fastapi import Request, Response
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from prometheus_client.exposition import choose_encoder, gzip_accepted
+from starlette.concurrency import run_in_threadpool
+
+from fastapi_batteries_included.helpers import multiprocess
+
+EXPOSITION_SECONDS = Histogram(
+    "fastapi_metrics_exposition_seconds",
+    "Time spent generating the /metrics exposition",
+    ["content_type"],
+    buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0],
+)
+
+EXPOSITION_REQUESTS = Counter(
+    "fastapi_metrics_exposition_requests",
+    "Requests for the /metrics exposition by whether they were served from cache",
+    ["cache"],
+)
+
+
+class _Exposition:
+    def __init__(self, body: bytes) -> None:
+        self.generated_at = time.monotonic()
+        self.body = body
+        # Scrapers normally accept gzip, so compress once here rather than per scrape
+        self.gzipped = gzip.compress(body)
+
+
+class CachedExposition:
+    """
+    Serves the Prometheus exposition, regenerating it at most once every `max_age`
+    seconds per content type however many scrapers there are. Generation runs in
+    the threadpool; cached responses are served directly from the event loop.
+    The OpenMetrics format is used when the scraper's Accept header asks for it, and
+    the body is gzipped when Accept-Encoding allows.
+    """
+
+    def __init__(
+        self,
+        max_age: float,
+        registry_factory: Callable[
+            [], CollectorRegistry
+        ] = multiprocess.exposition_registry,
+    ) -> None:
+        self.max_age = max_age
+        self.registry_factory = registry_factory
+        self._cache: dict[str, _Exposition] = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, content_type: str) -> Optional[_Exposition]:
+        exposition = self._cache.get(content_type)
+        if (
+            exposition is not None
+            and time.monotonic() - exposition.generated_at < self.max_age
+        ):
+            return exposition
+        return None
+
+    def _generate(
+        self, encoder: Callable[[CollectorRegistry], bytes], content_type: str
+    ) -> _Exposition:
+        with self._lock:
+            # Another scrape may have regenerated it while we waited for the lock
+            exposition = self._cached(content_type)
+            if exposition is not None:
+                EXPOSITION_REQUESTS.labels("hit").inc()
+                return exposition
+            EXPOSITION_REQUESTS.labels("miss").inc()
+            with EXPOSITION_SECONDS.labels(content_type).time():
+                exposition = _Exposition(encoder(self.registry_factory()))
+            self._cache[content_type] = exposition
+            return exposition
+
+    async def response(self, request: Request) -> Response:
+        encoder, content_type = choose_encoder(request.headers.get("Accept", ""))
+
+        exposition = self._cached(content_type)
+        if exposition is not None:
+            EXPOSITION_REQUESTS.labels("hit").inc()
+        else:
+            exposition = await run_in_threadpool(self._generate, encoder, content_type)
+
+        headers = {"Vary": "Accept, Accept-Encoding"}
+        if gzip_accepted(request.headers.get("Accept-Encoding", "")):
+            headers["Content-Encoding"] = "gzip"
+            return Response(
+                exposition.gzipped, media_type=content_type, headers=headers
+            )
+        return Response(exposition.body, media_type=content_type, headers=headers)
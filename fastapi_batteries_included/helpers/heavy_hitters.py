@@ -0,0 +1,166 @@
+"""
+Heavy hitter tracking.
+
+Finds the users (JWT `sub`), API key clients and client IP addresses sending the most
+requests without putting them in request metric labels, where every new client would
+add time series. Each is counted with the Space-Saving algorithm, which keeps at most
+HEAVY_HITTERS_CAPACITY clients however many there are: when a new client arrives and
+the sketch is full it replaces the client with the lowest count, inheriting that count
+as its possible overestimate. Any client with more than 1/capacity of the requests is
+guaranteed to be kept.
+
+The top HEAVY_HITTERS_TOP_N clients of each kind are exposed in the
+`fastapi_heavy_hitter_requests` metric family and by `/debug/heavy-hitters`. Counts
+are per worker, and are not included in `/metrics` in Prometheus multiprocess mode.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Iterator, NamedTuple, Optional
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from starlette.types import Scope
+
+from fastapi_batteries_included import config
+
+metrics_settings = config.MetricsSettings()
+
+DIMENSION_USER = "user"
+DIMENSION_API_KEY = "api_key"
+DIMENSION_IP = "ip"
+DIMENSIONS = (DIMENSION_USER, DIMENSION_API_KEY, DIMENSION_IP)
+
+# Request state keys set by the security dependencies
+USER_STATE_KEY = "client_user"
+API_KEY_STATE_KEY = "client_api_key"
+
+
+class HeavyHitter(NamedTuple):
+    client: str
+    requests: int
+    # The count may be overestimated by up to this much
+    error: int
+
+
+class SpaceSaving:
+    """
+    Space-Saving counters kept in a Stream-Summary: clients are grouped in buckets of
+    equal count, so finding the client to evict and moving a client up a count are both
+    O(1) whatever the capacity.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._counts: dict[str, int] = {}
+        self._errors: dict[str, int] = {}
+        # count -> clients with that count, oldest first. OrderedDict rather than dict
+        # so that taking the oldest stays O(1) after many deletions.
+        self._buckets: dict[int, OrderedDict[str, None]] = {}
+        self._min_count = 0
+        self._lock = threading.Lock()
+
+    def _add(self, client: str, count: int) -> None:
+        self._counts[client] = count
+        bucket = self._buckets.get(count)
+        if bucket is None:
+            bucket = self._buckets[count] = OrderedDict()
+        bucket[client] = None
+
+    def _remove(self, client: str) -> None:
+        count = self._counts.pop(client)
+        bucket = self._buckets[count]
+        del bucket[client]
+        if not bucket:
+            del self._buckets[count]
+
+    def offer(self, client: str) -> None:
+        with self._lock:
+            count = self._counts.get(client)
+            if count is not None:
+                self._remove(client)
+                self._add(client, count + 1)
+            elif len(self._counts) < self.capacity:
+                self._add(client, 1)
+                self._errors[client] = 0
+                self._min_count = 1
+                return
+            else:
+                count = self._min_count
+                evicted, _ = self._buckets[count].popitem(last=False)
+                self._counts.pop(evicted)
+                if not self._buckets[count]:
+                    del self._buckets[count]
+                del self._errors[evicted]
+                self._add(client, count + 1)
+                self._errors[client] = count
+            # Clients only ever move up one count
+            if count == self._min_count and count not in self._buckets:
+                self._min_count = count + 1
+
+    def top(self, n: int) -> list[HeavyHitter]:
+        with self._lock:
+            counters = [
+                HeavyHitter(client, count, self._errors[client])
+                for client, count in self._counts.items()
+            ]
+        counters.sort(key=lambda hitter: hitter.requests, reverse=True)
+        return counters[:n]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counts.clear()
+            self._errors.clear()
+            self._buckets.clear()
+            self._min_count = 0
+
+
+def api_key_fingerprint(api_key: str) -> str:
+    """Identifies an API key in metrics and logs without revealing it."""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+class HeavyHitters:
+    def __init__(self, capacity: int) -> None:
+        self.sketches = {dimension: SpaceSaving(capacity) for dimension in DIMENSIONS}
+
+    def record(self, scope: Scope) -> None:
+        state = scope.get("state", {})
+        user: Optional[str] = state.get(USER_STATE_KEY)
+        if user is not None:
+            self.sketches[DIMENSION_USER].offer(user)
+        api_key: Optional[str] = state.get(API_KEY_STATE_KEY)
+        if api_key is not None:
+            self.sketches[DIMENSION_API_KEY].offer(api_key)
+        client = scope.get("client")
+        if client:
+            self.sketches[DIMENSION_IP].offer(client[0])
+
+    def top(self, n: int) -> dict[str, list[HeavyHitter]]:
+        return {dimension: sketch.top(n) for dimension, sketch in self.sketches.items()}
+
+
+class HeavyHittersCollector(Collector):
+    def __init__(self, heavy_hitters: HeavyHitters, top_n: int) -> None:
+        self.heavy_hitters = heavy_hitters
+        self.top_n = top_n
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        family = GaugeMetricFamily(
+            "fastapi_heavy_hitter_requests",
+            "Requests from the clients sending the most requests to this worker",
+            labels=["dimension", "client"],
+        )
+        for dimension, hitters in self.heavy_hitters.top(self.top_n).items():
+            for hitter in hitters:
+                family.add_metric([dimension, hitter.client], hitter.requests)
+        yield family
+
+
+heavy_hitters = HeavyHitters(capacity=metrics_settings.HEAVY_HITTERS_CAPACITY)
+# Empty unless HEAVY_HITTERS_ENABLED
+REGISTRY.register(
+    HeavyHittersCollector(heavy_hitters, top_n=metrics_settings.HEAVY_HITTERS_TOP_N)
+)
@@ -0,0 +1,350 @@
+"""
+Admission control.
+
+`LoadSheddingMiddleware` counts the requests in flight in this worker in
+`fastapi_requests_in_flight`. When LOAD_SHEDDING_MAX_IN_FLIGHT is set, a request that
+arrives while that many requests are already in flight is rejected straight away with a
+503 instead of queueing behind them, so an overloaded pod keeps answering its probes and
+recovers rather than being restarted.
+
+Each request is given a priority from the tags of the route that will handle it:
+
+* `infra`: routes tagged `infra` (`/running`, `/version`, `/metrics`, ...) are always
+  admitted
+* `low`: routes with a tag in LOAD_SHEDDING_LOW_PRIORITY_TAGS are shed earlier, once
+  LOAD_SHEDDING_LOW_PRIORITY_MAX_IN_FLIGHT requests are in flight
+* `normal`: everything else
+
+With LOAD_SHEDDING_MAX_QUEUE_SECONDS set, non-infra requests that spent longer than that
+queued in front of the app (see `queueing`) are rejected too: the client has most likely
+given up on them already.
+
+With ADAPTIVE_CONCURRENCY_ENABLED each route template also gets its own concurrency limit,
+adjusted from the latency of the route's requests by `AdaptiveConcurrencyLimit`. A slow,
+database bound route then has its concurrency reduced before it can take up the whole
+worker, and requests to it beyond the limit are rejected with a 503 while faster routes
+carry on. Infrastructure routes have no route limit.
+
+While the app drains before shutdown (see `drain`) non-infra requests are rejected too,
+and those in flight are counted so the drain can wait for them.
+"""
+
+import statistics
+import time
+from collections import deque
+from typing import Collection, Optional
+
+from fastapi import FastAPI
+from prometheus_client import Counter, Gauge
+from she_logging import logger
+from starlette.responses import JSONResponse
+from starlette.routing import BaseRoute
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from fastapi_batteries_included import config
+from fastapi_batteries_included.helpers import multiprocess
+from fastapi_batteries_included.helpers.drain import DRAIN_REJECTED, Drain, drain
+from fastapi_batteries_included.helpers.queueing import queue_time_reader
+from fastapi_batteries_included.helpers.routes import UNMATCHED_ROUTE, get_matched_route
+
+load_shedding_settings = config.LoadSheddingSettings()
+
+INFRA_TAG = "infra"
+
+PRIORITY_INFRA = "infra"
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"
+
+REQUESTS_IN_FLIGHT = Gauge(
+    "fastapi_requests_in_flight",
+    "Requests currently being handled",
+    multiprocess_mode=multiprocess.GAUGE_LIVESUM,
+)
+REQUESTS_SHED = Counter(
+    "fastapi_requests_shed",
+    "Requests rejected because too many requests were in flight",
+    ["route", "priority"],
+)
+REQUESTS_EXPIRED = Counter(
+    "fastapi_requests_expired",
+    "Requests rejected because they had queued for longer than LOAD_SHEDDING_MAX_QUEUE_SECONDS",
+    ["route"],
+)
+ROUTE_CONCURRENCY_LIMIT = Gauge(
+    "fastapi_route_concurrency_limit",
+    "Current adaptive concurrency limit of the route",
+    ["route"],
+    multiprocess_mode=multiprocess.GAUGE_LIVEALL,
+)
+ROUTE_CONCURRENCY_REJECTIONS = Counter(
+    "fastapi_route_concurrency_rejections",
+    "Requests rejected because the route was at its adaptive concurrency limit",
+    ["route"],
+)
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    Additive increase, multiplicative decrease concurrency limit for one route.
+
+    Only successful responses are used as a latency signal: errors and short-circuited
+    responses (401, 404, ...) are often much faster than real work. Their latencies are
+    taken in windows of WINDOW_SIZE, and the baseline is the lowest median of the last
+    BASELINE_WINDOWS windows, so a share of very fast responses doesn't drag it down and
+    it follows lasting changes once older windows expire.
+
+    At the end of each window, a median above `tolerance` times the baseline is taken as
+    a sign of congestion and shrinks the limit by `backoff_ratio`. Otherwise the limit
+    grows by about one every `limit` requests, but only if at least half of the limit
+    was in use during the window: an idle route must not grow its limit without bound.
+    """
+
+    WINDOW_SIZE = 20
+    BASELINE_WINDOWS = 10
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        tolerance: float,
+        backoff_ratio: float,
+        gauge: Optional[Gauge] = None,
+    ) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff_ratio = backoff_ratio
+        self.gauge = gauge
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.in_flight = 0
+        self.baseline: Optional[float] = None
+        self._window: list[float] = []
+        self._window_peak_in_flight = 0
+        self._medians: deque[float] = deque(maxlen=self.BASELINE_WINDOWS)
+        if self.gauge is not None:
+            self.gauge.set(int(self.limit))
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        self._window_peak_in_flight = max(self._window_peak_in_flight, self.in_flight)
+        return True
+
+    def release(self, latency: float, status_code: int = 200) -> None:
+        self.in_flight -= 1
+        if status_code >= 400:
+            return
+        self._window.append(latency)
+        if len(self._window) < self.WINDOW_SIZE:
+            return
+
+        median = statistics.median(self._window)
+        utilised = self._window_peak_in_flight >= self.limit / 2
+        self._window.clear()
+        self._window_peak_in_flight = self.in_flight
+        self._medians.append(median)
+        self.baseline = min(self._medians)
+
+        if median > self.baseline * self.tolerance:
+            self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+        elif utilised:
+            self.limit = min(self.max_limit, self.limit + self.WINDOW_SIZE / self.limit)
+        if self.gauge is not None:
+            self.gauge.set(int(self.limit))
+
+
+class AdaptiveConcurrencyLimits:
+    """The `AdaptiveConcurrencyLimit` of each route, created on first use."""
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        tolerance: float,
+        backoff_ratio: float,
+    ) -> None:
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff_ratio = backoff_ratio
+        self._limits: dict[str, AdaptiveConcurrencyLimit] = {}
+
+    def for_route(self, route: str) -> AdaptiveConcurrencyLimit:
+        limit = self._limits.get(route)
+        if limit is None:
+            limit = self._limits[route] = AdaptiveConcurrencyLimit(
+                initial_limit=self.initial_limit,
+                min_limit=self.min_limit,
+                max_limit=self.max_limit,
+                tolerance=self.tolerance,
+                backoff_ratio=self.backoff_ratio,
+                gauge=ROUTE_CONCURRENCY_LIMIT.labels(route),
+            )
+        return limit
+
+
+def route_priority(
+    route: Optional[BaseRoute], low_priority_tags: Collection[str]
+) -> str:
+    tags = getattr(route, "tags", None) or []
+    if INFRA_TAG in tags:
+        return PRIORITY_INFRA
+    if any(tag in low_priority_tags for tag in tags):
+        return PRIORITY_LOW
+    return PRIORITY_NORMAL
+
+
+def _queue_seconds(scope: Scope) -> Optional[float]:
+    # MetricsMiddleware has measured it already with REQUEST_QUEUE_TIME_ENABLED
+    state = scope.get("state", {})
+    if "queue_seconds" in state:
+        return state["queue_seconds"]
+    return queue_time_reader.queue_time(scope)
+
+
+class LoadSheddingMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_in_flight: Optional[int] = None,
+        low_priority_max_in_flight: Optional[int] = None,
+        low_priority_tags: Collection[str] = (),
+        retry_after: int = 1,
+        route_limits: Optional[AdaptiveConcurrencyLimits] = None,
+        max_queue_seconds: Optional[float] = None,
+        drain: Optional[Drain] = None,
+    ) -> None:
+        self.app = app
+        self.max_in_flight = max_in_flight
+        self.low_priority_max_in_flight = low_priority_max_in_flight
+        self.low_priority_tags = frozenset(low_priority_tags)
+        self.retry_after = retry_after
+        self.route_limits = route_limits
+        self.max_queue_seconds = max_queue_seconds
+        self.drain = drain
+        # Only changed on the event loop thread
+        self.in_flight = 0
+
+    def limit_for(self, priority: str) -> Optional[int]:
+        if priority == PRIORITY_INFRA:
+            return None
+        if priority == PRIORITY_LOW and self.low_priority_max_in_flight is not None:
+            return self.low_priority_max_in_flight
+        return self.max_in_flight
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route_template, route = get_matched_route(scope)
+        priority = route_priority(route, self.low_priority_tags)
+        request_drain = self.drain if priority != PRIORITY_INFRA else None
+        if request_drain is not None and request_drain.rejecting:
+            DRAIN_REJECTED.inc()
+            # Make keep-alive clients reconnect, to another pod
+            await self.reject(scope, receive, send, headers={"Connection": "close"})
+            return
+
+        if self.max_queue_seconds is not None and priority != PRIORITY_INFRA:
+            queue_seconds = _queue_seconds(scope)
+            if queue_seconds is not None and queue_seconds > self.max_queue_seconds:
+                REQUESTS_EXPIRED.labels(route_template or UNMATCHED_ROUTE).inc()
+                await self.reject(scope, receive, send)
+                return
+
+        limit = self.limit_for(priority)
+        if limit is not None and self.in_flight >= limit:
+            REQUESTS_SHED.labels(route_template or UNMATCHED_ROUTE, priority).inc()
+            await self.reject(scope, receive, send)
+            return
+
+        route_limit: Optional[AdaptiveConcurrencyLimit] = None
+        if (
+            self.route_limits is not None
+            and route_template is not None
+            and priority != PRIORITY_INFRA
+        ):
+            route_limit = self.route_limits.for_route(route_template)
+            if not route_limit.try_acquire():
+                ROUTE_CONCURRENCY_REJECTIONS.labels(route_template).inc()
+                await self.reject(scope, receive, send)
+                return
+
+        self.in_flight += 1
+        REQUESTS_IN_FLIGHT.inc()
+        if request_drain is not None:
+            request_drain.request_started()
+        start_time = time.perf_counter()
+        # An exception becomes a 500 response
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(
+                scope, receive, send_wrapper if route_limit is not None else send
+            )
+        finally:
+            self.in_flight -= 1
+            REQUESTS_IN_FLIGHT.dec()
+            if request_drain is not None:
+                request_drain.request_finished()
+            if route_limit is not None:
+                route_limit.release(time.perf_counter() - start_time, status_code)
+
+    async def reject(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        headers: Optional[dict[str, str]] = None,
+    ) -> None:
+        # The same response as ServiceUnavailableException, without logging each
+        # rejection at a time when the service is already overloaded
+        response = JSONResponse(
+            status_code=503,
+            content={"message": "Service unavailable"},
+            headers={"Retry-After": str(self.retry_after), **(headers or {})},
+        )
+        await response(scope, receive, send)
+
+
+def init_load_shedding(app: FastAPI) -> None:
+    route_limits: Optional[AdaptiveConcurrencyLimits] = None
+    if load_shedding_settings.ADAPTIVE_CONCURRENCY_ENABLED:
+        route_limits = AdaptiveConcurrencyLimits(
+            initial_limit=load_shedding_settings.ADAPTIVE_CONCURRENCY_INITIAL_LIMIT,
+            min_limit=load_shedding_settings.ADAPTIVE_CONCURRENCY_MIN_LIMIT,
+            max_limit=load_shedding_settings.ADAPTIVE_CONCURRENCY_MAX_LIMIT,
+            tolerance=load_shedding_settings.ADAPTIVE_CONCURRENCY_LATENCY_TOLERANCE,
+            backoff_ratio=load_shedding_settings.ADAPTIVE_CONCURRENCY_BACKOFF_RATIO,
+        )
+        logger.debug("Adaptive route concurrency limits enabled")
+
+    app.add_middleware(
+        LoadSheddingMiddleware,
+        max_in_flight=load_shedding_settings.LOAD_SHEDDING_MAX_IN_FLIGHT,
+        low_priority_max_in_flight=(
+            load_shedding_settings.LOAD_SHEDDING_LOW_PRIORITY_MAX_IN_FLIGHT
+        ),
+        low_priority_tags=load_shedding_settings.LOAD_SHEDDING_LOW_PRIORITY_TAGS,
+        retry_after=load_shedding_settings.LOAD_SHEDDING_RETRY_AFTER_SECONDS,
+        route_limits=route_limits,
+        max_queue_seconds=load_shedding_settings.LOAD_SHEDDING_MAX_QUEUE_SECONDS,
+        drain=drain,
+    )
+    if (
+        load_shedding_settings.LOAD_SHEDDING_MAX_IN_FLIGHT is not None
+        or load_shedding_settings.LOAD_SHEDDING_LOW_PRIORITY_MAX_IN_FLIGHT is not None
+        or load_shedding_settings.LOAD_SHEDDING_MAX_QUEUE_SECONDS is not None
+    ):
+        logger.debug("Load shedding enabled")
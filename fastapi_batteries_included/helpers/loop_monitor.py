@@ -0,0 +1,119 @@
+"""
+Event loop lag monitoring.
+
+A task on the event loop repeatedly sleeps for EVENT_LOOP_MONITOR_INTERVAL_SECONDS and
+records how much later than requested it woke up in `fastapi_event_loop_lag_seconds`.
+Any lag means the loop was busy running something else, most often a blocking call
+made from async code.
+
+Outside production a watchdog thread also notices when the loop has not woken up for
+longer than EVENT_LOOP_BLOCKING_THRESHOLD_SECONDS and logs the stack the loop thread
+is executing at that moment, which points directly at the blocking call.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from fastapi import FastAPI
+from prometheus_client import Histogram
+from she_logging import logger
+
+from fastapi_batteries_included import config
+
+monitoring_settings = config.MonitoringSettings()
+
+EVENT_LOOP_LAG = Histogram(
+    "fastapi_event_loop_lag_seconds",
+    "Delay between when the event loop should have run a task and when it did",
+    buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
+)
+
+
+class EventLoopMonitor:
+    def __init__(
+        self, interval: float, blocking_threshold: Optional[float] = None
+    ) -> None:
+        self.interval = interval
+        self.blocking_threshold = blocking_threshold
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = time.monotonic()
+
+    async def start(self) -> None:
+        self._stopped.clear()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._measure_lag())
+        if self.blocking_threshold is not None:
+            self._watchdog = threading.Thread(
+                target=self._watch, name="event-loop-watchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    async def _measure_lag(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG.observe(max(0.0, loop.time() - expected))
+            self._heartbeat = time.monotonic()
+
+    def _watch(self) -> None:
+        assert self.blocking_threshold is not None
+        reported_heartbeat: Optional[float] = None
+        while not self._stopped.wait(self.blocking_threshold / 2):
+            heartbeat = self._heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            if blocked_for < self.blocking_threshold or heartbeat == reported_heartbeat:
+                continue
+            # Report each stall once, with the stack at the time it was noticed
+            reported_heartbeat = heartbeat
+            self.report_blocking_stack(blocked_for)
+
+    def report_blocking_stack(self, blocked_for: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id or 0)
+        if frame is None:
+            return
+        stack = "".join(traceback.format_stack(frame))
+        logger.warning(
+            "Event loop blocked for at least %.3fs, currently executing:\n%s",
+            blocked_for,
+            stack,
+        )
+
+
+def init_event_loop_monitor(app: FastAPI) -> None:
+    if not monitoring_settings.EVENT_LOOP_MONITOR_ENABLED:
+        return
+
+    monitor = EventLoopMonitor(
+        interval=monitoring_settings.EVENT_LOOP_MONITOR_INTERVAL_SECONDS,
+        blocking_threshold=(
+            monitoring_settings.EVENT_LOOP_BLOCKING_THRESHOLD_SECONDS
+            if config.is_not_production_environment()
+            else None
+        ),
+    )
+    app.state.event_loop_monitor = monitor
+    app.add_event_handler("startup", monitor.start)
+    app.add_event_handler("shutdown", monitor.stop)
+    logger.debug("Event loop lag monitor enabled")
@@ -1,26 +1,338 @@
+import os
+import threading
 import time
+from typing import Collection, NamedTuple, Optional, Sequence
 
 from fastapi import Depends, FastAPI, Request, Response
 from fastapi.responses import PlainTextResponse
-from prometheus_client import Counter, Histogram, Summary, generate_latest
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    Summary,
+)
 from prometheus_fastapi_instrumentator import Instrumentator
 from she_logging import logger
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from she_logging.request_id import current_request_id
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from fastapi_batteries_included import config
+from fastapi_batteries_included.helpers import multiprocess
+from fastapi_batteries_included.helpers.access_log import access_log_queue, log_request
+from fastapi_batteries_included.helpers.exposition import CachedExposition
+from fastapi_batteries_included.helpers.heavy_hitters import heavy_hitters
+from fastapi_batteries_included.helpers.quantiles import (
+    LatencyQuantiles,
+    LatencyQuantilesCollector,
+)
+from fastapi_batteries_included.helpers.queueing import (
+    REQUEST_QUEUE_TIME,
+    queue_time_reader,
+)
+from fastapi_batteries_included.helpers.routes import UNMATCHED_ROUTE, get_matched_route
+from fastapi_batteries_included.helpers.runtime_metrics import init_runtime_metrics
+from fastapi_batteries_included.helpers.slo import slo_tracker
+from fastapi_batteries_included.helpers.slow_requests import slow_request_watchdog
+from fastapi_batteries_included.helpers.timing import (
+    RequestTimer,
+    start_request_timer,
+    stop_request_timer,
+)
 
-REQUEST_LATENCY = Histogram(
-    "fastapi_request_latency_seconds", "FastAPI Request Latency", ["method", "url"]
+metrics_settings = config.MetricsSettings()
+
+OVERFLOW_ROUTE = "<overflow>"
+OTHER_METHOD = "OTHER"
+# Status recorded for requests whose client went away before the response started
+CLIENT_CLOSED_REQUEST = 499
+KNOWN_METHODS = frozenset(
+    {"GET", "HEAD", "POST", "PUT", "DELETE", "CONNECT", "OPTIONS", "TRACE", "PATCH"}
 )
 
-REQUEST_COUNT = Counter(
-    "fastapi_request_count", "FastAPI Request Count", ["method", "url", "http_status"]
+DROPPED_LABEL_SETS = Counter(
+    "fastapi_metrics_dropped_label_sets",
+    "Requests recorded against the overflow route because the label set limit was reached",
 )
 
-REQUEST_TIME = Summary(
-    "request_processing_seconds",
-    "Time spent processing request",
-    ["method", "endpoint"],
+
+class LabelSetLimiter:
+    """
+    Bounds the number of distinct (method, route, status) label sets used for the
+    request metrics. Once `max_label_sets` have been seen any new combination is
+    recorded against the `<overflow>` route and counted in DROPPED_LABEL_SETS.
+    """
+
+    def __init__(self, max_label_sets: int) -> None:
+        self.max_label_sets = max_label_sets
+        self._seen: set[tuple[str, str, str]] = set()
+        self._lock = threading.Lock()
+
+    def limit(self, method: str, route: str, status: str) -> tuple[str, str, str]:
+        label_set = (method, route, status)
+        if label_set in self._seen:
+            return label_set
+        with self._lock:
+            if len(self._seen) < self.max_label_sets:
+                self._seen.add(label_set)
+                return label_set
+        DROPPED_LABEL_SETS.inc()
+        # Methods and status codes are bounded so the overflow buckets are too
+        return method, OVERFLOW_ROUTE, status
+
+
+class RequestMeasurement(NamedTuple):
+    method: str
+    route: Optional[str]
+    status_code: int
+    # Until the last body message was sent
+    latency: float
+    # Until the response headers were sent
+    ttfb: Optional[float] = None
+    # Body bytes actually sent
+    response_size: Optional[int] = None
+    phases: Optional[dict[str, float]] = None
+    request_id: Optional[str] = None
+
+
+class RequestRecorder:
+    """
+    Turns the single measurement taken for each request into every configured request
+    metric. Which metrics exist is chosen by METRICS_REQUEST_RECORDERS:
+
+    * `histogram`: fastapi_request_latency_seconds, bucketed by METRICS_LATENCY_BUCKETS.
+      Observations of at least METRICS_EXEMPLAR_MIN_SECONDS carry the request ID as an
+      exemplar, shown on /metrics in the OpenMetrics format
+    * `counter`: fastapi_request_count_total
+    * `summary`: request_processing_seconds
+    * `ttfb`: fastapi_request_ttfb_seconds, bucketed by METRICS_LATENCY_BUCKETS
+    * `response_size`: fastapi_response_size_bytes, bucketed by METRICS_SIZE_BUCKETS
+    * `quantiles`: fastapi_request_latency_quantile_seconds, the METRICS_QUANTILES of
+      each route's latency over the last METRICS_QUANTILE_WINDOW_SECONDS
+
+    Phases reported through `timed_phase` are always recorded in
+    fastapi_request_phase_seconds.
+    """
+
+    def __init__(
+        self,
+        recorders: Collection[str],
+        buckets: Sequence[float],
+        size_buckets: Sequence[float],
+        max_label_sets: int,
+        registry: CollectorRegistry = REGISTRY,
+        quantiles: Sequence[float] = (0.5, 0.9, 0.99, 0.999),
+        quantile_window: float = 300.0,
+        quantile_subwindows: int = 5,
+        quantile_relative_accuracy: float = 0.01,
+        exemplar_min_latency: Optional[float] = None,
+    ) -> None:
+        self.exemplar_min_latency = exemplar_min_latency
+        self.latency: Optional[Histogram] = None
+        self.count: Optional[Counter] = None
+        self.processing_time: Optional[Summary] = None
+        self.ttfb: Optional[Histogram] = None
+        self.response_size: Optional[Histogram] = None
+        self.latency_quantiles: Optional[LatencyQuantiles] = None
+        if "histogram" in recorders:
+            self.latency = Histogram(
+                "fastapi_request_latency_seconds",
+                "FastAPI Request Latency",
+                ["method", "url"],
+                buckets=buckets,
+                registry=registry,
+            )
+        if "counter" in recorders:
+            self.count = Counter(
+                "fastapi_request_count",
+                "FastAPI Request Count",
+                ["method", "url", "http_status"],
+                registry=registry,
+            )
+        if "summary" in recorders:
+            self.processing_time = Summary(
+                "request_processing_seconds",
+                "Time spent processing request",
+                ["method", "endpoint"],
+                registry=registry,
+            )
+        if "ttfb" in recorders:
+            self.ttfb = Histogram(
+                "fastapi_request_ttfb_seconds",
+                "Time until the response headers were sent",
+                ["method", "route"],
+                buckets=buckets,
+                registry=registry,
+            )
+        if "response_size" in recorders:
+            self.response_size = Histogram(
+                "fastapi_response_size_bytes",
+                "Response body bytes sent",
+                ["method", "route"],
+                buckets=size_buckets,
+                registry=registry,
+            )
+        if "quantiles" in recorders:
+            self.latency_quantiles = LatencyQuantiles(
+                window_seconds=quantile_window,
+                subwindows=quantile_subwindows,
+                relative_accuracy=quantile_relative_accuracy,
+            )
+            registry.register(
+                LatencyQuantilesCollector(self.latency_quantiles, quantiles)
+            )
+        self.phase_latency = Histogram(
+            "fastapi_request_phase_seconds",
+            "Time spent in each phase of handling a request",
+            ["route", "phase"],
+            buckets=buckets,
+            registry=registry,
+        )
+        self.label_set_limiter = LabelSetLimiter(max_label_sets)
+        self._bound: dict[tuple[str, Optional[str], int], BoundRequestMetrics] = {}
+
+    def bound_metrics(
+        self, method: str, route: Optional[str], status_code: int
+    ) -> "BoundRequestMetrics":
+        """
+        Return the metric children for a label set, binding them on first use so that
+        recording a request needs neither `.labels()` calls nor label strings.
+        """
+        key = (_method_label(method), route, status_code)
+        bound = self._bound.get(key)
+        if bound is not None:
+            return bound
+        method_label, route_label, status = self.label_set_limiter.limit(
+            key[0], route or UNMATCHED_ROUTE, str(status_code)
+        )
+        if route_label == OVERFLOW_ROUTE:
+            # Not cached by the original key, which would make the cache unbounded
+            overflow_key = (method_label, OVERFLOW_ROUTE, status_code)
+            bound = self._bound.get(overflow_key)
+            if bound is None:
+                bound = self._bound[overflow_key] = BoundRequestMetrics(
+                    self, method_label, route_label, status
+                )
+            return bound
+        bound = self._bound[key] = BoundRequestMetrics(
+            self, method_label, route_label, status
+        )
+        return bound
+
+    def record(self, measurement: RequestMeasurement) -> None:
+        bound = self.bound_metrics(
+            measurement.method, measurement.route, measurement.status_code
+        )
+        latency = measurement.latency
+        if bound.latency is not None:
+            bound.latency.observe(latency, self._exemplar(measurement))
+        if bound.count is not None:
+            bound.count.inc()
+        if bound.processing_time is not None:
+            bound.processing_time.observe(latency)
+        if bound.ttfb is not None and measurement.ttfb is not None:
+            bound.ttfb.observe(measurement.ttfb)
+        if bound.response_size is not None and measurement.response_size is not None:
+            bound.response_size.observe(measurement.response_size)
+        if self.latency_quantiles is not None:
+            self.latency_quantiles.add(bound.route, latency)
+        if measurement.phases:
+            for phase, duration in measurement.phases.items():
+                bound.phase(phase).observe(duration)
+
+    def _exemplar(self, measurement: RequestMeasurement) -> Optional[dict[str, str]]:
+        if (
+            self.exemplar_min_latency is None
+            or measurement.latency < self.exemplar_min_latency
+            or not measurement.request_id
+            # OpenMetrics limits exemplar labels to 128 characters
+            or len(measurement.request_id) > 64
+        ):
+            return None
+        return {"request_id": measurement.request_id}
+
+
+class BoundRequestMetrics:
+    """The request metric children of one (method, route, status) label set."""
+
+    __slots__ = (
+        "route",
+        "latency",
+        "count",
+        "processing_time",
+        "ttfb",
+        "response_size",
+        "_phase_latency",
+        "_phases",
+    )
+
+    def __init__(
+        self, recorder: RequestRecorder, method: str, route: str, status: str
+    ) -> None:
+        self.route = route
+        self.latency = (
+            recorder.latency.labels(method, route)
+            if recorder.latency is not None
+            else None
+        )
+        self.count = (
+            recorder.count.labels(method, route, status)
+            if recorder.count is not None
+            else None
+        )
+        self.processing_time = (
+            recorder.processing_time.labels(method, route)
+            if recorder.processing_time is not None
+            else None
+        )
+        self.ttfb = (
+            recorder.ttfb.labels(method, route) if recorder.ttfb is not None else None
+        )
+        self.response_size = (
+            recorder.response_size.labels(method, route)
+            if recorder.response_size is not None
+            else None
+        )
+        self._phase_latency = recorder.phase_latency
+        self._phases: dict[str, Histogram] = {}
+
+    def phase(self, phase: str) -> Histogram:
+        child = self._phases.get(phase)
+        if child is None:
+            child = self._phases[phase] = self._phase_latency.labels(self.route, phase)
+        return child
+
+
+request_recorder = RequestRecorder(
+    recorders=metrics_settings.METRICS_REQUEST_RECORDERS,
+    buckets=metrics_settings.METRICS_LATENCY_BUCKETS,
+    size_buckets=metrics_settings.METRICS_SIZE_BUCKETS,
+    max_label_sets=metrics_settings.METRICS_MAX_LABEL_SETS,
+    quantiles=metrics_settings.METRICS_QUANTILES,
+    quantile_window=metrics_settings.METRICS_QUANTILE_WINDOW_SECONDS,
+    quantile_subwindows=metrics_settings.METRICS_QUANTILE_SUBWINDOWS,
+    quantile_relative_accuracy=metrics_settings.METRICS_QUANTILE_RELATIVE_ACCURACY,
+    # Exemplars are not supported in multiprocess mode
+    exemplar_min_latency=(
+        metrics_settings.METRICS_EXEMPLAR_MIN_SECONDS
+        if metrics_settings.METRICS_EXEMPLARS_ENABLED
+        and not multiprocess.is_multiprocess_mode()
+        else None
+    ),
+)
+metrics_exposition = CachedExposition(
+    max_age=metrics_settings.METRICS_EXPOSITION_CACHE_SECONDS
 )
 
+REQUEST_LATENCY = request_recorder.latency
+REQUEST_COUNT = request_recorder.count
+REQUEST_TIME = request_recorder.processing_time
+
+
+def _method_label(method: str) -> str:
+    return method if method in KNOWN_METHODS else OTHER_METHOD
+
 
 class NoMetrics:
     def __init__(self, request: Request) -> None:
@@ -31,14 +343,98 @@ def set_no_metrics(request: Request) -> None:
     request.state.enable_metrics = False
 
 
-class MetricsMiddleware(BaseHTTPMiddleware):
-    async def dispatch(
-        self, request: Request, call_next: RequestResponseEndpoint
-    ) -> Response:
-        start_time = time.time()
-        request.state.enable_metrics = True
-        response = await call_next(request)
-        return after_request(start_time, request, response)
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware that records request metrics and writes the access log.
+
+    Latency is measured from receipt of the request until the final body message has
+    been sent, so streamed responses are timed to completion. Requests whose client
+    disconnected early are recorded when the app returns, with the status sent so far,
+    or 499 if the response had not started. Unlike a
+    `BaseHTTPMiddleware` no extra task or memory stream is placed between the server
+    and the app, which keeps per-request overhead low and preserves back-pressure on
+    streamed responses.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        state = scope.setdefault("state", {})
+        state["enable_metrics"] = True
+        get_matched_route(scope)
+        if metrics_settings.REQUEST_QUEUE_TIME_ENABLED:
+            state["queue_seconds"] = queue_time_reader.queue_time(scope)
+            if state["queue_seconds"] is not None:
+                REQUEST_QUEUE_TIME.observe(state["queue_seconds"])
+        timer, timer_token = start_request_timer()
+        running_request = slow_request_watchdog.begin(scope)
+        status_code = CLIENT_CLOSED_REQUEST
+        response_complete = False
+        ttfb: Optional[float] = None
+        response_size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, response_complete, ttfb, response_size
+            if message["type"] == "http.response.start":
+                ttfb = time.perf_counter() - start_time
+                timer.add("app", ttfb)
+                status_code = message["status"]
+                response_headers = MutableHeaders(scope=message)
+                _add_no_cache_headers(response_headers)
+                if metrics_settings.SERVER_TIMING_ENABLED:
+                    response_headers.append("Server-Timing", timer.server_timing())
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    await send(message)
+                    response_complete = True
+                    record_request(
+                        scope,
+                        start_time,
+                        status_code,
+                        timer=timer,
+                        ttfb=ttfb,
+                        response_size=response_size,
+                    )
+                    return
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            # ServerErrorMiddleware will turn this into a 500 response.
+            status_code = 500
+            raise
+        finally:
+            # Also when the client disconnected part way through a streamed response,
+            # which Starlette handles by returning early
+            if not response_complete:
+                record_request(
+                    scope,
+                    start_time,
+                    status_code,
+                    timer=timer,
+                    ttfb=ttfb,
+                    response_size=response_size if ttfb is not None else None,
+                )
+            stop_request_timer(timer_token)
+            if running_request is not None:
+                slow_request_watchdog.end(running_request)
+
+
+def _add_no_cache_headers(headers: MutableHeaders) -> None:
+    if not headers.get("Cache-Control"):
+        headers["Cache-Control"] = "no-cache, must-revalidate"
+    if not headers.get("Pragma"):
+        headers["Pragma"] = "no-cache"
+    if not headers.get("Expires"):
+        headers["Expires"] = "0"
 
 
 def add_no_cache_headers(response: Response) -> Response:
@@ -46,75 +442,107 @@ def add_no_cache_headers(response: Response) -> Response:
     Add headers to both force IE to not cache response
     Only add header if not already set
     """
-    if not response.headers.get("Cache-Control"):
-        response.headers["Cache-Control"] = "no-cache, must-revalidate"
-    if not response.headers.get("Pragma"):
-        response.headers["Pragma"] = "no-cache"
-    if not response.headers.get("Expires"):
-        response.headers["Expires"] = "0"
+    _add_no_cache_headers(response.headers)
     return response
 
 
 def after_request(start_time: float, request: Request, response: Response) -> Response:
+    """
+    Add the no-cache headers and record the metrics and access log of a completed
+    request, with `start_time` from `time.time()`. Kept for apps calling it from their
+    own middleware: `MetricsMiddleware` calls `record_request` instead.
+    """
     response = add_no_cache_headers(response)
+    request_latency = time.time() - start_time
+    get_matched_route(request.scope)
+    content_length = response.headers.get("content-length")
+    record_request(
+        request.scope,
+        time.perf_counter() - request_latency,
+        response.status_code,
+        response_size=int(content_length) if content_length is not None else None,
+    )
+    return response
+
 
+def record_request(
+    scope: Scope,
+    start_time: float,
+    status_code: int,
+    *,
+    timer: Optional[RequestTimer] = None,
+    ttfb: Optional[float] = None,
+    response_size: Optional[int] = None,
+) -> None:
+    """
+    Record the metrics and access log of a completed request. Works directly on the
+    ASGI scope so that nothing is built for the request beyond the measurement.
+    """
+    state = scope.get("state", {})
     # Skip logging and metrics for app monitoring probes
-    if not request.state.enable_metrics:
-        return response
+    if not state.get("enable_metrics"):
+        return
 
-    request_latency: float = time.time() - start_time
-    endpoint = request.base_url
-    REQUEST_LATENCY.labels(request.method, endpoint).observe(request_latency)
-    REQUEST_COUNT.labels(request.method, endpoint, response.status_code).inc()
-    REQUEST_TIME.labels(request.method, endpoint).observe(request_latency)
+    request_latency: float = time.perf_counter() - start_time
+    request_recorder.record(
+        RequestMeasurement(
+            method=scope["method"],
+            route=state.get("route_template"),
+            status_code=status_code,
+            latency=request_latency,
+            ttfb=ttfb,
+            response_size=response_size,
+            phases=timer.phases if timer is not None else None,
+            request_id=current_request_id(),
+        )
+    )
 
-    content_length = response.headers.get("content-length")
+    if metrics_settings.HEAVY_HITTERS_ENABLED:
+        heavy_hitters.record(scope)
 
-    request_details = {
-        "status": response.status_code,
-        "requestUrl": str(request.url),
-        "requestMethod": request.method,
-        "remoteIp": request.client.host if request.client else None,
-        "responseSize": content_length,
-        "userAgent": str(request.headers.get("User-Agent", None)),
-        "latency": f"{request_latency:.4f}s",
-    }
-    additional_details = {
-        "requestXHeaders": {
-            k: v for k, v in request.headers.items() if k.lower().startswith("x-")
-        },
-        "requestQueryParams": dict(request.query_params or {}),
-        "requestPathParams": dict(request.path_params or {}),
-    }
-    additional_details = {k: v for k, v in additional_details.items() if v}
-    additional_detail_keys = {item for v in additional_details.values() for item in v}
-    logger.info(
-        '%s "%s" %s',
-        request.method,
-        request.url,
-        response.status_code,
-        extra={"httpRequest": request_details},
-    )
-    if additional_detail_keys:
-        logger.debug(
-            "Request has additional details %s",
-            ", ".join(additional_detail_keys),
-            extra={"httpRequest": additional_details},
+    # Set by the route_slo dependency
+    slos = state.get("slos")
+    if slos:
+        slo_tracker.record(
+            state.get("route_template"), slos, status_code, request_latency
         )
-    return response
+
+    log_request(scope, status_code, request_latency, response_size)
 
 
 def init_metrics(app: FastAPI) -> None:
-    Instrumentator().instrument(app)
+    if metrics_settings.METRICS_INSTRUMENTATOR_ENABLED:
+        # Records its own http_* metrics in an additional middleware layer
+        Instrumentator().instrument(app)
     app.add_middleware(MetricsMiddleware)
 
+    if metrics_settings.RUNTIME_METRICS_ENABLED:
+        init_runtime_metrics()
+
+    # Write out any queued access log records
+    app.add_event_handler("shutdown", access_log_queue.close)
+
+    if slow_request_watchdog.threshold is not None:
+        app.add_event_handler("startup", slow_request_watchdog.start)
+        app.add_event_handler("shutdown", slow_request_watchdog.stop)
+
+    if multiprocess.is_multiprocess_mode():
+        app.add_event_handler("startup", multiprocess.cleanup_dead_processes)
+        app.add_event_handler(
+            "shutdown", lambda: multiprocess.mark_process_dead(os.getpid())
+        )
+        logger.debug(
+            "Prometheus multiprocess mode using %s", multiprocess.multiprocess_dir()
+        )
+
     @app.get(
         "/metrics",
         response_class=PlainTextResponse,
         dependencies=[Depends(set_no_metrics)],
         include_in_schema=False,
+        tags=["infra"],
     )
-    def get_metrics() -> bytes:
-        return generate_latest()
+    async def get_metrics(request: Request) -> Response:
+        return await metrics_exposition.response(request)
 
     logger.debug("Registered metrics route on /metrics")
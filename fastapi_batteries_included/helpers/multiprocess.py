@@ -0,0 +1,100 @@
+"""
+Support for prometheus_client multiprocess mode, used when the app runs in several
+uvicorn/gunicorn worker processes.
+
+Multiprocess mode is enabled by setting PROMETHEUS_MULTIPROC_DIR to an empty, writable
+directory before the app (and so prometheus_client) is imported. Each worker then
+writes its metric values to mmap-backed files in that directory and `/metrics`
+aggregates the files from every worker, whichever worker handles the scrape.
+
+Gauges must declare how values from different workers are combined, e.g.
+`Gauge(..., multiprocess_mode=GAUGE_LIVESUM)` for an in-flight request count.
+
+When running under gunicorn add the following to the gunicorn config file so the
+files of a worker that exits are cleaned up:
+
+    from fastapi_batteries_included.helpers.multiprocess import child_exit
+"""
+
+import glob
+import os
+import re
+from typing import Any, Optional
+
+from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
+from she_logging import logger
+
+# Gauge multiprocess modes, see prometheus_client.Gauge
+GAUGE_ALL = "all"
+GAUGE_LIVEALL = "liveall"
+GAUGE_LIVESUM = "livesum"
+GAUGE_MAX = "max"
+GAUGE_MIN = "min"
+
+_LIVE_GAUGE_FILE = re.compile(r"gauge_live(?:all|sum)_(\d+)\.db$")
+
+
+def multiprocess_dir() -> Optional[str]:
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR") or None
+
+
+def is_multiprocess_mode() -> bool:
+    return multiprocess_dir() is not None
+
+
+def exposition_registry() -> CollectorRegistry:
+    """
+    The registry to expose on `/metrics`: one that aggregates every worker's metric
+    files in multiprocess mode, otherwise the default registry of this process.
+    """
+    if not is_multiprocess_mode():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to someone else
+        return True
+    return True
+
+
+def mark_process_dead(pid: int) -> None:
+    """Remove the live gauge values of a worker that has exited."""
+    if is_multiprocess_mode():
+        multiprocess.mark_process_dead(pid)
+
+
+def cleanup_dead_processes() -> list[int]:
+    """
+    Remove the live gauge files left behind by workers that are no longer running,
+    e.g. after a worker was killed without the `child_exit` hook running. Counter and
+    histogram files are kept so totals never go backwards.
+
+    :return: the pids that were cleaned up
+    """
+    path = multiprocess_dir()
+    if path is None:
+        return []
+
+    dead_pids: set[int] = set()
+    for filename in glob.glob(os.path.join(path, "gauge_live*.db")):
+        match = _LIVE_GAUGE_FILE.search(filename)
+        if match and not _pid_alive(int(match.group(1))):
+            dead_pids.add(int(match.group(1)))
+
+    for pid in sorted(dead_pids):
+        logger.debug("Removing multiprocess metrics for dead worker %d", pid)
+        multiprocess.mark_process_dead(pid, path)
+    return sorted(dead_pids)
+
+
+def child_exit(server: Any, worker: Any) -> None:
+    """gunicorn server hook, called in the master process when a worker exits."""
+    mark_process_dead(worker.pid)
@@ -0,0 +1,135 @@
+"""
+Statistical stack sampling profiler.
+
+`StackSampler` runs a background thread that periodically records the stack of every
+other thread in the process. The result is returned in the "collapsed stack" format
+(`frame;frame;frame count` per line) read by flamegraph.pl, speedscope and similar tools.
+
+`ProfilingMiddleware` profiles a single request when it carries the PROFILE_REQUEST_HEADER
+header and the caller is allowed to use debug endpoints. The response is replaced by the
+profile, sent as an attachment, with the original status in the X-Profiled-Status header.
+"""
+
+import asyncio
+import sys
+import threading
+from collections import Counter
+from types import FrameType
+from typing import Callable, Optional
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+PROFILE_REQUEST_HEADER = "X-Profile-Request"
+PROFILE_MEDIA_TYPE = "text/plain; charset=utf-8"
+
+
+def _collapse(thread_name: str, frame: Optional[FrameType]) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    frames.append(thread_name)
+    return ";".join(reversed(frames))
+
+
+class StackSampler:
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                thread_name = thread_names.get(thread_id, str(thread_id))
+                self.samples[_collapse(thread_name, frame)] += 1
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in sorted(self.samples.items())
+        )
+
+
+async def profile(seconds: float, interval: float) -> str:
+    """Sample every thread in this worker for `seconds` and return collapsed stacks."""
+    sampler = StackSampler(interval)
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        sampler.stop()
+    return sampler.collapsed()
+
+
+class ProfilingMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        interval: float,
+        access_allowed: Callable[[Headers], bool],
+    ) -> None:
+        self.app = app
+        self.interval = interval
+        self.access_allowed = access_allowed
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        if PROFILE_REQUEST_HEADER not in headers or not self.access_allowed(headers):
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def discard_response(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+        sampler = StackSampler(self.interval)
+        sampler.start()
+        try:
+            await self.app(scope, receive, discard_response)
+        finally:
+            sampler.stop()
+
+        body = sampler.collapsed().encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", PROFILE_MEDIA_TYPE.encode()),
+                    (b"content-length", str(len(body)).encode()),
+                    (
+                        b"content-disposition",
+                        b'attachment; filename="request-profile.folded"',
+                    ),
+                    (b"x-profiled-status", str(status_code).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
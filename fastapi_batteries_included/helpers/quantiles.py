@@ -0,0 +1,168 @@
+"""
+Per-route latency quantiles.
+
+Latencies are kept in `LogBucketSketch`es: values are counted in logarithmically sized
+buckets, so every quantile is estimated to within a fixed relative error (1% by
+default) whatever the latency, using a few hundred buckets at most. Sketches of the same
+accuracy can be merged exactly by adding their bucket counts.
+
+`WindowedSketch` keeps one sketch per sub-window and merges the sub-windows of the last
+METRICS_QUANTILE_WINDOW_SECONDS when queried, so quantiles follow current latency. The
+quantiles of every route are exposed in `fastapi_request_latency_quantile_seconds` and
+by `/debug/latency-quantiles`.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterator, NamedTuple, Optional, Sequence
+
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# Latencies below this are counted as zero
+MIN_VALUE = 1e-9
+
+
+class LogBucketSketch:
+    def __init__(self, relative_accuracy: float) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        if value < MIN_VALUE:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other: "LogBucketSketch") -> None:
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # The value within relative_accuracy of every value in the bucket
+                return 2 * self.gamma**index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class WindowedSketch:
+    def __init__(
+        self,
+        window_seconds: float,
+        subwindows: int,
+        relative_accuracy: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.subwindow_seconds = window_seconds / subwindows
+        self.subwindows = subwindows
+        self.relative_accuracy = relative_accuracy
+        self.clock = clock
+        # (subwindow number, sketch), oldest first
+        self._sketches: deque[tuple[int, LogBucketSketch]] = deque(maxlen=subwindows)
+        self._lock = threading.Lock()
+
+    def _subwindow(self) -> int:
+        return int(self.clock() // self.subwindow_seconds)
+
+    def add(self, value: float) -> None:
+        subwindow = self._subwindow()
+        with self._lock:
+            if not self._sketches or self._sketches[-1][0] != subwindow:
+                self._sketches.append(
+                    (subwindow, LogBucketSketch(self.relative_accuracy))
+                )
+            self._sketches[-1][1].add(value)
+
+    def merged(self) -> LogBucketSketch:
+        oldest = self._subwindow() - self.subwindows + 1
+        merged = LogBucketSketch(self.relative_accuracy)
+        with self._lock:
+            for subwindow, sketch in self._sketches:
+                if subwindow >= oldest:
+                    merged.merge(sketch)
+        return merged
+
+
+class RouteLatency(NamedTuple):
+    samples: int
+    sum: float
+    quantiles: dict[str, Optional[float]]
+
+
+class LatencyQuantiles:
+    """The `WindowedSketch` of each route, created on first use."""
+
+    def __init__(
+        self, window_seconds: float, subwindows: int, relative_accuracy: float
+    ) -> None:
+        self.window_seconds = window_seconds
+        self.subwindows = subwindows
+        self.relative_accuracy = relative_accuracy
+        self._sketches: dict[str, WindowedSketch] = {}
+
+    def add(self, route: str, latency: float) -> None:
+        sketch = self._sketches.get(route)
+        if sketch is None:
+            sketch = self._sketches.setdefault(
+                route,
+                WindowedSketch(
+                    self.window_seconds, self.subwindows, self.relative_accuracy
+                ),
+            )
+        sketch.add(latency)
+
+    def snapshot(self, quantiles: Sequence[float]) -> dict[str, RouteLatency]:
+        snapshot = {}
+        for route, windowed in list(self._sketches.items()):
+            sketch = windowed.merged()
+            if sketch.count == 0:
+                continue
+            snapshot[route] = RouteLatency(
+                samples=sketch.count,
+                sum=sketch.sum,
+                quantiles={str(q): sketch.quantile(q) for q in quantiles},
+            )
+        return snapshot
+
+
+class LatencyQuantilesCollector(Collector):
+    def __init__(
+        self, latency_quantiles: LatencyQuantiles, quantiles: Sequence[float]
+    ) -> None:
+        self.latency_quantiles = latency_quantiles
+        self.quantiles = quantiles
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        family = GaugeMetricFamily(
+            "fastapi_request_latency_quantile_seconds",
+            "Request latency quantiles over the recent window",
+            labels=["route", "quantile"],
+        )
+        for route, latency in self.latency_quantiles.snapshot(self.quantiles).items():
+            for q, value in latency.quantiles.items():
+                if value is not None:
+                    family.add_metric([route, q], value)
+        yield family
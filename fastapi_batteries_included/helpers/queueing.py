@@ -0,0 +1,69 @@
+"""
+Request queueing time.
+
+Load balancers and proxies can add a header with the time they received the request,
+such as nginx's `proxy_set_header X-Request-Start "t=${msec}"`. The difference between
+that time and the time the app starts on the request is time spent queued in front of
+the app (in the proxy, the listen backlog and the server), which grows first when the
+service is overloaded. Clocks must be synchronised for the numbers to be meaningful.
+
+With REQUEST_QUEUE_TIME_ENABLED the queueing time is recorded in
+`fastapi_request_queue_seconds`, and requests that waited for longer than
+LOAD_SHEDDING_MAX_QUEUE_SECONDS can be rejected by load shedding.
+"""
+
+import time
+from typing import Optional, Sequence
+
+from prometheus_client import Histogram
+from starlette.types import Scope
+
+from fastapi_batteries_included import config
+
+metrics_settings = config.MetricsSettings()
+
+REQUEST_QUEUE_TIME = Histogram(
+    "fastapi_request_queue_seconds",
+    "Time between the proxy receiving the request and the app starting on it",
+    buckets=metrics_settings.METRICS_LATENCY_BUCKETS,
+)
+
+
+def parse_request_start(value: str) -> Optional[float]:
+    """
+    Parse an X-Request-Start style header (`t=1660000000.123`, `t=1660000000123` or
+    `1660000000123456`) into a Unix timestamp in seconds.
+    """
+    parts = value.split()
+    if not parts:
+        return None
+    token = parts[0]
+    if token.startswith("t="):
+        token = token[2:]
+    try:
+        timestamp = float(token)
+    except ValueError:
+        return None
+    # Proxies send seconds (nginx), milliseconds (Heroku) or microseconds (Apache)
+    if timestamp > 1e14:
+        return timestamp / 1e6
+    if timestamp > 1e11:
+        return timestamp / 1e3
+    return timestamp
+
+
+class QueueTimeReader:
+    def __init__(self, headers: Sequence[str]) -> None:
+        self.header_names = frozenset(h.lower().encode("latin-1") for h in headers)
+
+    def queue_time(self, scope: Scope, now: Optional[float] = None) -> Optional[float]:
+        for name, value in scope.get("headers", []):
+            if name in self.header_names:
+                start = parse_request_start(value.decode("latin-1"))
+                if start is not None:
+                    # Allow for small clock differences
+                    return max(0.0, (now or time.time()) - start)
+        return None
+
+
+queue_time_reader = QueueTimeReader(metrics_settings.REQUEST_QUEUE_TIME_HEADERS)
@@ -1,8 +1,13 @@
 from datetime import datetime, timezone
-from typing import Callable
+from typing import Callable, Optional, Sequence
 
 from fastapi import Request, Response
 from she_logging import logger
+from starlette.routing import BaseRoute, Match, Mount
+from starlette.types import Scope
+
+# Route label of requests that matched no route
+UNMATCHED_ROUTE = "<unmatched>"
 
 
 def deprecated_route(
@@ -52,3 +57,53 @@ def deprecated_route(
             response.headers["Link"] = link
 
     return deprecation_dependency
+
+
+def get_route_template(scope: Scope) -> Optional[str]:
+    """
+    Return the path template (e.g. `/patient/{patient_id}`) of the route that will
+    handle the request, or None if no route matches.
+
+    This must be called before the request is routed: routing through a `Mount`
+    rewrites the path held in the scope.
+    """
+    return get_matched_route(scope)[0]
+
+
+def get_matched_route(scope: Scope) -> tuple[Optional[str], Optional[BaseRoute]]:
+    """
+    Return the path template and the route that will handle the request, or
+    (None, None) if no route matches. See `get_route_template`.
+
+    The routes are only matched once per request: the result is kept in the request
+    state, as `route_template` and `matched_route`, for the other middleware.
+    """
+    state = scope.setdefault("state", {})
+    if "matched_route" in state:
+        return state["route_template"], state["matched_route"]
+
+    router = getattr(scope.get("app"), "router", None)
+    matched = None
+    if router is not None:
+        matched = _match_route(router.routes, scope, prefix="")
+    state["route_template"], state["matched_route"] = matched or (None, None)
+    return state["route_template"], state["matched_route"]
+
+
+def _match_route(
+    routes: Sequence[BaseRoute], scope: Scope, prefix: str
+) -> Optional[tuple[str, BaseRoute]]:
+    partial: Optional[tuple[str, BaseRoute]] = None
+    for route in routes:
+        match, child_scope = route.matches(scope)
+        path = prefix + getattr(route, "path", "")
+        if match == Match.FULL:
+            if isinstance(route, Mount) and route.routes:
+                return _match_route(
+                    route.routes, {**scope, **child_scope}, prefix=path
+                ) or (path, route)
+            return path, route
+        if match == Match.PARTIAL and partial is None:
+            # Path matches but the method doesn't: the app will return a 405
+            partial = path, route
+    return partial
@@ -0,0 +1,180 @@
+"""
+Python runtime metrics and heap snapshots.
+
+prometheus_client already reports the process RSS (`process_resident_memory_bytes`) and
+the number of collections and collected objects of each garbage collector generation.
+`init_runtime_metrics` adds what it leaves out:
+
+* `python_gc_pause_seconds`: how long each collection stopped the process, by generation
+* `python_gc_generation_count` and `python_gc_generation_threshold`: the garbage
+  collector's counter of each generation, and the value at which it collects the
+  generation
+* `python_allocated_blocks`: memory blocks currently allocated by the interpreter, which
+  grows with the number of live objects
+
+The last three are reported by a collector of this worker, and are not included in
+`/metrics` in Prometheus multiprocess mode. They are read in constant time: counting the
+objects in each generation would walk the whole heap, holding the GIL, on every scrape.
+
+`HeapSnapshots` drives `tracemalloc` for the `/debug/tracemalloc` endpoints, which find
+where memory is allocated and what grew between two snapshots.
+"""
+
+import gc
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from typing import Any, Iterator, NamedTuple, Optional
+
+from prometheus_client import REGISTRY, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+GC_PAUSE = Histogram(
+    "python_gc_pause_seconds",
+    "Time the garbage collector stopped the process for",
+    ["generation"],
+    buckets=[0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0],
+)
+
+
+class GcPauseTimer:
+    def __init__(self) -> None:
+        # The collector holds the GIL, so only one collection runs at a time
+        self._start: Optional[float] = None
+        self._pauses = {
+            str(generation): GC_PAUSE.labels(str(generation))
+            for generation in range(len(gc.get_count()))
+        }
+
+    def __call__(self, phase: str, info: dict[str, Any]) -> None:
+        if phase == "start":
+            self._start = time.perf_counter()
+        elif self._start is not None:
+            self._pauses[str(info["generation"])].observe(
+                time.perf_counter() - self._start
+            )
+            self._start = None
+
+
+class RuntimeCollector(Collector):
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        counts = GaugeMetricFamily(
+            "python_gc_generation_count",
+            "Garbage collector counter of each generation: allocations less "
+            "deallocations for generation 0, collections of the younger generation "
+            "for the others",
+            labels=["generation"],
+        )
+        thresholds = GaugeMetricFamily(
+            "python_gc_generation_threshold",
+            "Counter value at which the garbage collector collects each generation",
+            labels=["generation"],
+        )
+        for generation, (count, threshold) in enumerate(
+            zip(gc.get_count(), gc.get_threshold())
+        ):
+            counts.add_metric([str(generation)], count)
+            thresholds.add_metric([str(generation)], threshold)
+        yield counts
+        yield thresholds
+        yield GaugeMetricFamily(
+            "python_allocated_blocks",
+            "Memory blocks currently allocated by the interpreter",
+            value=sys.getallocatedblocks(),
+        )
+
+
+gc_pause_timer = GcPauseTimer()
+_runtime_collector = RuntimeCollector()
+_lock = threading.Lock()
+
+
+def init_runtime_metrics() -> None:
+    with _lock:
+        if gc_pause_timer not in gc.callbacks:
+            gc.callbacks.append(gc_pause_timer)
+            REGISTRY.register(_runtime_collector)
+
+
+class AllocationSite(NamedTuple):
+    location: str
+    size: int
+    allocations: int
+    size_diff: int = 0
+    allocations_diff: int = 0
+
+
+# Allocations made by the tracing machinery itself
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def _location(statistic: Any) -> str:
+    frame = statistic.traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+class HeapSnapshots:
+    """
+    The most recent `max_snapshots` tracemalloc snapshots, numbered in the order they
+    were taken.
+    """
+
+    def __init__(self, max_snapshots: int) -> None:
+        self.max_snapshots = max_snapshots
+        self._snapshots: OrderedDict[int, tracemalloc.Snapshot] = OrderedDict()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def start(frames: int) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+        with self._lock:
+            self._snapshots.clear()
+
+    def take(self) -> int:
+        """Take a snapshot and return its ID. Slow: call from a thread."""
+        if not tracemalloc.is_tracing():
+            raise ValueError("tracemalloc is not running")
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        with self._lock:
+            snapshot_id = self._next_id
+            self._next_id += 1
+            self._snapshots[snapshot_id] = snapshot
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        return snapshot_id
+
+    def _get(self, snapshot_id: int) -> tracemalloc.Snapshot:
+        with self._lock:
+            snapshot = self._snapshots.get(snapshot_id)
+        if snapshot is None:
+            raise KeyError(snapshot_id)
+        return snapshot
+
+    def top(self, snapshot_id: int, limit: int) -> list[AllocationSite]:
+        statistics = self._get(snapshot_id).statistics("lineno")
+        return [
+            AllocationSite(_location(stat), stat.size, stat.count)
+            for stat in statistics[:limit]
+        ]
+
+    def diff(self, base_id: int, snapshot_id: int, limit: int) -> list[AllocationSite]:
+        statistics = self._get(snapshot_id).compare_to(self._get(base_id), "lineno")
+        return [
+            AllocationSite(
+                _location(stat), stat.size, stat.count, stat.size_diff, stat.count_diff
+            )
+            for stat in statistics[:limit]
+        ]
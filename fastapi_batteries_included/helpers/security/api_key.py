@@ -1,18 +1,24 @@
 from typing import Optional
 
-from fastapi import HTTPException, Security
+from fastapi import HTTPException, Request, Security
 from fastapi.security import APIKeyHeader
 from starlette import status
 
 from fastapi_batteries_included import config
+from fastapi_batteries_included.helpers.heavy_hitters import (
+    API_KEY_STATE_KEY,
+    api_key_fingerprint,
+)
 
 api_key_header = APIKeyHeader(name="X-Api-Key", auto_error=False)
 
 api_key_settings = config.ApiKeySettings()
+metrics_settings = config.MetricsSettings()
 
 
 async def get_api_key(
     api_key: Optional[str] = Security(api_key_header),
+    request: Request = None,
 ) -> None:
     if api_key is None:
         raise HTTPException(
@@ -22,3 +28,6 @@ async def get_api_key(
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Invalid API key supplied"
         )
+    if metrics_settings.HEAVY_HITTERS_ENABLED and request is not None:
+        # Identifies the client in heavy hitter tracking
+        setattr(request.state, API_KEY_STATE_KEY, api_key_fingerprint(api_key))
@@ -6,6 +6,7 @@ from cachetools import TTLCache, cached
 from she_logging import logger
 
 from fastapi_batteries_included.helpers.security.jwt import jwt_settings
+from fastapi_batteries_included.helpers.timing import track_dependency
 
 
 class JwkCollection(TypedDict):
@@ -23,17 +24,24 @@ def fetch_auth_provider_jwks(key_id: str = "") -> dict:
 
     url = jwt_settings.AUTH_PROVIDER_JWKS_URL
     logger.debug("Fetching JWKS from %s", url)
-    with httpx.Client() as client:
-        fresh_jwks_resp = client.get(url)
-    if fresh_jwks_resp.status_code != 200:
-        logger.critical(f"Not able to retrieve Auth JWKS from %s", url)
-        raise EnvironmentError(f"Could not retrieve JWKs from {url}")
+    with track_dependency("jwks"):
+        with httpx.Client(timeout=jwt_settings.JWKS_FETCH_TIMEOUT_SECONDS) as client:
+            fresh_jwks_resp = client.get(url)
+        if fresh_jwks_resp.status_code != 200:
+            logger.critical(f"Not able to retrieve Auth JWKS from %s", url)
+            raise EnvironmentError(f"Could not retrieve JWKs from {url}")
     jwks: JwkCollection = fresh_jwks_resp.json()
 
     keys = {jwk["kid"]: jwk for jwk in jwks["keys"]}
     return keys
 
 
+def jwks_readiness_check() -> None:
+    """Readiness check that the JWKS is cached or can be fetched."""
+    if not fetch_auth_provider_jwks():
+        raise EnvironmentError("JWKS has no keys")
+
+
 def retrieve_auth_provider_jwk(key_id: str, testing: bool = False) -> Optional[dict]:
     if testing:
         jwks_str = jwt_settings.AUTH_PROVIDER_JWKS_TESTING
@@ -1,6 +1,6 @@
 from typing import Optional
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.openapi.models import HTTPBearer as HTTPBearerModel
 from fastapi.security import (
     HTTPAuthorizationCredentials,
@@ -14,8 +14,11 @@ from jose import jwt as jose_jwt
 from pydantic import BaseModel
 from she_logging import logger
 
+from fastapi_batteries_included import config
+from fastapi_batteries_included.helpers.heavy_hitters import USER_STATE_KEY
 from fastapi_batteries_included.helpers.security.jwt import TokenData, current_jwt_user
 from fastapi_batteries_included.helpers.security.jwt_parsers import get_jwt_parser
+from fastapi_batteries_included.helpers.timing import timed_phase
 
 
 class JWTBearer(OAuth2PasswordBearer):
@@ -36,6 +39,7 @@ class JWTBearer(OAuth2PasswordBearer):
 
 
 jwtbearer_scheme = JWTBearer()
+metrics_settings = config.MetricsSettings()
 
 
 class ValidatedUser(BaseModel):
@@ -46,11 +50,13 @@ class ValidatedUser(BaseModel):
 async def get_validated_jwt_token(
     security_scopes: SecurityScopes,
     jwt_token: str = Depends(jwtbearer_scheme),
+    request: Request = None,
 ) -> TokenData:
     try:
-        jwt_parser = get_jwt_parser(jwt_token)
-        unverified_header = jose_jwt.get_unverified_header(jwt_token)
-        token_data = jwt_parser.decode_jwt(jwt_token, unverified_header)
+        with timed_phase("auth"):
+            jwt_parser = get_jwt_parser(jwt_token)
+            unverified_header = jose_jwt.get_unverified_header(jwt_token)
+            token_data = jwt_parser.decode_jwt(jwt_token, unverified_header)
     except (
         ValueError,
         jose_jwt.ExpiredSignatureError,
@@ -69,6 +75,12 @@ async def get_validated_jwt_token(
             detail="Could not validate credentials",
         )
 
+    if metrics_settings.HEAVY_HITTERS_ENABLED and request is not None:
+        # Identifies the user in heavy hitter tracking
+        sub = token_data.claims.get("sub")
+        if isinstance(sub, str):
+            setattr(request.state, USER_STATE_KEY, sub)
+
     scopes: Optional[list[str]] = security_scopes.scopes
     if scopes:
         required_scopes = set(scopes)
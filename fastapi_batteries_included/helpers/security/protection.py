@@ -15,6 +15,7 @@ from fastapi_batteries_included.helpers.security.jwt_user import (
     get_validated_jwt_token,
     get_validated_user,
 )
+from fastapi_batteries_included.helpers.timing import timed_phase
 
 
 class _ProtectedRoute:
@@ -45,7 +46,8 @@ class _ProtectedRoute:
         env = ProtectedScopeEnvironment(
             scopes=token_data.scopes, claims=token_data.claims, request=request
         )
-        valid = await self.validation_function(env)
+        with timed_phase("authz"):
+            valid = await self.validation_function(env)
 
         if not valid:
             raise PermissionError(
@@ -60,7 +62,8 @@ class _ProtectedRouteDevelopment(_ProtectedRoute):
         env = ProtectedScopeEnvironment(
             scopes=token_data.scopes, claims=token_data.claims, request=request
         )
-        valid = await self.validation_function(env)
+        with timed_phase("authz"):
+            valid = await self.validation_function(env)
 
         if not valid and not jwt_settings.IGNORE_JWT_VALIDATION:
             raise PermissionError(
@@ -0,0 +1,219 @@
+"""
+Route service level objectives and error budget burn rates.
+
+SLOs are declared on routes with the `route_slo` dependency:
+
+    @router.get(
+        "/patient/{patient_id}",
+        dependencies=[Depends(route_slo(availability=0.999, latency=0.5))],
+    )
+
+Here 99.9% of requests must not fail with a 5xx response, and 99% (`latency_objective`)
+of the requests that don't must complete within 0.5 seconds. `MetricsMiddleware` counts
+every request to the route as a good or a bad event of each of its SLOs, in
+SLO_BUCKET_SECONDS buckets covering the longest of SLO_BURN_RATE_WINDOWS.
+
+The burn rate over a window is the fraction of bad events in the window divided by the
+error budget (1 - objective): at a burn rate of 1 the budget lasts exactly the SLO
+period, at 14.4 a 30 day budget is gone in 2 days. The burn rate of every SLO over each
+window is exposed in `fastapi_slo_burn_rate`, so multi-window burn rate alerts are a
+simple threshold rather than a query over raw histograms. Burn rates are per worker,
+and are not included in `/metrics` in Prometheus multiprocess mode.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterator, NamedTuple, Optional, Sequence
+
+from fastapi import Request
+from prometheus_client import REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from fastapi_batteries_included import config
+
+metrics_settings = config.MetricsSettings()
+
+SLO_AVAILABILITY = "availability"
+SLO_LATENCY = "latency"
+
+
+class SLO(NamedTuple):
+    name: str
+    objective: float
+    # Only for latency SLOs
+    latency_threshold: Optional[float] = None
+
+    def is_good(self, status_code: int, latency: float) -> Optional[bool]:
+        """Whether the request met the SLO, or None if it doesn't count towards it."""
+        if self.latency_threshold is None:
+            return status_code < 500
+        if status_code >= 500:
+            # Already counted by the availability SLO
+            return None
+        return latency <= self.latency_threshold
+
+
+def route_slo(
+    availability: Optional[float] = None,
+    latency: Optional[float] = None,
+    latency_objective: float = 0.99,
+) -> Callable:
+    """
+    Dependency to declare the SLOs of a route.
+
+    :param availability: fraction of requests that must not get a 5xx response
+    :param latency: seconds within which `latency_objective` of the requests that
+        did not get a 5xx response must complete
+
+    Put it before any dependency that can reject the request, such as authentication,
+    so that rejected requests are counted too.
+    """
+    slos = []
+    if availability is not None:
+        slos.append(SLO(SLO_AVAILABILITY, availability))
+    if latency is not None:
+        slos.append(SLO(SLO_LATENCY, latency_objective, latency_threshold=latency))
+    if not slos:
+        raise ValueError("route_slo needs an availability or latency objective")
+    for slo in slos:
+        if not 0 < slo.objective < 1:
+            raise ValueError(f"SLO objective must be between 0 and 1: {slo.objective}")
+    route_slos = tuple(slos)
+
+    def slo_dependency(request: Request) -> None:
+        request.state.slos = route_slos
+
+    return slo_dependency
+
+
+class RollingEventCounts:
+    """Good and bad event counts in fixed size time buckets, oldest first."""
+
+    def __init__(
+        self,
+        bucket_seconds: float,
+        max_window_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.bucket_seconds = bucket_seconds
+        self.clock = clock
+        max_buckets = max(1, int(-(-max_window_seconds // bucket_seconds)))
+        # [bucket number, good, bad]
+        self._buckets: deque[list[int]] = deque(maxlen=max_buckets)
+        self._lock = threading.Lock()
+
+    def _bucket(self) -> int:
+        return int(self.clock() // self.bucket_seconds)
+
+    def add(self, good: bool) -> None:
+        bucket = self._bucket()
+        with self._lock:
+            if not self._buckets or self._buckets[-1][0] != bucket:
+                self._buckets.append([bucket, 0, 0])
+            self._buckets[-1][1 if good else 2] += 1
+
+    def totals(self, window_seconds: float) -> tuple[int, int]:
+        """The good and bad events in the buckets overlapping the last window."""
+        oldest = self._bucket() - int(-(-window_seconds // self.bucket_seconds)) + 1
+        good = bad = 0
+        with self._lock:
+            for bucket, bucket_good, bucket_bad in self._buckets:
+                if bucket >= oldest:
+                    good += bucket_good
+                    bad += bucket_bad
+        return good, bad
+
+
+class SLOStatus(NamedTuple):
+    route: str
+    slo: str
+    objective: float
+    # By window label, None if there were no events in the window
+    burn_rates: dict[str, Optional[float]]
+
+
+def window_label(seconds: float) -> str:
+    """`300` -> `5m`, `21600` -> `6h`"""
+    seconds = int(seconds)
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds % size == 0:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
+
+
+class SLOTracker:
+    """The `RollingEventCounts` of each route SLO, created on first use."""
+
+    def __init__(
+        self,
+        windows: Sequence[float],
+        bucket_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.windows = sorted(windows)
+        self.bucket_seconds = bucket_seconds
+        self.clock = clock
+        self._counts: dict[tuple[str, SLO], RollingEventCounts] = {}
+
+    def record(
+        self, route: str, slos: Sequence[SLO], status_code: int, latency: float
+    ) -> None:
+        for slo in slos:
+            good = slo.is_good(status_code, latency)
+            if good is None:
+                continue
+            counts = self._counts.get((route, slo))
+            if counts is None:
+                counts = self._counts.setdefault(
+                    (route, slo),
+                    RollingEventCounts(
+                        self.bucket_seconds, self.windows[-1], clock=self.clock
+                    ),
+                )
+            counts.add(good)
+
+    def status(self) -> list[SLOStatus]:
+        statuses = []
+        for (route, slo), counts in list(self._counts.items()):
+            burn_rates: dict[str, Optional[float]] = {}
+            for window in self.windows:
+                good, bad = counts.totals(window)
+                total = good + bad
+                burn_rates[window_label(window)] = (
+                    (bad / total) / (1 - slo.objective) if total else None
+                )
+            statuses.append(SLOStatus(route, slo.name, slo.objective, burn_rates))
+        return statuses
+
+
+class SLOCollector(Collector):
+    def __init__(self, tracker: SLOTracker) -> None:
+        self.tracker = tracker
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        objective = GaugeMetricFamily(
+            "fastapi_slo_objective",
+            "Objective of the route SLO",
+            labels=["route", "slo"],
+        )
+        burn_rate = GaugeMetricFamily(
+            "fastapi_slo_burn_rate",
+            "Rate at which the route SLO error budget is being used over the window",
+            labels=["route", "slo", "window"],
+        )
+        for status in self.tracker.status():
+            objective.add_metric([status.route, status.slo], status.objective)
+            for window, rate in status.burn_rates.items():
+                if rate is not None:
+                    burn_rate.add_metric([status.route, status.slo, window], rate)
+        yield objective
+        yield burn_rate
+
+
+slo_tracker = SLOTracker(
+    windows=metrics_settings.SLO_BURN_RATE_WINDOWS,
+    bucket_seconds=metrics_settings.SLO_BUCKET_SECONDS,
+)
+REGISTRY.register(SLOCollector(slo_tracker))
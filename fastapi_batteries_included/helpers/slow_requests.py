@@ -0,0 +1,165 @@
+"""
+Slow request capture.
+
+With SLOW_REQUEST_CAPTURE_SECONDS set, `MetricsMiddleware` registers every request with
+`SlowRequestWatchdog` while it runs. A task on the event loop checks the running
+requests every half threshold, and the first time a request has been running for
+longer than the threshold it captures the stack of the request's task, showing what the
+request is waiting for at that moment. The stack is logged as a warning with the
+request ID, and the last SLOW_REQUEST_MAX_CAPTURED slow requests are kept for
+`/debug/slow-requests`. Requests excluded from metrics, such as `/debug/profile`, are
+never captured.
+
+A request blocking the event loop stops the watchdog too; the event loop monitor
+reports those.
+"""
+
+import asyncio
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, NamedTuple, Optional
+
+from prometheus_client import Counter
+from she_logging import logger
+from she_logging.request_id import current_request_id, reset_request_id, set_request_id
+from starlette.types import Scope
+
+from fastapi_batteries_included import config
+from fastapi_batteries_included.helpers.routes import UNMATCHED_ROUTE
+
+monitoring_settings = config.MonitoringSettings()
+
+SLOW_REQUESTS = Counter(
+    "fastapi_slow_requests",
+    "Requests still running after SLOW_REQUEST_CAPTURE_SECONDS",
+    ["route"],
+)
+
+
+class RunningRequest:
+    __slots__ = ("task", "start_time", "state", "method", "route", "path", "request_id")
+
+    def __init__(self, task: "asyncio.Task", scope: Scope) -> None:
+        self.task = task
+        self.start_time = time.monotonic()
+        self.state: dict[str, Any] = scope.get("state", {})
+        self.method: str = scope["method"]
+        self.route: Optional[str] = self.state.get("route_template")
+        self.path: str = scope["path"]
+        self.request_id = current_request_id()
+
+
+class SlowRequest(NamedTuple):
+    method: str
+    route: Optional[str]
+    path: str
+    request_id: Optional[str]
+    running_seconds: float
+    captured_at: str
+    stack: str
+
+
+def _format_task_stack(task: "asyncio.Task") -> str:
+    # Task.get_stack() only returns the outermost frame of a suspended task, so follow
+    # the chain of awaited coroutines down to where the task is waiting
+    frames = []
+    awaitable: Any = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(
+            awaitable, "gi_frame", None
+        )
+        if frame is None:
+            break
+        frames.append((frame, frame.f_lineno))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(
+            awaitable, "gi_yieldfrom", None
+        )
+    return "".join(traceback.StackSummary.extract(iter(frames)).format())
+
+
+class SlowRequestWatchdog:
+    def __init__(self, threshold: Optional[float], max_captured: int) -> None:
+        self.threshold = threshold
+        self.captured: deque[SlowRequest] = deque(maxlen=max_captured)
+        self._running: set[RunningRequest] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def begin(self, scope: Scope) -> Optional[RunningRequest]:
+        if self._task is None:
+            return None
+        task = asyncio.current_task()
+        if task is None:
+            return None
+        request = RunningRequest(task, scope)
+        self._running.add(request)
+        return request
+
+    def end(self, request: RunningRequest) -> None:
+        self._running.discard(request)
+
+    async def start(self) -> None:
+        if self.threshold is not None and self._task is None:
+            self._task = asyncio.create_task(self._watch(self.threshold))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._running.clear()
+
+    async def _watch(self, threshold: float) -> None:
+        while True:
+            await asyncio.sleep(threshold / 2)
+            self.check(threshold)
+
+    def check(self, threshold: float) -> None:
+        now = time.monotonic()
+        for request in list(self._running):
+            running_seconds = now - request.start_time
+            if running_seconds >= threshold and request.state.get("enable_metrics"):
+                # Capture each slow request once
+                self._running.discard(request)
+                self.capture(request, running_seconds)
+
+    def capture(self, request: RunningRequest, running_seconds: float) -> None:
+        slow_request = SlowRequest(
+            method=request.method,
+            route=request.route,
+            path=request.path,
+            request_id=request.request_id,
+            running_seconds=running_seconds,
+            captured_at=datetime.now(tz=timezone.utc).isoformat(),
+            stack=_format_task_stack(request.task),
+        )
+        self.captured.append(slow_request)
+        SLOW_REQUESTS.labels(request.route or UNMATCHED_ROUTE).inc()
+
+        # Log records pick up the request ID from a context variable
+        token = (
+            set_request_id(request.request_id)
+            if request.request_id is not None
+            else None
+        )
+        try:
+            logger.warning(
+                "Slow request %s %s still running after %.1fs, currently at:\n%s",
+                request.method,
+                request.route or request.path,
+                running_seconds,
+                slow_request.stack,
+            )
+        finally:
+            if token is not None:
+                reset_request_id(token)
+
+
+slow_request_watchdog = SlowRequestWatchdog(
+    threshold=monitoring_settings.SLOW_REQUEST_CAPTURE_SECONDS,
+    max_captured=monitoring_settings.SLOW_REQUEST_MAX_CAPTURED,
+)
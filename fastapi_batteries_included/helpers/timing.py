@@ -0,0 +1,169 @@
+"""
+Request-scoped phase timing.
+
+`MetricsMiddleware` gives every request a `RequestTimer`. Code handling the request
+reports how long each phase took with `timed_phase`:
+
+    with timed_phase("db"):
+        ...
+
+Time spent in phases of the same name is added up. The phases are recorded in the
+`fastapi_request_phase_seconds` histogram and, when SERVER_TIMING_ENABLED, sent to the
+client in a `Server-Timing` response header. `timed_phase` does nothing outside a request.
+
+Calls to other services are timed with `track_dependency`, as a context manager (sync or
+async) or as a decorator of sync or async functions:
+
+    @track_dependency("patient-api")
+    async def get_patient(patient_id: str) -> dict:
+        ...
+
+Each call is recorded in the `dependency_latency_seconds` histogram by dependency and
+outcome, inside or outside a request, and during a request also counts towards the
+request phase of the same name.
+"""
+
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from types import TracebackType
+from typing import Any, Callable, Iterator, Optional, TypeVar, cast
+
+from prometheus_client import Histogram
+
+from fastapi_batteries_included import config
+
+metrics_settings = config.MetricsSettings()
+
+OUTCOME_SUCCESS = "success"
+OUTCOME_ERROR = "error"
+
+DEPENDENCY_LATENCY = Histogram(
+    "dependency_latency_seconds",
+    "Time spent waiting for calls to other services",
+    ["dependency", "outcome"],
+    buckets=metrics_settings.METRICS_LATENCY_BUCKETS,
+)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class RequestTimer:
+    def __init__(self) -> None:
+        self.phases: dict[str, float] = {}
+
+    def add(self, phase: str, duration: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def server_timing(self) -> str:
+        return ", ".join(
+            f"{phase};dur={duration * 1000:.1f}"
+            for phase, duration in self.phases.items()
+        )
+
+
+_request_timer: ContextVar[Optional[RequestTimer]] = ContextVar(
+    "request_timer", default=None
+)
+
+
+def current_request_timer() -> Optional[RequestTimer]:
+    return _request_timer.get()
+
+
+def start_request_timer() -> tuple[RequestTimer, Token]:
+    timer = RequestTimer()
+    return timer, _request_timer.set(timer)
+
+
+def stop_request_timer(token: Token) -> None:
+    _request_timer.reset(token)
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    timer = _request_timer.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(phase, time.perf_counter() - start)
+
+
+def record_dependency_call(
+    dependency: str, duration: float, outcome: str, phase: Optional[str] = None
+) -> None:
+    DEPENDENCY_LATENCY.labels(dependency, outcome).observe(duration)
+    timer = _request_timer.get()
+    if timer is not None:
+        timer.add(phase or dependency, duration)
+
+
+class DependencyCall:
+    """Times one call to a dependency; see `track_dependency`."""
+
+    def __init__(self, dependency: str, phase: Optional[str] = None) -> None:
+        self.dependency = dependency
+        self.phase = phase
+        self._start: Optional[float] = None
+
+    def __enter__(self) -> "DependencyCall":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        assert self._start is not None
+        record_dependency_call(
+            self.dependency,
+            time.perf_counter() - self._start,
+            OUTCOME_SUCCESS if exc_type is None else OUTCOME_ERROR,
+            self.phase,
+        )
+
+    async def __aenter__(self) -> "DependencyCall":
+        return self.__enter__()
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.__exit__(exc_type, exc, traceback)
+
+    def __call__(self, func: F) -> F:
+        # Every call gets its own DependencyCall so that concurrent calls don't mix
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                async with DependencyCall(self.dependency, self.phase):
+                    return await func(*args, **kwargs)
+
+            return cast(F, async_wrapper)
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with DependencyCall(self.dependency, self.phase):
+                return func(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+
+def track_dependency(dependency: str, phase: Optional[str] = None) -> DependencyCall:
+    """
+    Record the latency and outcome (`success`, or `error` if an exception was raised)
+    of a call to `dependency`. During a request the time also counts towards the
+    request phase `phase`, which defaults to the dependency name.
+    """
+    return DependencyCall(dependency, phase)
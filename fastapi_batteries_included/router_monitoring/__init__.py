@@ -1,22 +1,34 @@
-from pathlib import Path
+from typing import Union
 
-from aiofile import async_open
-from fastapi import APIRouter, Depends, FastAPI
+from fastapi import APIRouter, Depends, FastAPI, Request, Response, status
 from pydantic import Field
 from pydantic.main import BaseModel
 
+from fastapi_batteries_included.helpers.build_info import build_info
 from fastapi_batteries_included.helpers.metrics import set_no_metrics
+from fastapi_batteries_included.helpers.profiling import ProfilingMiddleware
+from fastapi_batteries_included.router_monitoring.debug import (
+    debug_access_allowed,
+    debug_router,
+    monitoring_settings,
+)
+from fastapi_batteries_included.router_monitoring.readiness import (
+    readiness_checks,
+    readiness_router,
+)
 
 router = APIRouter()
 
 
 class RunningResponse(BaseModel):
     "If we respond, we are running"
+
     running: bool = True
 
 
 class VersionResponse(BaseModel):
     "Version numbers"
+
     circle: str = Field(example="1234")
     hash: str = Field(example="366c204")
 
@@ -41,25 +53,36 @@ async def running() -> dict[str, bool]:
     summary="Get version information",
     dependencies=[Depends(set_no_metrics)],
 )
-async def app_version() -> dict[str, str]:
+async def app_version(
+    request: Request, response: Response
+) -> Union[dict[str, str], Response]:
     """Get the circleci build number, and git hash."""
-
-    file_to_data_map = {
-        "circle": "build-circleci.txt",
-        "hash": "build-githash.txt",
-    }
-    version = {}
-    for key in file_to_data_map:
-        try:
-            async with async_open(Path(f"/app/{file_to_data_map[key]}"), "r") as afp:
-                version[key] = (await afp.read()).strip()
-        except OSError:
-            version[key] = "unknown"
+    version = await build_info.get()
+    headers = {"ETag": build_info.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("If-None-Match") == build_info.etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
     return version
 
 
 def init_monitoring(app: FastAPI) -> None:
     app.include_router(router)
+    app.include_router(readiness_router)
+    app.include_router(debug_router)
+    app.add_event_handler("startup", build_info.reload)
+    if monitoring_settings.READINESS_JWKS_CHECK:
+        from fastapi_batteries_included.helpers.security.jwk import (
+            jwks_readiness_check,
+        )
+
+        readiness_checks.register("jwks", jwks_readiness_check)
+    app.add_event_handler("startup", readiness_checks.start)
+    app.add_event_handler("shutdown", readiness_checks.stop)
+    app.add_middleware(
+        ProfilingMiddleware,
+        interval=monitoring_settings.PROFILER_SAMPLE_INTERVAL_SECONDS,
+        access_allowed=debug_access_allowed,
+    )
     if app.openapi_tags is None:
         app.openapi_tags = []
 
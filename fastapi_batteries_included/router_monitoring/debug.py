@@ -0,0 +1,171 @@
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import PlainTextResponse
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+from fastapi_batteries_included import config
+from fastapi_batteries_included.helpers import profiling
+from fastapi_batteries_included.helpers.heavy_hitters import heavy_hitters
+from fastapi_batteries_included.helpers.metrics import request_recorder, set_no_metrics
+from fastapi_batteries_included.helpers.runtime_metrics import HeapSnapshots
+from fastapi_batteries_included.helpers.slo import slo_tracker
+from fastapi_batteries_included.helpers.slow_requests import slow_request_watchdog
+
+monitoring_settings = config.MonitoringSettings()
+metrics_settings = config.MetricsSettings()
+
+heap_snapshots = HeapSnapshots(
+    max_snapshots=monitoring_settings.TRACEMALLOC_MAX_SNAPSHOTS
+)
+
+
+def _accepted_api_key() -> Optional[str]:
+    try:
+        return config.ApiKeySettings().ACCEPTED_API_KEY
+    except ValidationError:
+        return None
+
+
+def debug_access_allowed(headers: Headers) -> bool:
+    """
+    Debug endpoints are open outside production. In production the caller must send
+    the ACCEPTED_API_KEY in the X-Api-Key header.
+    """
+    if config.is_not_production_environment():
+        return True
+    accepted_api_key = _accepted_api_key()
+    api_key = headers.get("X-Api-Key")
+    return (
+        accepted_api_key is not None
+        and api_key is not None
+        and secrets.compare_digest(api_key, accepted_api_key)
+    )
+
+
+def require_debug_access(request: Request) -> None:
+    if not debug_access_allowed(request.headers):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Debug endpoints are not available",
+        )
+
+
+debug_router = APIRouter(
+    prefix="/debug",
+    tags=["infra"],
+    include_in_schema=False,
+    dependencies=[Depends(set_no_metrics), Depends(require_debug_access)],
+)
+
+
+@debug_router.get("/profile", response_class=PlainTextResponse)
+async def get_profile(
+    seconds: float = Query(default=10.0, gt=0),
+    # Shorter intervals would keep the sampler thread holding the GIL
+    interval: Optional[float] = Query(default=None, ge=0.001),
+) -> PlainTextResponse:
+    """
+    Sample the stacks of every thread in this worker for `seconds` and return them in
+    collapsed stack format, ready to be turned into a flamegraph.
+    """
+    seconds = min(seconds, monitoring_settings.PROFILER_MAX_SECONDS)
+    collapsed = await profiling.profile(
+        seconds, interval or monitoring_settings.PROFILER_SAMPLE_INTERVAL_SECONDS
+    )
+    return PlainTextResponse(
+        collapsed,
+        headers={"Content-Disposition": 'attachment; filename="profile.folded"'},
+    )
+
+
+@debug_router.get("/heavy-hitters")
+async def get_heavy_hitters(
+    limit: Optional[int] = Query(default=None, gt=0)
+) -> dict[str, list[dict[str, object]]]:
+    """
+    The users, API key clients and IP addresses that sent the most requests to this
+    worker, with the possible overestimate of each count. Empty unless
+    HEAVY_HITTERS_ENABLED.
+    """
+    top = heavy_hitters.top(limit or metrics_settings.HEAVY_HITTERS_TOP_N)
+    return {
+        dimension: [hitter._asdict() for hitter in hitters]
+        for dimension, hitters in top.items()
+    }
+
+
+@debug_router.get("/latency-quantiles")
+async def get_latency_quantiles() -> dict[str, dict[str, object]]:
+    """
+    Latency quantiles of each route over the last METRICS_QUANTILE_WINDOW_SECONDS in
+    this worker. Empty unless the `quantiles` request recorder is enabled.
+    """
+    if request_recorder.latency_quantiles is None:
+        return {}
+    snapshot = request_recorder.latency_quantiles.snapshot(
+        metrics_settings.METRICS_QUANTILES
+    )
+    return {route: latency._asdict() for route, latency in snapshot.items()}
+
+
+@debug_router.post("/tracemalloc/start", status_code=status.HTTP_204_NO_CONTENT)
+async def start_tracemalloc(
+    frames: Optional[int] = Query(default=None, gt=0)
+) -> Response:
+    """Start tracing memory allocations. Tracing slows the worker down while it runs."""
+    heap_snapshots.start(frames or monitoring_settings.TRACEMALLOC_FRAMES)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@debug_router.post("/tracemalloc/stop", status_code=status.HTTP_204_NO_CONTENT)
+async def stop_tracemalloc() -> Response:
+    """Stop tracing memory allocations and discard the snapshots."""
+    heap_snapshots.stop()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@debug_router.post("/tracemalloc/snapshots")
+async def take_heap_snapshot(limit: int = Query(default=20, gt=0)) -> dict[str, object]:
+    """Take a snapshot of the traced allocations and return its top allocation sites."""
+    try:
+        snapshot_id = await run_in_threadpool(heap_snapshots.take)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    top = await run_in_threadpool(heap_snapshots.top, snapshot_id, limit)
+    return {"id": snapshot_id, "top": [site._asdict() for site in top]}
+
+
+@debug_router.get("/tracemalloc/diff")
+async def diff_heap_snapshots(
+    base: int, current: int, limit: int = Query(default=20, gt=0)
+) -> list[dict[str, object]]:
+    """The allocation sites that changed most between two snapshots."""
+    try:
+        diff = await run_in_threadpool(heap_snapshots.diff, base, current, limit)
+    except KeyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=f"No snapshot {e}"
+        )
+    return [site._asdict() for site in diff]
+
+
+@debug_router.get("/slow-requests")
+async def get_slow_requests() -> list[dict[str, object]]:
+    """
+    The most recent requests that ran for longer than SLOW_REQUEST_CAPTURE_SECONDS in
+    this worker, newest first, with the stack each was at when it was noticed.
+    """
+    return [request._asdict() for request in reversed(slow_request_watchdog.captured)]
+
+
+@debug_router.get("/slos")
+async def get_slos() -> list[dict[str, object]]:
+    """
+    The objective and error budget burn rate over each of SLO_BURN_RATE_WINDOWS of
+    every route SLO in this worker.
+    """
+    return [status._asdict() for status in slo_tracker.status()]
@@ -0,0 +1,195 @@
+"""
+Readiness checks.
+
+`/ready` tells Kubernetes whether the pod should receive traffic. Rather than checking
+dependencies while the probe waits, registered checks run in the background every
+READINESS_CHECK_INTERVAL_SECONDS and `/ready` returns the stored result: 200 if every
+check passed its last run, 503 otherwise (including before the first run, and once the
+app has started draining before shutdown).
+
+A check is a sync or async callable that raises if the dependency is not available.
+Every check is abandoned after READINESS_CHECK_TIMEOUT_SECONDS. Sync checks run in the
+thread pool, where a hanging check can't be stopped: it is not run again until it
+returns, so that hanging checks don't take up the threads requests need. Checks should
+still set their own timeouts on the calls they make. `init_db` registers a `db` check,
+READINESS_JWKS_CHECK registers a `jwks` check, and apps add their own:
+
+    readiness_checks.register("patient-api", check_patient_api)
+"""
+
+import asyncio
+import inspect
+import json
+import time
+from typing import Awaitable, Callable, NamedTuple, Optional, Union, cast
+
+from fastapi import APIRouter, Depends, Response, status
+from prometheus_client import Gauge
+from pydantic import BaseModel
+from she_logging import logger
+from starlette.concurrency import run_in_threadpool
+
+from fastapi_batteries_included import config
+from fastapi_batteries_included.helpers import multiprocess
+from fastapi_batteries_included.helpers.metrics import set_no_metrics
+
+monitoring_settings = config.MonitoringSettings()
+
+READINESS_CHECK_UP = Gauge(
+    "fastapi_readiness_check_up",
+    "Whether the last run of the readiness check passed",
+    ["check"],
+    multiprocess_mode=multiprocess.GAUGE_LIVEALL,
+)
+
+ReadinessCheck = Callable[[], Union[None, Awaitable[None]]]
+
+
+class CheckResult(NamedTuple):
+    ok: bool
+    # Unix time
+    checked_at: float
+    duration: float
+    error: Optional[str] = None
+
+
+class ReadinessChecks:
+    def __init__(self, interval: float, timeout: float) -> None:
+        self.interval = interval
+        self.timeout = timeout
+        self.checks: dict[str, ReadinessCheck] = {}
+        self.results: dict[str, CheckResult] = {}
+        self.draining = False
+        self._task: Optional[asyncio.Task] = None
+        # Sync checks still running in the thread pool, by name
+        self._running: dict[str, asyncio.Future] = {}
+        self._update()
+
+    def register(self, name: str, check: ReadinessCheck) -> None:
+        """Add a check, replacing any check of the same name."""
+        self.checks[name] = check
+        self.results.pop(name, None)
+        self._update()
+
+    def set_draining(self, draining: bool) -> None:
+        """Report not ready whatever the checks say, e.g. while shutting down."""
+        self.draining = draining
+        self._update()
+
+    def _update(self) -> None:
+        # Everything /ready needs, so that it doesn't have to do any work
+        checks = {
+            name: name in self.results and self.results[name].ok for name in self.checks
+        }
+        self.ready = not self.draining and all(checks.values())
+        self.body = json.dumps(
+            {"ready": self.ready, "draining": self.draining, "checks": checks}
+        ).encode()
+
+    async def _run_check(self, name: str, check: ReadinessCheck) -> CheckResult:
+        start = time.perf_counter()
+        error = None
+        try:
+            if inspect.iscoroutinefunction(check):
+                await asyncio.wait_for(cast(Awaitable[None], check()), self.timeout)
+            else:
+                await self._run_sync_check(name, check)
+        except asyncio.TimeoutError:
+            error = f"Timed out after {self.timeout}s"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+        previous = self.results.get(name)
+        if error is not None and (previous is None or previous.ok):
+            logger.warning("Readiness check %s failed: %s", name, error)
+        elif error is None and previous is not None and not previous.ok:
+            logger.info("Readiness check %s passed", name)
+        READINESS_CHECK_UP.labels(name).set(error is None)
+        return CheckResult(
+            ok=error is None,
+            checked_at=time.time(),
+            duration=time.perf_counter() - start,
+            error=error,
+        )
+
+    async def _run_sync_check(self, name: str, check: ReadinessCheck) -> None:
+        running = self._running.get(name)
+        if running is not None and not running.done():
+            raise RuntimeError("Still running since an earlier run")
+        running = self._running[name] = asyncio.ensure_future(run_in_threadpool(check))
+        # Cancelling the future would not stop the thread
+        await asyncio.wait_for(asyncio.shield(running), self.timeout)
+
+    async def run(self) -> None:
+        """Run every check once, concurrently."""
+        checks = list(self.checks.items())
+        results = await asyncio.gather(
+            *(self._run_check(name, check) for name, check in checks)
+        )
+        for (name, check), result in zip(checks, results):
+            # Unless replaced while it ran
+            if self.checks.get(name) is check:
+                self.results[name] = result
+        self._update()
+
+    async def _run_forever(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Failed to run readiness checks")
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+readiness_checks = ReadinessChecks(
+    interval=monitoring_settings.READINESS_CHECK_INTERVAL_SECONDS,
+    timeout=monitoring_settings.READINESS_CHECK_TIMEOUT_SECONDS,
+)
+
+
+class ReadyResponse(BaseModel):
+    "Whether the service should receive traffic, and the result of each check"
+
+    ready: bool
+    draining: bool
+    checks: dict[str, bool]
+
+
+readiness_router = APIRouter()
+
+
+@readiness_router.get(
+    "/ready",
+    response_model=ReadyResponse,
+    responses={status.HTTP_503_SERVICE_UNAVAILABLE: {"model": ReadyResponse}},
+    summary="Verify the service is ready to receive traffic",
+    tags=["infra"],
+    dependencies=[Depends(set_no_metrics)],
+)
+async def ready() -> Response:
+    """
+    Reports the last result of the readiness checks, which run in the background.
+    Used for readiness probes in kubernetes.
+    """
+    return Response(
+        readiness_checks.body,
+        status_code=(
+            status.HTTP_200_OK
+            if readiness_checks.ready
+            else status.HTTP_503_SERVICE_UNAVAILABLE
+        ),
+        media_type="application/json",
+    )
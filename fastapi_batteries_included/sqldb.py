@@ -1,14 +1,24 @@
+import math
+import time
 from datetime import datetime, timezone
-from typing import Any, Union
+from typing import Any, Callable, Union
 
 from fastapi import FastAPI
 from fastapi_sqlalchemy import DBSessionMiddleware, db
-from sqlalchemy import Column, MetaData, String, create_engine
+from sqlalchemy import Column, MetaData, String, create_engine, event, text
+from sqlalchemy.engine import URL, Connection, Engine
 from sqlalchemy.orm import Mapped, declarative_base, declarative_mixin
+from sqlalchemy.pool import NullPool
 from sqlalchemy.types import DateTime
 
 from fastapi_batteries_included.config import MsSQLDbSettings, PostgresDbSettings
 from fastapi_batteries_included.helpers import generate_uuid
+from fastapi_batteries_included.helpers.timing import (
+    OUTCOME_ERROR,
+    OUTCOME_SUCCESS,
+    record_dependency_call,
+)
+from fastapi_batteries_included.router_monitoring.readiness import readiness_checks
 
 __all__ = ["db", "utcnow_with_timezone", "ModelIdentifier", "Base"]
 
@@ -21,10 +31,14 @@ def init_db(app: FastAPI, testing: bool = False) -> None:
     else:
         raise ValueError("App is not configured for a database")
 
-    app.add_middleware(
-        DBSessionMiddleware,
-        db_url=settings.SQLALCHEMY_DATABASE_URI,
-        engine_args=settings.SQLALCHEMY_ENGINE_OPTIONS,
+    engine = create_engine(
+        settings.SQLALCHEMY_DATABASE_URI, **settings.SQLALCHEMY_ENGINE_OPTIONS
+    )
+    app.add_middleware(DBSessionMiddleware, custom_engine=engine)
+
+    register_query_timing(engine)
+    readiness_checks.register(
+        "db", database_readiness_check(engine, timeout=readiness_checks.timeout)
     )
 
     metadata = MetaData()
@@ -37,6 +51,65 @@ def init_db(app: FastAPI, testing: bool = False) -> None:
         Base.metadata.create_all(engine)
 
 
+def _connect_timeout_args(url: URL, timeout: float) -> dict[str, Any]:
+    seconds = max(1, math.ceil(timeout))
+    backend = url.get_backend_name()
+    if backend == "postgresql":
+        return {"connect_timeout": seconds}
+    if backend == "mssql":
+        return {"timeout": seconds}
+    return {}
+
+
+def database_readiness_check(engine: Engine, timeout: float) -> Callable[[], None]:
+    """
+    Readiness check that a new connection to the database can run a query. Uses its
+    own connections, which give up connecting after `timeout`, rather than the pool's.
+    """
+    check_engine = create_engine(
+        engine.url,
+        poolclass=NullPool,
+        connect_args=_connect_timeout_args(engine.url, timeout),
+    )
+
+    def check() -> None:
+        with check_engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+    return check
+
+
+def register_query_timing(engine: Engine) -> None:
+    """
+    Record the time spent running queries on the engine as calls to the `db`
+    dependency, which also makes it the `db` request phase.
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+def _before_cursor_execute(conn: Connection, *args: Any) -> None:
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _query_finished(conn: Connection, outcome: str) -> None:
+    start_times = conn.info.get("query_start_time")
+    if not start_times:
+        return
+    record_dependency_call("db", time.perf_counter() - start_times.pop(), outcome)
+
+
+def _after_cursor_execute(conn: Connection, *args: Any) -> None:
+    _query_finished(conn, OUTCOME_SUCCESS)
+
+
+def _handle_error(context: Any) -> None:
+    if context.connection is not None:
+        _query_finished(context.connection, OUTCOME_ERROR)
+
+
 def utcnow_with_timezone() -> datetime:
     return datetime.now(tz=timezone.utc)
 
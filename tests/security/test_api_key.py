@@ -1,5 +1,5 @@
 import pytest
-from fastapi import APIRouter, FastAPI, Response, Security, status
+from fastapi import APIRouter, FastAPI, HTTPException, Response, Security, status
 from httpx import AsyncClient
 
 from fastapi_batteries_included.helpers.security.api_key import get_api_key
@@ -54,3 +54,8 @@ class TestApiKey:
             f"/test_endpoint_1", headers={"X-Api-Key": "incorrect"}
         )
         assert response.status_code == 403
+
+    async def test_called_directly(self) -> None:
+        await get_api_key("TopSecret")
+        with pytest.raises(HTTPException):
+            await get_api_key("incorrect")
@@ -2,12 +2,15 @@ import logging
 
 import pytest
 from _pytest.logging import LogCaptureFixture
-from fastapi import APIRouter, FastAPI, Security
+from fastapi import APIRouter, FastAPI, Request, Security
+from fastapi.security import SecurityScopes
 from httpx import AsyncClient
 from jose import jwt as jose_jwt
 
+from fastapi_batteries_included.helpers.heavy_hitters import USER_STATE_KEY
 from fastapi_batteries_included.helpers.security.jwt_user import (
     ValidatedUser,
+    get_validated_jwt_token,
     get_validated_user,
 )
 
@@ -81,3 +84,18 @@ class TestApiKey:
             }
         else:
             assert "missing required scopes: ['hello:world']" in caplog.text
+
+    @pytest.mark.parametrize("jwt_scopes", ["hello:world"])
+    async def test_validated_jwt_token_called_directly(
+        self, mock_bearer_authorization: dict
+    ) -> None:
+        token = mock_bearer_authorization["Authorization"].split()[1]
+        request = Request({"type": "http", "state": {}})
+
+        token_data = await get_validated_jwt_token(
+            SecurityScopes(["hello:world"]), token, request
+        )
+
+        assert token_data.claims["sub"] == "1234567890"
+        # Heavy hitter tracking is not enabled
+        assert USER_STATE_KEY not in request.scope["state"]
@@ -0,0 +1,120 @@
+import logging
+import threading
+
+import pytest
+from _pytest.logging import LogCaptureFixture
+from _pytest.monkeypatch import MonkeyPatch
+from prometheus_client import REGISTRY
+from she_logging import logger
+from she_logging.request_id import reset_request_id, set_request_id
+
+from fastapi_batteries_included.helpers import access_log
+from fastapi_batteries_included.helpers.access_log import (
+    AccessLogQueue,
+    AccessLogRecord,
+    log_request,
+    make_access_log_record,
+)
+
+
+@pytest.fixture(autouse=True)
+def configured_logging() -> None:
+    # she-logging replaces the logging configuration, and so the caplog handler,
+    # on first use. Make sure that happens before caplog is set up.
+    logger.debug("Logging configured")
+
+
+def _record(path: str = "/hello-world") -> AccessLogRecord:
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "scheme": "http",
+        "server": ("test", 80),
+        "client": ("127.0.0.1", 1234),
+        "root_path": "",
+        "path": path,
+        "query_string": b"a=1",
+        "headers": [(b"host", b"test"), (b"x-hello", b"World")],
+        "path_params": {},
+        "app": object(),
+    }
+    token = set_request_id("request-id-1")
+    try:
+        return make_access_log_record(scope, 200, 0.0123, 17)
+    finally:
+        reset_request_id(token)
+
+
+def test_make_access_log_record() -> None:
+    record = _record()
+    assert "app" not in record.scope
+    assert record.scope["path"] == "/hello-world"
+    assert record.request_id == "request-id-1"
+
+
+def test_queue_writes_in_background(caplog: LogCaptureFixture) -> None:
+    access_log_queue = AccessLogQueue(max_size=100, batch_size=10)
+    with caplog.at_level(logging.DEBUG):
+        for i in range(25):
+            access_log_queue.put(_record(f"/item/{i}"))
+        access_log_queue.close()
+
+    messages = [r for r in caplog.records if r.getMessage().startswith("GET")]
+    assert [r.getMessage() for r in messages] == [
+        f'GET "http://test/item/{i}?a=1" 200' for i in range(25)
+    ]
+    assert all(r.threadName == "access-log" for r in messages)
+    assert all(getattr(r, "requestID", None) == "request-id-1" for r in messages)
+    assert "Request has additional details" in caplog.text
+
+
+def test_queue_full_drops_records(caplog: LogCaptureFixture) -> None:
+    access_log_queue = AccessLogQueue(max_size=2, batch_size=10)
+    dropped_before = REGISTRY.get_sample_value("fastapi_access_log_dropped_total") or 0
+
+    # Stall the writer thread so that the queue fills up
+    release = threading.Event()
+    access_log_queue._emit = lambda record: release.wait()  # type: ignore
+    for _ in range(5):
+        access_log_queue.put(_record())
+    release.set()
+    access_log_queue.close()
+
+    # One record may already be with the writer thread, 2 fit in the queue
+    dropped = REGISTRY.get_sample_value("fastapi_access_log_dropped_total") or 0
+    assert dropped - dropped_before in (2, 3)
+
+
+def test_close_without_start() -> None:
+    AccessLogQueue(max_size=2, batch_size=1).close()
+
+
+@pytest.mark.parametrize(
+    "status_code,latency,expected",
+    [(200, 0.01, False), (302, 0.01, False), (200, 2.5, True), (404, 0.01, True)],
+)
+def test_sampling(
+    monkeypatch: MonkeyPatch,
+    caplog: LogCaptureFixture,
+    status_code: int,
+    latency: float,
+    expected: bool,
+) -> None:
+    monkeypatch.setattr(
+        access_log.access_log_settings, "ACCESS_LOG_SUCCESS_SAMPLE_RATE", 0.0
+    )
+    monkeypatch.setattr(
+        access_log.access_log_settings, "ACCESS_LOG_SLOW_REQUEST_SECONDS", 2.0
+    )
+    with caplog.at_level(logging.INFO):
+        log_request(_record().scope, status_code, latency, None)
+    assert (f'GET "http://test/hello-world?a=1" {status_code}' in caplog.text) is (
+        expected
+    )
+
+
+def test_details_only_built_for_debug(caplog: LogCaptureFixture) -> None:
+    with caplog.at_level(logging.INFO):
+        log_request(_record().scope, 200, 0.01, None)
+    assert 'GET "http://test/hello-world?a=1" 200' in caplog.text
+    assert "Request has additional details" not in caplog.text
@@ -0,0 +1,34 @@
+from pathlib import Path
+
+import pytest
+from prometheus_client import REGISTRY
+
+from fastapi_batteries_included.helpers.build_info import BuildInfo
+
+
+@pytest.mark.asyncio
+async def test_build_info_reload(tmp_path: Path) -> None:
+    (tmp_path / "build-circleci.txt").write_text("1234\n")
+    build_info = BuildInfo(tmp_path)
+
+    assert await build_info.get() == {"circle": "1234", "hash": "unknown"}
+    etag = build_info.etag
+    assert (
+        REGISTRY.get_sample_value("build_info", {"circle": "1234", "hash": "unknown"})
+        == 1
+    )
+
+    # Served from memory until reloaded
+    (tmp_path / "build-githash.txt").write_text("366c204\n")
+    assert await build_info.get() == {"circle": "1234", "hash": "unknown"}
+
+    assert await build_info.reload() == {"circle": "1234", "hash": "366c204"}
+    assert build_info.etag != etag
+    assert (
+        REGISTRY.get_sample_value("build_info", {"circle": "1234", "hash": "366c204"})
+        == 1
+    )
+    assert (
+        REGISTRY.get_sample_value("build_info", {"circle": "1234", "hash": "unknown"})
+        is None
+    )
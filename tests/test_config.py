@@ -72,3 +72,58 @@ class TestConfig:
 
         assert is_production_environment() is expected
         assert is_not_production_environment() is not expected
+
+    def test_metrics_request_recorders(
+        self, monkeypatch: MonkeyPatch, clear_caches: None
+    ) -> None:
+        from fastapi_batteries_included.config import MetricsSettings
+
+        monkeypatch.setenv("METRICS_REQUEST_RECORDERS", '["histogram"]')
+        monkeypatch.setenv("METRICS_LATENCY_BUCKETS", "[0.1, 0.5, 2.0]")
+        settings = MetricsSettings()
+        assert settings.METRICS_REQUEST_RECORDERS == {"histogram"}
+        assert settings.METRICS_LATENCY_BUCKETS == [0.1, 0.5, 2.0]
+
+        monkeypatch.setenv("METRICS_REQUEST_RECORDERS", '["histogram", "gauge"]')
+        with pytest.raises(ValueError):
+            MetricsSettings()
+
+    def test_slo_burn_rate_windows(
+        self, monkeypatch: MonkeyPatch, clear_caches: None
+    ) -> None:
+        from fastapi_batteries_included.config import MetricsSettings
+
+        monkeypatch.setenv("SLO_BURN_RATE_WINDOWS", "[3600, 300]")
+        assert MetricsSettings().SLO_BURN_RATE_WINDOWS == [300, 3600]
+
+        for windows in ["[]", "[300, 0]", "[-300]"]:
+            monkeypatch.setenv("SLO_BURN_RATE_WINDOWS", windows)
+            with pytest.raises(ValueError):
+                MetricsSettings()
+
+    def test_load_shedding_limits(
+        self, monkeypatch: MonkeyPatch, clear_caches: None
+    ) -> None:
+        from fastapi_batteries_included.config import LoadSheddingSettings
+
+        monkeypatch.setenv("LOAD_SHEDDING_MAX_IN_FLIGHT", "100")
+        monkeypatch.setenv("LOAD_SHEDDING_LOW_PRIORITY_MAX_IN_FLIGHT", "50")
+        monkeypatch.setenv("ADAPTIVE_CONCURRENCY_MIN_LIMIT", "5")
+        monkeypatch.setenv("ADAPTIVE_CONCURRENCY_INITIAL_LIMIT", "5")
+        monkeypatch.setenv("ADAPTIVE_CONCURRENCY_MAX_LIMIT", "10")
+        LoadSheddingSettings()
+
+        monkeypatch.setenv("LOAD_SHEDDING_LOW_PRIORITY_MAX_IN_FLIGHT", "150")
+        with pytest.raises(ValueError):
+            LoadSheddingSettings()
+        monkeypatch.setenv("LOAD_SHEDDING_LOW_PRIORITY_MAX_IN_FLIGHT", "50")
+
+        for min_limit, initial_limit, max_limit in [
+            ("5", "2", "10"),
+            ("5", "20", "10"),
+        ]:
+            monkeypatch.setenv("ADAPTIVE_CONCURRENCY_MIN_LIMIT", min_limit)
+            monkeypatch.setenv("ADAPTIVE_CONCURRENCY_INITIAL_LIMIT", initial_limit)
+            monkeypatch.setenv("ADAPTIVE_CONCURRENCY_MAX_LIMIT", max_limit)
+            with pytest.raises(ValueError):
+                LoadSheddingSettings()
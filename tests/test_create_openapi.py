@@ -31,4 +31,4 @@ class TestCreateOpenapi:
         assert "API specification generated" in result.stdout
 
         spec = yaml.safe_load(outfile.read_text(encoding="utf-8"))
-        assert spec["paths"].keys() == {"/running", "/version"}
+        assert spec["paths"].keys() == {"/running", "/ready", "/version"}
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import signal
+from types import FrameType
+from typing import Generator, Optional
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+
+from fastapi_batteries_included.helpers.drain import Drain
+from fastapi_batteries_included.helpers.load_shedding import LoadSheddingMiddleware
+from fastapi_batteries_included.router_monitoring.readiness import readiness_checks
+
+
+@pytest.fixture(autouse=True)
+def reset_readiness() -> Generator[None, None, None]:
+    yield
+    readiness_checks.set_draining(False)
+
+
+@pytest.fixture
+def release() -> asyncio.Event:
+    return asyncio.Event()
+
+
+def make_app(drain: Drain, release: asyncio.Event) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/work")
+    async def work() -> dict:
+        await release.wait()
+        return {}
+
+    @app.get("/running", tags=["infra"])
+    async def running() -> dict:
+        return {"running": True}
+
+    app.add_middleware(LoadSheddingMiddleware, drain=drain)
+    return app
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_requests_in_flight(release: asyncio.Event) -> None:
+    drain = Drain(grace_seconds=0.01, timeout_seconds=5)
+    rejected_before = (
+        REGISTRY.get_sample_value("fastapi_drain_rejected_requests_total") or 0
+    )
+    async with AsyncClient(
+        app=make_app(drain, release), base_url="http://test"
+    ) as client:
+        in_flight = asyncio.create_task(client.get("/work"))
+        while drain.in_flight < 1:
+            await asyncio.sleep(0.001)
+
+        draining = asyncio.create_task(drain.drain())
+        await asyncio.sleep(0)
+        assert not readiness_checks.ready
+        while not drain.rejecting:
+            await asyncio.sleep(0.001)
+
+        response = await client.get("/work")
+        assert response.status_code == 503
+        assert response.headers["Connection"] == "close"
+        assert (await client.get("/running")).status_code == 200
+        assert not draining.done()
+
+        release.set()
+        assert (await in_flight).status_code == 200
+        assert (await draining) == (1, 0)
+    assert REGISTRY.get_sample_value("fastapi_drain_rejected_requests_total") == (
+        rejected_before + 1
+    )
+
+
+@pytest.mark.asyncio
+async def test_drain_timeout(release: asyncio.Event) -> None:
+    drain = Drain(grace_seconds=0, timeout_seconds=0.01)
+    aborted_before = (
+        REGISTRY.get_sample_value("fastapi_drain_aborted_requests_total") or 0
+    )
+    async with AsyncClient(
+        app=make_app(drain, release), base_url="http://test"
+    ) as client:
+        in_flight = asyncio.create_task(client.get("/work"))
+        while drain.in_flight < 1:
+            await asyncio.sleep(0.001)
+
+        assert (await drain.drain()) == (0, 1)
+        release.set()
+        await in_flight
+    assert REGISTRY.get_sample_value("fastapi_drain_aborted_requests_total") == (
+        aborted_before + 1
+    )
+
+
+@pytest.mark.asyncio
+async def test_drain_on_sigterm() -> None:
+    drain = Drain(grace_seconds=0, timeout_seconds=1)
+    received = asyncio.Event()
+
+    def previous_handler(signum: int, frame: Optional[FrameType]) -> None:
+        received.set()
+
+    original = signal.signal(signal.SIGTERM, previous_handler)
+    try:
+        drain.install_signal_handler()
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.wait_for(received.wait(), 1)
+        assert drain.draining
+        # The previous handler is restored once drained
+        assert signal.getsignal(signal.SIGTERM) is previous_handler
+    finally:
+        signal.signal(signal.SIGTERM, original)
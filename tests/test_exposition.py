@@ -0,0 +1,73 @@
+import pytest
+from fastapi import FastAPI, Request, Response
+from httpx import AsyncClient
+from prometheus_client import REGISTRY, CollectorRegistry, Counter
+from prometheus_client.openmetrics.exposition import (
+    CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE,
+)
+
+from fastapi_batteries_included.helpers.exposition import CachedExposition
+
+
+@pytest.fixture
+def registry() -> CollectorRegistry:
+    registry = CollectorRegistry()
+    Counter("widgets", "Widgets made", registry=registry).inc()
+    return registry
+
+
+@pytest.fixture
+def app(registry: CollectorRegistry) -> FastAPI:
+    app = FastAPI()
+    exposition = CachedExposition(max_age=60, registry_factory=lambda: registry)
+
+    @app.get("/metrics")
+    async def get_metrics(request: Request) -> Response:
+        return await exposition.response(request)
+
+    return app
+
+
+def _generations() -> float:
+    return (
+        REGISTRY.get_sample_value(
+            "fastapi_metrics_exposition_requests_total", {"cache": "miss"}
+        )
+        or 0
+    )
+
+
+@pytest.mark.asyncio
+async def test_exposition_cached(
+    client: AsyncClient, registry: CollectorRegistry
+) -> None:
+    before = _generations()
+    response = await client.get("/metrics", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "content-encoding" not in response.headers
+    assert "widgets_total 1.0" in response.text
+
+    Counter("gadgets", "Gadgets made", registry=registry).inc()
+    response = await client.get("/metrics", headers={"Accept-Encoding": "identity"})
+    assert "gadgets_total" not in response.text, "Should be served from cache"
+    assert _generations() == before + 1
+
+
+@pytest.mark.asyncio
+async def test_exposition_gzip(client: AsyncClient) -> None:
+    response = await client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    # httpx transparently decompresses the body
+    assert "widgets_total 1.0" in response.text
+
+
+@pytest.mark.asyncio
+async def test_exposition_openmetrics(client: AsyncClient) -> None:
+    response = await client.get(
+        "/metrics", headers={"Accept": "application/openmetrics-text; version=0.0.1"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == OPENMETRICS_CONTENT_TYPE
+    assert response.text.endswith("# EOF\n")
@@ -0,0 +1,144 @@
+import random
+from collections import Counter
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+from fastapi import Depends, FastAPI
+from httpx import AsyncClient
+from prometheus_client import CollectorRegistry
+from prometheus_fastapi_instrumentator import Instrumentator
+from pytest_mock import MockFixture
+
+from fastapi_batteries_included.helpers import heavy_hitters as heavy_hitters_module
+from fastapi_batteries_included.helpers import metrics
+from fastapi_batteries_included.helpers.heavy_hitters import (
+    HeavyHitter,
+    HeavyHitters,
+    HeavyHittersCollector,
+    SpaceSaving,
+    api_key_fingerprint,
+)
+from fastapi_batteries_included.helpers.security import api_key as api_key_module
+from fastapi_batteries_included.helpers.security.api_key import get_api_key
+
+
+def test_space_saving_keeps_heavy_hitters() -> None:
+    sketch = SpaceSaving(capacity=3)
+    for i in range(100):
+        sketch.offer("heavy")
+        sketch.offer(f"light-{i}")
+    top = sketch.top(1)
+    assert top == [HeavyHitter("heavy", 100, 0)]
+    assert len(sketch.top(10)) == 3
+
+
+def test_space_saving_eviction_inherits_count() -> None:
+    sketch = SpaceSaving(capacity=2)
+    for client in ["a", "a", "b", "c"]:
+        sketch.offer(client)
+    assert sketch.top(2) == [HeavyHitter("a", 2, 0), HeavyHitter("c", 2, 1)]
+
+
+def test_space_saving_bounds() -> None:
+    rng = random.Random(42)
+    sketch = SpaceSaving(capacity=20)
+    stream = [f"client-{int(rng.paretovariate(1.2))}" for _ in range(5000)]
+    for client in stream:
+        sketch.offer(client)
+
+    top = sketch.top(100)
+    assert len(top) == 20
+    assert sum(hitter.requests for hitter in top) == len(stream)
+    true_counts = Counter(stream)
+    for hitter in top:
+        assert hitter.requests - hitter.error <= true_counts[hitter.client]
+        assert true_counts[hitter.client] <= hitter.requests
+    # Every client with more than 1/capacity of the requests is kept
+    tracked = {hitter.client for hitter in top}
+    for client, count in true_counts.items():
+        if count > len(stream) / 20:
+            assert client in tracked
+
+
+def test_heavy_hitters_collector() -> None:
+    heavy_hitters = HeavyHitters(capacity=10)
+    for _ in range(3):
+        heavy_hitters.record(
+            {"client": ("10.0.0.1", 1234), "state": {"client_user": "user-1"}}
+        )
+    heavy_hitters.record({"client": ("10.0.0.2", 1234), "state": {}})
+
+    registry = CollectorRegistry()
+    registry.register(HeavyHittersCollector(heavy_hitters, top_n=1))
+    value = registry.get_sample_value
+    assert (
+        value(
+            "fastapi_heavy_hitter_requests", {"dimension": "ip", "client": "10.0.0.1"}
+        )
+        == 3
+    )
+    assert (
+        value(
+            "fastapi_heavy_hitter_requests", {"dimension": "ip", "client": "10.0.0.2"}
+        )
+        is None
+    )
+    assert (
+        value(
+            "fastapi_heavy_hitter_requests", {"dimension": "user", "client": "user-1"}
+        )
+        == 3
+    )
+
+
+class TestHeavyHittersEndpoint:
+    @pytest.fixture
+    def app(self, mocker: MockFixture, monkeypatch: MonkeyPatch) -> FastAPI:
+        from fastapi_batteries_included import create_app
+
+        # p-f-i doesn't like being attached to multiple apps so stub it out
+        mocker.patch.object(Instrumentator, "instrument")
+        monkeypatch.setattr(metrics.metrics_settings, "HEAVY_HITTERS_ENABLED", True)
+        monkeypatch.setattr(
+            api_key_module.metrics_settings, "HEAVY_HITTERS_ENABLED", True
+        )
+        for sketch in heavy_hitters_module.heavy_hitters.sketches.values():
+            sketch.clear()
+
+        app = create_app(testing=False)
+
+        @app.get("/protected", dependencies=[Depends(get_api_key)])
+        async def protected() -> dict:
+            return {}
+
+        return app
+
+    @pytest.mark.asyncio
+    async def test_heavy_hitters_endpoint(self, client: AsyncClient) -> None:
+        for _ in range(2):
+            response = await client.get(
+                "/protected", headers={"X-Api-Key": "TopSecret"}
+            )
+            assert response.status_code == 200
+
+        response = await client.get("/debug/heavy-hitters")
+        assert response.status_code == 200
+        assert response.json()["api_key"] == [
+            {"client": api_key_fingerprint("TopSecret"), "requests": 2, "error": 0}
+        ]
+        assert response.json()["user"] == []
+
+
+@pytest.mark.asyncio
+async def test_api_key_not_fingerprinted_when_disabled(mocker: MockFixture) -> None:
+    fingerprint = mocker.patch.object(api_key_module, "api_key_fingerprint")
+    app = FastAPI()
+
+    @app.get("/protected", dependencies=[Depends(get_api_key)])
+    async def protected() -> dict:
+        return {}
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/protected", headers={"X-Api-Key": "TopSecret"})
+    assert response.status_code == 200
+    fingerprint.assert_not_called()
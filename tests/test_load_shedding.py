@@ -0,0 +1,217 @@
+import asyncio
+import random
+from typing import Iterable
+
+import pytest
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+
+from fastapi_batteries_included.helpers.load_shedding import (
+    PRIORITY_INFRA,
+    PRIORITY_LOW,
+    PRIORITY_NORMAL,
+    AdaptiveConcurrencyLimit,
+    AdaptiveConcurrencyLimits,
+    LoadSheddingMiddleware,
+    route_priority,
+)
+
+
+@pytest.fixture
+def release() -> asyncio.Event:
+    return asyncio.Event()
+
+
+@pytest.fixture
+def app(release: asyncio.Event) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/work")
+    async def work() -> dict:
+        await release.wait()
+        return {}
+
+    @app.get("/report", tags=["reports"])
+    async def report() -> dict:
+        return {}
+
+    @app.get("/running", tags=["infra"])
+    async def running() -> dict:
+        return {"running": True}
+
+    app.add_middleware(
+        LoadSheddingMiddleware,
+        max_in_flight=2,
+        low_priority_max_in_flight=1,
+        low_priority_tags={"reports"},
+    )
+    return app
+
+
+def test_route_priority(app: FastAPI) -> None:
+    routes = {route.path: route for route in app.routes if isinstance(route, APIRoute)}
+    assert route_priority(routes["/running"], {"reports"}) == PRIORITY_INFRA
+    assert route_priority(routes["/report"], {"reports"}) == PRIORITY_LOW
+    assert route_priority(routes["/work"], {"reports"}) == PRIORITY_NORMAL
+    assert route_priority(None, {"reports"}) == PRIORITY_NORMAL
+
+
+@pytest.mark.asyncio
+async def test_load_shedding(client: AsyncClient, release: asyncio.Event) -> None:
+    labels = {"route": "/work", "priority": PRIORITY_NORMAL}
+    shed_before = REGISTRY.get_sample_value("fastapi_requests_shed_total", labels) or 0
+
+    # Nothing in flight: low priority requests are admitted
+    response = await client.get("/report")
+    assert response.status_code == 200
+
+    in_flight = [asyncio.create_task(client.get("/work")) for _ in range(2)]
+    while (REGISTRY.get_sample_value("fastapi_requests_in_flight") or 0) < 2:
+        await asyncio.sleep(0.001)
+
+    response = await client.get("/work")
+    assert response.status_code == 503
+    assert response.json() == {"message": "Service unavailable"}
+    assert response.headers["Retry-After"] == "1"
+    assert REGISTRY.get_sample_value("fastapi_requests_shed_total", labels) == (
+        shed_before + 1
+    )
+    assert (await client.get("/report")).status_code == 503
+    assert (await client.get("/running")).status_code == 200
+
+    release.set()
+    assert [(await task).status_code for task in in_flight] == [200, 200]
+    assert REGISTRY.get_sample_value("fastapi_requests_in_flight") == 0
+    assert (await client.get("/work")).status_code == 200
+
+
+def make_limit(initial_limit: int = 4) -> AdaptiveConcurrencyLimit:
+    return AdaptiveConcurrencyLimit(
+        initial_limit=initial_limit,
+        min_limit=1,
+        max_limit=8,
+        tolerance=2.0,
+        backoff_ratio=0.5,
+    )
+
+
+def run_saturated(
+    limit: AdaptiveConcurrencyLimit,
+    latencies: Iterable[float],
+    status_code: int = 200,
+) -> None:
+    """Complete requests in batches that use the whole limit."""
+    latencies = list(latencies)
+    while latencies:
+        batch = []
+        while latencies and limit.try_acquire():
+            batch.append(latencies.pop())
+        for latency in batch:
+            limit.release(latency, status_code)
+
+
+def test_adaptive_concurrency_limit_acquire() -> None:
+    limit = make_limit(initial_limit=2)
+    assert limit.try_acquire()
+    assert limit.try_acquire()
+    assert not limit.try_acquire()
+    limit.release(0.01)
+    assert limit.try_acquire()
+
+
+def test_adaptive_concurrency_limit_grows_when_healthy() -> None:
+    limit = make_limit()
+    run_saturated(limit, [0.01] * 1000)
+    assert limit.limit == 8
+
+
+def test_adaptive_concurrency_limit_shrinks_when_slow() -> None:
+    limit = make_limit()
+    window = AdaptiveConcurrencyLimit.WINDOW_SIZE
+    run_saturated(limit, [0.01] * window)
+    before = limit.limit
+
+    # One decrease per window of slow requests
+    run_saturated(limit, [1.0] * window)
+    assert limit.limit == before * 0.5
+
+    run_saturated(limit, [1.0] * window * 5)
+    assert limit.limit == 1
+
+
+def test_adaptive_concurrency_limit_mixed_latency() -> None:
+    # A fifth of the responses are much faster than the rest, e.g. cache hits
+    rng = random.Random(42)
+    limit = make_limit()
+    latencies = [
+        0.001 if rng.random() < 0.2 else rng.uniform(0.04, 0.06) for _ in range(2000)
+    ]
+    run_saturated(limit, latencies)
+    assert limit.limit == 8
+
+
+def test_adaptive_concurrency_limit_ignores_errors() -> None:
+    limit = make_limit()
+    run_saturated(limit, [0.05] * AdaptiveConcurrencyLimit.WINDOW_SIZE)
+    before = limit.limit
+    # Fast 404s and slow 503s don't move the baseline or the limit
+    run_saturated(limit, [0.0001] * 100, status_code=404)
+    run_saturated(limit, [5.0] * 100, status_code=503)
+    assert limit.limit == before
+    assert limit.baseline == 0.05
+
+
+def test_adaptive_concurrency_limit_does_not_grow_when_idle() -> None:
+    limit = make_limit()
+    # One request at a time never uses half of the limit
+    for _ in range(1000):
+        assert limit.try_acquire()
+        limit.release(0.01)
+    assert limit.limit == 4
+
+
+@pytest.mark.asyncio
+async def test_adaptive_concurrency_rejections(release: asyncio.Event) -> None:
+    app = FastAPI()
+
+    @app.get("/slow")
+    async def slow() -> dict:
+        await release.wait()
+        return {}
+
+    @app.get("/fast")
+    async def fast() -> dict:
+        return {}
+
+    app.add_middleware(
+        LoadSheddingMiddleware,
+        route_limits=AdaptiveConcurrencyLimits(
+            initial_limit=1,
+            min_limit=1,
+            max_limit=10,
+            tolerance=2.0,
+            backoff_ratio=0.9,
+        ),
+    )
+    labels = {"route": "/slow"}
+    before = (
+        REGISTRY.get_sample_value("fastapi_route_concurrency_rejections_total", labels)
+        or 0
+    )
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        in_flight = asyncio.create_task(client.get("/slow"))
+        while (REGISTRY.get_sample_value("fastapi_requests_in_flight") or 0) < 1:
+            await asyncio.sleep(0.001)
+
+        assert (await client.get("/slow")).status_code == 503
+        assert (await client.get("/fast")).status_code == 200
+        assert REGISTRY.get_sample_value(
+            "fastapi_route_concurrency_rejections_total", labels
+        ) == (before + 1)
+
+        release.set()
+        assert (await in_flight).status_code == 200
+    # Too few requests to complete a latency window
+    assert REGISTRY.get_sample_value("fastapi_route_concurrency_limit", labels) == 1
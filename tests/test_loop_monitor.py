@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import time
+
+import pytest
+from _pytest.logging import LogCaptureFixture
+from _pytest.monkeypatch import MonkeyPatch
+from fastapi import FastAPI
+from prometheus_client import REGISTRY
+from she_logging import logger
+
+from fastapi_batteries_included.helpers import loop_monitor
+from fastapi_batteries_included.helpers.loop_monitor import (
+    EventLoopMonitor,
+    init_event_loop_monitor,
+)
+
+
+def _lag_count() -> float:
+    return REGISTRY.get_sample_value("fastapi_event_loop_lag_seconds_count") or 0
+
+
+def _lag_sum() -> float:
+    return REGISTRY.get_sample_value("fastapi_event_loop_lag_seconds_sum") or 0
+
+
+def blocking_call() -> None:
+    time.sleep(0.3)
+
+
+@pytest.mark.asyncio
+async def test_lag_measured() -> None:
+    monitor = EventLoopMonitor(interval=0.01)
+    count_before, sum_before = _lag_count(), _lag_sum()
+    await monitor.start()
+    await asyncio.sleep(0.05)
+    blocking_call()
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    assert _lag_count() > count_before
+    assert _lag_sum() - sum_before >= 0.25
+
+
+@pytest.mark.asyncio
+async def test_blocking_stack_logged(caplog: LogCaptureFixture) -> None:
+    logger.debug("Logging configured")
+    monitor = EventLoopMonitor(interval=0.01, blocking_threshold=0.1)
+    with caplog.at_level(logging.WARNING):
+        await monitor.start()
+        await asyncio.sleep(0.02)
+        blocking_call()
+        await asyncio.sleep(0.02)
+        await monitor.stop()
+
+    assert "Event loop blocked for at least" in caplog.text
+    assert "in blocking_call" in caplog.text
+
+
+def test_init_disabled_by_default() -> None:
+    app = FastAPI()
+    init_event_loop_monitor(app)
+    assert not hasattr(app.state, "event_loop_monitor")
+
+
+def test_init_enabled(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setattr(
+        loop_monitor.monitoring_settings, "EVENT_LOOP_MONITOR_ENABLED", True
+    )
+    app = FastAPI()
+    init_event_loop_monitor(app)
+    assert isinstance(app.state.event_loop_monitor, EventLoopMonitor)
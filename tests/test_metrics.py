@@ -1,13 +1,29 @@
+import asyncio
 import re
+import time
+from typing import AsyncIterator, Iterator
 
 import pytest
 from _pytest.logging import LogCaptureFixture
-from fastapi import APIRouter, FastAPI
+from _pytest.monkeypatch import MonkeyPatch
+from fastapi import APIRouter, FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
 from httpx import AsyncClient
+from prometheus_client import REGISTRY, CollectorRegistry
+from prometheus_client.openmetrics import exposition as openmetrics
 from prometheus_fastapi_instrumentator import Instrumentator
 from pytest_mock import MockFixture
+from starlette.types import Message
 
 from fastapi_batteries_included import init_metrics
+from fastapi_batteries_included.helpers import access_log
+from fastapi_batteries_included.helpers.metrics import (
+    OVERFLOW_ROUTE,
+    LabelSetLimiter,
+    RequestMeasurement,
+    RequestRecorder,
+    after_request,
+)
 
 dummy_router = APIRouter()
 
@@ -17,6 +33,30 @@ async def hello_world() -> dict:
     return {"greeting": "hello"}
 
 
+@dummy_router.get("/patient/{patient_id}")
+async def get_patient(patient_id: str) -> dict:
+    return {"uuid": patient_id}
+
+
+@dummy_router.get("/stream")
+async def stream() -> StreamingResponse:
+    def chunks() -> Iterator[bytes]:
+        for i in range(3):
+            yield f"chunk {i}\n".encode()
+
+    return StreamingResponse(chunks(), media_type="text/plain")
+
+
+@dummy_router.get("/slow-stream")
+async def slow_stream() -> StreamingResponse:
+    async def chunks() -> AsyncIterator[bytes]:
+        for i in range(100):
+            yield f"chunk {i}\n".encode()
+            await asyncio.sleep(0.01)
+
+    return StreamingResponse(chunks(), media_type="text/plain")
+
+
 class TestErrors:
     @pytest.fixture
     def app(self, mocker: MockFixture) -> FastAPI:
@@ -51,3 +91,318 @@ class TestErrors:
         expected = """INFO.*?GET "http://test/hello-world" 200\nDEBUG"""
         assert re.match(expected, caplog.text)
         assert "Request has additional details" not in caplog.text
+
+    @pytest.mark.asyncio
+    async def test_metrics_streaming_response(
+        self, app: FastAPI, client: AsyncClient, caplog: LogCaptureFixture
+    ) -> None:
+        labels = {"method": "GET", "url": "/stream", "http_status": "200"}
+        before = REGISTRY.get_sample_value("fastapi_request_count_total", labels) or 0
+        response = await client.get("/stream")
+        assert response.status_code == 200
+        assert response.text == "chunk 0\nchunk 1\nchunk 2\n"
+        assert response.headers["Cache-Control"] == "no-cache, must-revalidate"
+        assert response.headers["Pragma"] == "no-cache"
+        assert REGISTRY.get_sample_value("fastapi_request_count_total", labels) == (
+            before + 1
+        )
+        assert 'GET "http://test/stream" 200' in caplog.text
+
+    @pytest.mark.asyncio
+    async def test_metrics_client_disconnected_during_stream(
+        self, app: FastAPI, caplog: LogCaptureFixture
+    ) -> None:
+        labels = {"method": "GET", "url": "/slow-stream", "http_status": "200"}
+        before = REGISTRY.get_sample_value("fastapi_request_count_total", labels) or 0
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "server": ("test", 80),
+            "client": ("127.0.0.1", 12345),
+            "root_path": "",
+            "path": "/slow-stream",
+            "raw_path": b"/slow-stream",
+            "query_string": b"",
+            "headers": [(b"host", b"test")],
+        }
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+        body_sent = asyncio.Event()
+        sent: list[Message] = []
+
+        async def receive() -> Message:
+            if messages:
+                return messages.pop()
+            # The client goes away once the first chunk has arrived
+            await body_sent.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message: Message) -> None:
+            sent.append(message)
+            if message["type"] == "http.response.body":
+                body_sent.set()
+
+        await asyncio.wait_for(app(scope, receive, send), 5)
+
+        assert sent[-1].get("more_body", False)
+        assert REGISTRY.get_sample_value("fastapi_request_count_total", labels) == (
+            before + 1
+        )
+        assert 'GET "http://test/slow-stream" 200' in caplog.text
+
+    @pytest.mark.asyncio
+    async def test_metrics_streaming_response_size_and_ttfb(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        labels = {"method": "GET", "route": "/stream"}
+        size_before = (
+            REGISTRY.get_sample_value("fastapi_response_size_bytes_sum", labels) or 0
+        )
+        ttfb_before = (
+            REGISTRY.get_sample_value("fastapi_request_ttfb_seconds_count", labels) or 0
+        )
+        response = await client.get("/stream")
+        assert response.status_code == 200
+        # No Content-Length is sent, the size is counted from the body messages
+        assert "content-length" not in response.headers
+        assert REGISTRY.get_sample_value(
+            "fastapi_response_size_bytes_sum", labels
+        ) == size_before + len(response.content)
+        assert REGISTRY.get_sample_value(
+            "fastapi_request_ttfb_seconds_count", labels
+        ) == (ttfb_before + 1)
+
+    @pytest.mark.asyncio
+    async def test_metrics_labelled_by_route_template(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        labels = {"method": "GET", "url": "/patient/{patient_id}"}
+        before = (
+            REGISTRY.get_sample_value("fastapi_request_latency_seconds_count", labels)
+            or 0
+        )
+        for patient_id in ("p1", "p2"):
+            response = await client.get(
+                f"/patient/{patient_id}", headers={"Host": f"{patient_id}.example"}
+            )
+            assert response.status_code == 200
+        assert REGISTRY.get_sample_value(
+            "fastapi_request_latency_seconds_count", labels
+        ) == (before + 2)
+
+    @pytest.mark.asyncio
+    async def test_metrics_unmatched_route(
+        self, app: FastAPI, client: AsyncClient
+    ) -> None:
+        labels = {"method": "GET", "url": "<unmatched>", "http_status": "404"}
+        before = REGISTRY.get_sample_value("fastapi_request_count_total", labels) or 0
+        response = await client.get("/no/such/route")
+        assert response.status_code == 404
+        assert REGISTRY.get_sample_value("fastapi_request_count_total", labels) == (
+            before + 1
+        )
+
+    @pytest.mark.asyncio
+    async def test_metrics_async_access_log(
+        self,
+        app: FastAPI,
+        client: AsyncClient,
+        caplog: LogCaptureFixture,
+        monkeypatch: MonkeyPatch,
+    ) -> None:
+        monkeypatch.setattr(access_log.access_log_settings, "ACCESS_LOG_ASYNC", True)
+        response = await client.get("/hello-world")
+        assert response.status_code == 200
+        access_log.access_log_queue.close()
+        assert 'GET "http://test/hello-world" 200' in caplog.text
+
+
+class TestExemplars:
+    @pytest.fixture
+    def app(self, mocker: MockFixture, monkeypatch: MonkeyPatch) -> FastAPI:
+        from fastapi_batteries_included import create_app
+        from fastapi_batteries_included.helpers import metrics
+
+        # p-f-i doesn't like being attached to multiple apps so stub it out
+        mocker.patch.object(Instrumentator, "instrument")
+        monkeypatch.setattr(metrics.request_recorder, "exemplar_min_latency", 0.0)
+        monkeypatch.setattr(metrics.metrics_exposition, "max_age", 0.0)
+
+        app = create_app(testing=False)
+        app.include_router(dummy_router)
+        return app
+
+    @pytest.mark.asyncio
+    async def test_metrics_exemplar_request_id(self, client: AsyncClient) -> None:
+        response = await client.get(
+            "/patient/p1", headers={"X-Request-ID": "exemplar-request-id"}
+        )
+        assert response.status_code == 200
+
+        response = await client.get(
+            "/metrics", headers={"Accept": "application/openmetrics-text"}
+        )
+        assert '# {request_id="exemplar-request-id"}' in response.text
+
+
+def test_label_set_limiter_overflow() -> None:
+    limiter = LabelSetLimiter(max_label_sets=2)
+    dropped_before = (
+        REGISTRY.get_sample_value("fastapi_metrics_dropped_label_sets_total") or 0
+    )
+    assert limiter.limit("GET", "/a", "200") == ("GET", "/a", "200")
+    assert limiter.limit("GET", "/b", "200") == ("GET", "/b", "200")
+    assert limiter.limit("GET", "/a", "200") == ("GET", "/a", "200")
+    assert limiter.limit("GET", "/c", "200") == ("GET", OVERFLOW_ROUTE, "200")
+    assert REGISTRY.get_sample_value("fastapi_metrics_dropped_label_sets_total") == (
+        dropped_before + 1
+    )
+
+
+def test_after_request() -> None:
+    app = FastAPI()
+    app.include_router(dummy_router)
+    labels = {"method": "GET", "url": "/patient/{patient_id}", "http_status": "200"}
+    size_labels = {"method": "GET", "route": "/patient/{patient_id}"}
+    before = REGISTRY.get_sample_value("fastapi_request_count_total", labels) or 0
+    size_before = (
+        REGISTRY.get_sample_value("fastapi_response_size_bytes_sum", size_labels) or 0
+    )
+    request = Request(
+        {
+            "type": "http",
+            "app": app,
+            "method": "GET",
+            "path": "/patient/p1",
+            "query_string": b"",
+            "headers": [],
+            "state": {"enable_metrics": True},
+        }
+    )
+
+    response = after_request(time.time(), request, Response("ok"))
+
+    assert response.headers["Cache-Control"] == "no-cache, must-revalidate"
+    assert REGISTRY.get_sample_value("fastapi_request_count_total", labels) == (
+        before + 1
+    )
+    assert REGISTRY.get_sample_value(
+        "fastapi_response_size_bytes_sum", size_labels
+    ) == (size_before + 2)
+
+
+def test_request_recorder_configured_metrics() -> None:
+    registry = CollectorRegistry()
+    recorder = RequestRecorder(
+        recorders={"histogram", "counter"},
+        buckets=[0.1, 1.0],
+        size_buckets=[100, 1000],
+        max_label_sets=10,
+        registry=registry,
+    )
+    assert recorder.processing_time is None
+    assert recorder.response_size is None
+
+    recorder.record(RequestMeasurement("GET", "/patient/{patient_id}", 200, 0.5))
+    recorder.record(RequestMeasurement("BREW", None, 404, 0.05))
+
+    assert (
+        registry.get_sample_value(
+            "fastapi_request_latency_seconds_bucket",
+            {"method": "GET", "url": "/patient/{patient_id}", "le": "0.1"},
+        )
+        == 0
+    )
+    assert (
+        registry.get_sample_value(
+            "fastapi_request_latency_seconds_bucket",
+            {"method": "GET", "url": "/patient/{patient_id}", "le": "1.0"},
+        )
+        == 1
+    )
+    assert (
+        registry.get_sample_value(
+            "fastapi_request_count_total",
+            {"method": "OTHER", "url": "<unmatched>", "http_status": "404"},
+        )
+        == 1
+    )
+    assert registry.get_sample_value("request_processing_seconds_count") is None
+
+
+def test_request_recorder_bound_metrics_cached() -> None:
+    recorder = RequestRecorder(
+        recorders={"histogram", "counter"},
+        buckets=[0.1, 1.0],
+        size_buckets=[100, 1000],
+        max_label_sets=1,
+        registry=CollectorRegistry(),
+    )
+    bound = recorder.bound_metrics("GET", "/a", 200)
+    assert recorder.bound_metrics("GET", "/a", 200) is bound
+    assert bound.phase("db") is bound.phase("db")
+
+    overflow = recorder.bound_metrics("GET", "/b", 200)
+    assert overflow.route == OVERFLOW_ROUTE
+    assert recorder.bound_metrics("GET", "/c", 200) is overflow
+    assert len(recorder._bound) == 2
+
+
+def test_request_recorder_exemplars_for_slow_requests() -> None:
+    registry = CollectorRegistry()
+    recorder = RequestRecorder(
+        recorders={"histogram"},
+        buckets=[0.1, 1.0],
+        size_buckets=[100, 1000],
+        max_label_sets=10,
+        registry=registry,
+        exemplar_min_latency=0.5,
+    )
+    recorder.record(RequestMeasurement("GET", "/a", 200, 0.05, request_id="fast"))
+    recorder.record(RequestMeasurement("GET", "/a", 200, 0.8, request_id="slow"))
+    recorder.record(RequestMeasurement("GET", "/a", 200, 0.9, request_id="x" * 100))
+
+    exposition = openmetrics.generate_latest(registry).decode()
+    assert '# {request_id="slow"} 0.8' in exposition
+    assert 'request_id="fast"' not in exposition
+    assert "xxx" not in exposition
+
+
+def test_request_recorder_ttfb_and_response_size() -> None:
+    registry = CollectorRegistry()
+    recorder = RequestRecorder(
+        recorders={"ttfb", "response_size"},
+        buckets=[0.1, 1.0],
+        size_buckets=[100, 1000],
+        max_label_sets=10,
+        registry=registry,
+    )
+    assert recorder.latency is None
+
+    recorder.record(
+        RequestMeasurement(
+            "GET", "/report", 200, latency=2.0, ttfb=0.05, response_size=500
+        )
+    )
+
+    labels = {"method": "GET", "route": "/report"}
+    assert (
+        registry.get_sample_value(
+            "fastapi_request_ttfb_seconds_bucket", {**labels, "le": "0.1"}
+        )
+        == 1
+    )
+    assert (
+        registry.get_sample_value(
+            "fastapi_response_size_bytes_bucket", {**labels, "le": "100.0"}
+        )
+        == 0
+    )
+    assert (
+        registry.get_sample_value(
+            "fastapi_response_size_bytes_bucket", {**labels, "le": "1000.0"}
+        )
+        == 1
+    )
@@ -71,3 +71,16 @@ class TestMonitoring:
         assert response.status_code == 200
         if content_type == "application/json":
             assert response.json() == expected
+
+    @pytest.mark.asyncio
+    async def test_version_etag(self, client: AsyncClient) -> None:
+        response: Response = await client.get("/version")
+        etag = response.headers["ETag"]
+
+        response = await client.get("/version", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert not response.content
+
+        response = await client.get("/version", headers={"If-None-Match": '"stale"'})
+        assert response.status_code == 200
@@ -0,0 +1,45 @@
+import os
+from pathlib import Path
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+from prometheus_client import REGISTRY, CollectorRegistry
+
+from fastapi_batteries_included.helpers import multiprocess
+
+
+@pytest.fixture
+def multiproc_dir(tmp_path: Path, monkeypatch: MonkeyPatch) -> Path:
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_single_process_mode(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    assert multiprocess.is_multiprocess_mode() is False
+    assert multiprocess.exposition_registry() is REGISTRY
+    assert multiprocess.cleanup_dead_processes() == []
+
+
+def test_exposition_registry_aggregates(multiproc_dir: Path) -> None:
+    assert multiprocess.is_multiprocess_mode() is True
+    registry = multiprocess.exposition_registry()
+    assert isinstance(registry, CollectorRegistry)
+    assert registry is not REGISTRY
+
+
+def test_cleanup_dead_processes(multiproc_dir: Path) -> None:
+    dead_pid = 2**22 + 1  # above the default Linux pid_max
+    live_pid = os.getpid()
+    for name in (
+        f"gauge_livesum_{dead_pid}.db",
+        f"gauge_liveall_{dead_pid}.db",
+        f"counter_{dead_pid}.db",
+        f"gauge_livesum_{live_pid}.db",
+    ):
+        (multiproc_dir / name).touch()
+
+    assert multiprocess.cleanup_dead_processes() == [dead_pid]
+
+    remaining = sorted(p.name for p in multiproc_dir.iterdir())
+    assert remaining == [f"counter_{dead_pid}.db", f"gauge_livesum_{live_pid}.db"]
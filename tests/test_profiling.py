@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+from fastapi import FastAPI
+from httpx import AsyncClient
+from prometheus_fastapi_instrumentator import Instrumentator
+from pytest_mock import MockFixture
+
+from fastapi_batteries_included.helpers.profiling import StackSampler
+
+
+def busy_function(stop: threading.Event) -> None:
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+def test_stack_sampler() -> None:
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_function, args=(stop,), name="busy")
+    worker.start()
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    time.sleep(0.05)
+    sampler.stop()
+    stop.set()
+    worker.join()
+
+    lines = sampler.collapsed().splitlines()
+    busy = [line for line in lines if line.startswith("busy;")]
+    assert busy
+    stack, count = busy[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert "busy_function (" in stack.split(";")[-1]
+    assert not any(line.startswith("stack-sampler;") for line in lines)
+
+
+class TestProfilingEndpoints:
+    @pytest.fixture
+    def app(self, mocker: MockFixture) -> FastAPI:
+        from fastapi_batteries_included import create_app
+
+        # p-f-i doesn't like being attached to multiple apps so stub it out
+        mocker.patch.object(Instrumentator, "instrument")
+
+        app = create_app(testing=False)
+
+        @app.get("/slow")
+        def slow() -> dict:
+            time.sleep(0.05)
+            return {}
+
+        return app
+
+    @pytest.mark.asyncio
+    async def test_profile_endpoint(self, client: AsyncClient) -> None:
+        response = await client.get("/debug/profile", params={"seconds": 0.05})
+        assert response.status_code == 200
+        assert response.headers["content-disposition"].startswith("attachment")
+        assert "MainThread;" in response.text
+
+    @pytest.mark.asyncio
+    async def test_profile_endpoint_interval_too_short(
+        self, client: AsyncClient
+    ) -> None:
+        response = await client.get(
+            "/debug/profile", params={"seconds": 0.05, "interval": 1e-9}
+        )
+        assert response.status_code == 422
+
+    @pytest.mark.asyncio
+    async def test_profile_request(self, client: AsyncClient) -> None:
+        response = await client.get("/slow", headers={"X-Profile-Request": "1"})
+        assert response.status_code == 200
+        assert response.headers["x-profiled-status"] == "200"
+        assert response.headers["content-disposition"].startswith("attachment")
+        assert "slow (" in response.text
+
+    @pytest.mark.asyncio
+    async def test_profile_production(
+        self, client: AsyncClient, monkeypatch: MonkeyPatch
+    ) -> None:
+        monkeypatch.setenv("ENVIRONMENT", "PRODUCTION")
+        monkeypatch.setenv("ACCEPTED_API_KEY", "TopSecret")
+
+        response = await client.get("/debug/profile", params={"seconds": 0.01})
+        assert response.status_code == 403
+
+        response = await client.get("/slow", headers={"X-Profile-Request": "1"})
+        assert response.status_code == 200
+        assert "x-profiled-status" not in response.headers
+        assert response.json() == {}
+
+        response = await client.get(
+            "/debug/profile",
+            params={"seconds": 0.01},
+            headers={"X-Api-Key": "TopSecret"},
+        )
+        assert response.status_code == 200
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+from prometheus_client import CollectorRegistry
+
+from fastapi_batteries_included.helpers.metrics import (
+    RequestMeasurement,
+    RequestRecorder,
+)
+from fastapi_batteries_included.helpers.quantiles import (
+    LogBucketSketch,
+    WindowedSketch,
+)
+
+
+def test_log_bucket_sketch_relative_error() -> None:
+    rng = random.Random(42)
+    values = sorted(rng.lognormvariate(-3, 1) for _ in range(10000))
+    sketch = LogBucketSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    for q in (0.5, 0.9, 0.99, 0.999):
+        exact = values[int(q * (len(values) - 1))]
+        estimate = sketch.quantile(q)
+        assert estimate == pytest.approx(exact, rel=0.01)
+    assert len(sketch.buckets) < 1000
+
+
+def test_log_bucket_sketch_merge() -> None:
+    first = LogBucketSketch(relative_accuracy=0.01)
+    second = LogBucketSketch(relative_accuracy=0.01)
+    for value in (0.0, 0.1, 0.2):
+        first.add(value)
+    second.add(10.0)
+    first.merge(second)
+    assert first.count == 4
+    assert first.quantile(0.0) == 0.0
+    assert first.quantile(1.0) == pytest.approx(10.0, rel=0.01)
+
+    with pytest.raises(ValueError):
+        first.merge(LogBucketSketch(relative_accuracy=0.05))
+
+
+def test_log_bucket_sketch_empty() -> None:
+    assert LogBucketSketch(relative_accuracy=0.01).quantile(0.5) is None
+
+
+def test_windowed_sketch_forgets_old_values() -> None:
+    now = 0.0
+    sketch = WindowedSketch(
+        window_seconds=60, subwindows=3, relative_accuracy=0.01, clock=lambda: now
+    )
+    sketch.add(5.0)
+    now = 30.0
+    sketch.add(1.0)
+    assert sketch.merged().count == 2
+
+    # The first sub-window has left the window
+    now = 61.0
+    merged = sketch.merged()
+    assert merged.count == 1
+    assert merged.quantile(0.5) == pytest.approx(1.0, rel=0.01)
+
+
+def test_request_recorder_quantiles() -> None:
+    registry = CollectorRegistry()
+    recorder = RequestRecorder(
+        recorders={"quantiles"},
+        buckets=[0.1, 1.0],
+        size_buckets=[100, 1000],
+        max_label_sets=10,
+        registry=registry,
+        quantiles=[0.5, 0.99],
+    )
+    for latency in range(1, 101):
+        recorder.record(RequestMeasurement("GET", "/report", 200, latency / 100))
+
+    assert recorder.latency_quantiles is not None
+    snapshot = recorder.latency_quantiles.snapshot([0.5])
+    assert snapshot["/report"].samples == 100
+    assert registry.get_sample_value(
+        "fastapi_request_latency_quantile_seconds",
+        {"route": "/report", "quantile": "0.99"},
+    ) == pytest.approx(0.99, rel=0.01)
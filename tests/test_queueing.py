@@ -0,0 +1,90 @@
+import time
+from typing import Optional
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+from pytest_mock import MockFixture
+
+from fastapi_batteries_included.helpers import metrics
+from fastapi_batteries_included.helpers.load_shedding import LoadSheddingMiddleware
+from fastapi_batteries_included.helpers.metrics import MetricsMiddleware
+from fastapi_batteries_included.helpers.queueing import (
+    QueueTimeReader,
+    parse_request_start,
+)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("t=1660000000.125", 1660000000.125),
+        ("1660000000.125", 1660000000.125),
+        ("t=1660000000125", 1660000000.125),
+        ("t=1660000000125000", 1660000000.125),
+        ("t=1660000000125000 D=42", 1660000000.125),
+        ("", None),
+        ("t=soon", None),
+    ],
+)
+def test_parse_request_start(value: str, expected: Optional[float]) -> None:
+    assert parse_request_start(value) == expected
+
+
+def test_queue_time() -> None:
+    reader = QueueTimeReader(["X-Request-Start"])
+    scope = {"headers": [(b"x-request-start", b"t=1000.5")]}
+    assert reader.queue_time(scope, now=1001.0) == 0.5
+    # Clock skew must not give a negative queueing time
+    assert reader.queue_time(scope, now=1000.0) == 0.0
+    assert reader.queue_time({"headers": []}, now=1001.0) is None
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/work")
+    async def work() -> dict:
+        return {}
+
+    @app.get("/running", tags=["infra"])
+    async def running() -> dict:
+        return {"running": True}
+
+    app.add_middleware(LoadSheddingMiddleware, max_queue_seconds=5)
+    app.add_middleware(MetricsMiddleware)
+    return app
+
+
+@pytest.mark.asyncio
+async def test_queue_time_recorded(mocker: MockFixture) -> None:
+    mocker.patch.object(metrics.metrics_settings, "REQUEST_QUEUE_TIME_ENABLED", True)
+    before = REGISTRY.get_sample_value("fastapi_request_queue_seconds_count") or 0
+    async with AsyncClient(app=make_app(), base_url="http://test") as client:
+        response = await client.get(
+            "/work", headers={"X-Request-Start": f"t={time.time() * 1000:.0f}"}
+        )
+        assert response.status_code == 200
+        # No header, nothing recorded
+        assert (await client.get("/work")).status_code == 200
+    assert REGISTRY.get_sample_value("fastapi_request_queue_seconds_count") == (
+        before + 1
+    )
+
+
+@pytest.mark.asyncio
+async def test_expired_requests_rejected() -> None:
+    labels = {"route": "/work"}
+    before = REGISTRY.get_sample_value("fastapi_requests_expired_total", labels) or 0
+    expired = {"X-Request-Start": f"t={time.time() - 10:.3f}"}
+    async with AsyncClient(app=make_app(), base_url="http://test") as client:
+        response = await client.get("/work", headers=expired)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert (await client.get("/running", headers=expired)).status_code == 200
+        fresh = {"X-Request-Start": f"t={time.time():.3f}"}
+        assert (await client.get("/work", headers=fresh)).status_code == 200
+    assert REGISTRY.get_sample_value("fastapi_requests_expired_total", labels) == (
+        before + 1
+    )
@@ -0,0 +1,146 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+
+from fastapi_batteries_included.router_monitoring import readiness
+from fastapi_batteries_included.router_monitoring.readiness import (
+    ReadinessChecks,
+    readiness_router,
+)
+from fastapi_batteries_included.sqldb import database_readiness_check
+
+
+def passing() -> None:
+    pass
+
+
+def failing() -> None:
+    raise ConnectionError("No route to host")
+
+
+async def hanging() -> None:
+    await asyncio.sleep(10)
+
+
+@pytest.mark.asyncio
+async def test_readiness_checks() -> None:
+    checks = ReadinessChecks(interval=10, timeout=0.01)
+    assert checks.ready
+
+    checks.register("passing", passing)
+    # Not ready until the check has run
+    assert not checks.ready
+
+    await checks.run()
+    assert checks.ready
+    assert checks.results["passing"].ok
+
+    checks.register("failing", failing)
+    checks.register("hanging", hanging)
+    await checks.run()
+    assert not checks.ready
+    assert checks.results["failing"].error == "ConnectionError: No route to host"
+    assert checks.results["hanging"].error == "Timed out after 0.01s"
+    assert (
+        REGISTRY.get_sample_value("fastapi_readiness_check_up", {"check": "failing"})
+        == 0
+    )
+    assert (
+        REGISTRY.get_sample_value("fastapi_readiness_check_up", {"check": "passing"})
+        == 1
+    )
+
+
+@pytest.mark.asyncio
+async def test_readiness_checks_run_in_background() -> None:
+    checks = ReadinessChecks(interval=0.01, timeout=1)
+    calls = 0
+
+    def counting() -> None:
+        nonlocal calls
+        calls += 1
+
+    checks.register("counting", counting)
+    await checks.start()
+    while calls < 2:
+        await asyncio.sleep(0.01)
+    await checks.stop()
+    assert checks.ready
+
+
+@pytest.mark.asyncio
+async def test_hanging_sync_check_not_run_again() -> None:
+    checks = ReadinessChecks(interval=10, timeout=0.01)
+    release = threading.Event()
+    calls = 0
+
+    def hanging() -> None:
+        nonlocal calls
+        calls += 1
+        release.wait()
+
+    checks.register("hanging", hanging)
+    try:
+        await checks.run()
+        assert checks.results["hanging"].error == "Timed out after 0.01s"
+        await checks.run()
+        assert calls == 1
+        assert checks.results["hanging"].error == (
+            "RuntimeError: Still running since an earlier run"
+        )
+    finally:
+        release.set()
+    await checks._running["hanging"]
+
+    await checks.run()
+    assert calls == 2
+    assert checks.ready
+
+
+def test_database_readiness_check() -> None:
+    database_readiness_check(create_engine("sqlite://"), timeout=1)()
+
+
+@pytest.mark.asyncio
+async def test_ready_endpoint(monkeypatch: pytest.MonkeyPatch) -> None:
+    checks = ReadinessChecks(interval=10, timeout=1)
+    monkeypatch.setattr(readiness, "readiness_checks", checks)
+    app = FastAPI()
+    app.include_router(readiness_router)
+
+    checks.register("db", failing)
+    await checks.run()
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/ready")
+        assert response.status_code == 503
+        assert response.json() == {
+            "ready": False,
+            "draining": False,
+            "checks": {"db": False},
+        }
+
+        checks.register("db", passing)
+        await checks.run()
+        response = await client.get("/ready")
+        assert response.status_code == 200
+        assert response.json() == {
+            "ready": True,
+            "draining": False,
+            "checks": {"db": True},
+        }
+
+
+@pytest.mark.asyncio
+async def test_not_ready_while_draining() -> None:
+    checks = ReadinessChecks(interval=10, timeout=1)
+    checks.register("passing", passing)
+    await checks.run()
+    checks.set_draining(True)
+    assert not checks.ready
+    checks.set_draining(False)
+    assert checks.ready
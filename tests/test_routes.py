@@ -4,8 +4,14 @@ import pytest
 from _pytest.logging import LogCaptureFixture
 from fastapi import APIRouter, Depends, FastAPI
 from httpx import AsyncClient
+from starlette.routing import Mount
+from starlette.types import Scope
 
-from fastapi_batteries_included.helpers.routes import deprecated_route
+from fastapi_batteries_included.helpers.routes import (
+    deprecated_route,
+    get_matched_route,
+    get_route_template,
+)
 
 dummy_router = APIRouter()
 
@@ -24,6 +30,14 @@ async def route_replacement() -> list:
     return []
 
 
+sub_app = FastAPI()
+
+
+@sub_app.get("/item/{item_id}")
+async def get_item(item_id: str) -> dict:
+    return {}
+
+
 class TestErrors:
     @pytest.fixture(scope="module")
     def app(self) -> FastAPI:
@@ -53,3 +67,43 @@ class TestErrors:
             "Endpoint /route/deprecated is deprecated, use GET /route/replacement"
             in caplog.text
         )
+
+
+class TestRouteTemplate:
+    @pytest.fixture(scope="module")
+    def app(self) -> FastAPI:
+        app = FastAPI()
+        app.include_router(dummy_router)
+        app.router.routes.append(Mount("/sub", app=sub_app))
+        return app
+
+    @staticmethod
+    def scope(app: FastAPI, method: str, path: str) -> Scope:
+        return {"type": "http", "app": app, "method": method, "path": path}
+
+    def test_get_route_template(self, app: FastAPI) -> None:
+        assert get_route_template(self.scope(app, "GET", "/route/replacement")) == (
+            "/route/replacement"
+        )
+        assert get_route_template(self.scope(app, "GET", "/sub/item/123")) == (
+            "/sub/item/{item_id}"
+        )
+        assert get_route_template(self.scope(app, "POST", "/route/replacement")) == (
+            "/route/replacement"
+        )
+        assert get_route_template(self.scope(app, "GET", "/nowhere")) is None
+
+    def test_get_matched_route(self, app: FastAPI) -> None:
+        template, route = get_matched_route(self.scope(app, "GET", "/sub/item/123"))
+        assert template == "/sub/item/{item_id}"
+        assert route is sub_app.routes[-1]
+        assert get_matched_route(self.scope(app, "GET", "/nowhere")) == (None, None)
+
+    def test_get_matched_route_once_per_request(self, app: FastAPI) -> None:
+        scope = self.scope(app, "GET", "/sub/item/123")
+        matched = get_matched_route(scope)
+        assert scope["state"]["route_template"] == "/sub/item/{item_id}"
+
+        # As routing through the mount does
+        scope["path"] = "/item/123"
+        assert get_matched_route(scope) == matched
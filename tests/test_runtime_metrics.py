@@ -0,0 +1,106 @@
+import gc
+import tracemalloc
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+from prometheus_fastapi_instrumentator import Instrumentator
+from pytest_mock import MockFixture
+
+from fastapi_batteries_included.helpers.runtime_metrics import (
+    HeapSnapshots,
+    init_runtime_metrics,
+)
+
+
+def test_gc_pause_recorded() -> None:
+    init_runtime_metrics()
+    init_runtime_metrics()
+    labels = {"generation": "2"}
+    before = REGISTRY.get_sample_value("python_gc_pause_seconds_count", labels) or 0
+    gc.collect()
+    assert REGISTRY.get_sample_value("python_gc_pause_seconds_count", labels) == (
+        before + 1
+    )
+    assert (REGISTRY.get_sample_value("python_allocated_blocks") or 0) > 0
+    assert (
+        REGISTRY.get_sample_value("python_gc_generation_threshold", {"generation": "0"})
+        == gc.get_threshold()[0]
+    )
+    assert (
+        REGISTRY.get_sample_value("python_gc_generation_count", {"generation": "2"})
+        is not None
+    )
+
+
+def test_heap_snapshots_diff() -> None:
+    snapshots = HeapSnapshots(max_snapshots=2)
+    with pytest.raises(ValueError):
+        snapshots.take()
+
+    snapshots.start(frames=1)
+    try:
+        base = snapshots.take()
+        retained = [bytearray(1000) for _ in range(100)]
+        current = snapshots.take()
+        diff = snapshots.diff(base, current, limit=5)
+        assert diff[0].size_diff >= 100 * 1000
+        assert __file__ in diff[0].location
+        assert snapshots.top(current, limit=5)
+
+        snapshots.take()
+        with pytest.raises(KeyError):
+            snapshots.top(base, limit=5)
+    finally:
+        snapshots.stop()
+    assert not tracemalloc.is_tracing()
+    del retained
+
+
+class TestTracemallocEndpoints:
+    @pytest.fixture
+    def app(self, mocker: MockFixture) -> FastAPI:
+        from fastapi_batteries_included import create_app
+
+        # p-f-i doesn't like being attached to multiple apps so stub it out
+        mocker.patch.object(Instrumentator, "instrument")
+        return create_app(testing=False)
+
+    @pytest.mark.asyncio
+    async def test_tracemalloc_endpoints(self, client: AsyncClient) -> None:
+        response = await client.post("/debug/tracemalloc/snapshots")
+        assert response.status_code == 409
+
+        response = await client.post("/debug/tracemalloc/start")
+        assert response.status_code == 204
+        try:
+            base = (await client.post("/debug/tracemalloc/snapshots")).json()
+            response = await client.post(
+                "/debug/tracemalloc/snapshots", params={"limit": 3}
+            )
+            assert response.status_code == 200
+            current = response.json()
+            assert len(current["top"]) == 3
+            assert set(current["top"][0]) == {
+                "location",
+                "size",
+                "allocations",
+                "size_diff",
+                "allocations_diff",
+            }
+
+            response = await client.get(
+                "/debug/tracemalloc/diff",
+                params={"base": base["id"], "current": current["id"]},
+            )
+            assert response.status_code == 200
+
+            response = await client.get(
+                "/debug/tracemalloc/diff", params={"base": 999, "current": 1}
+            )
+            assert response.status_code == 404
+        finally:
+            response = await client.post("/debug/tracemalloc/stop")
+        assert response.status_code == 204
+        assert not tracemalloc.is_tracing()
@@ -0,0 +1,113 @@
+from typing import Optional
+
+import pytest
+from fastapi import Depends, FastAPI
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+
+from fastapi_batteries_included.helpers.metrics import MetricsMiddleware
+from fastapi_batteries_included.helpers.slo import (
+    SLO,
+    SLO_AVAILABILITY,
+    SLO_LATENCY,
+    RollingEventCounts,
+    SLOTracker,
+    route_slo,
+    window_label,
+)
+
+
+def test_slo_events() -> None:
+    availability = SLO(SLO_AVAILABILITY, 0.999)
+    latency = SLO(SLO_LATENCY, 0.99, latency_threshold=0.5)
+    assert availability.is_good(404, 10.0) is True
+    assert availability.is_good(503, 0.1) is False
+    assert latency.is_good(200, 0.5) is True
+    assert latency.is_good(200, 0.6) is False
+    assert latency.is_good(500, 0.1) is None
+
+
+def test_route_slo_needs_an_objective() -> None:
+    with pytest.raises(ValueError):
+        route_slo()
+    with pytest.raises(ValueError):
+        route_slo(availability=99.9)
+
+
+def test_rolling_event_counts_forget_old_buckets() -> None:
+    now = 0.0
+    counts = RollingEventCounts(
+        bucket_seconds=60, max_window_seconds=300, clock=lambda: now
+    )
+    counts.add(good=False)
+    now = 120.0
+    counts.add(good=True)
+    counts.add(good=True)
+    assert counts.totals(60) == (2, 0)
+    assert counts.totals(300) == (2, 1)
+    now = 400.0
+    assert counts.totals(300) == (2, 0)
+    now = 1000.0
+    assert counts.totals(300) == (0, 0)
+
+
+def test_window_label() -> None:
+    assert window_label(300) == "5m"
+    assert window_label(21600) == "6h"
+    assert window_label(259200) == "3d"
+    assert window_label(90) == "90s"
+
+
+def test_burn_rates() -> None:
+    now = 0.0
+    tracker = SLOTracker(windows=[3600, 300], bucket_seconds=60, clock=lambda: now)
+    slos = (SLO(SLO_AVAILABILITY, 0.99),)
+    # 1% of requests failing in the last hour uses the budget at exactly 1x
+    for i in range(100):
+        tracker.record("/work", slos, 500 if i == 0 else 200, 0.1)
+    now = 3000.0
+    for _ in range(100):
+        tracker.record("/work", slos, 200, 0.1)
+
+    [status] = tracker.status()
+    assert status.route == "/work"
+    assert status.slo == SLO_AVAILABILITY
+    assert status.burn_rates["5m"] == 0.0
+    assert status.burn_rates["1h"] == pytest.approx(0.5)
+
+    now = 10000.0
+    assert tracker.status()[0].burn_rates == {"5m": None, "1h": None}
+
+
+@pytest.mark.asyncio
+async def test_route_slo_burn_rate_metrics() -> None:
+    app = FastAPI()
+
+    @app.get(
+        "/slo/{item_id}",
+        dependencies=[Depends(route_slo(availability=0.9, latency=10))],
+    )
+    async def item(item_id: int) -> dict:
+        if item_id == 0:
+            raise ValueError("Item zero")
+        return {}
+
+    app.add_middleware(MetricsMiddleware)
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        for item_id in range(1, 4):
+            assert (await client.get(f"/slo/{item_id}")).status_code == 200
+        with pytest.raises(ValueError):
+            await client.get("/slo/0")
+
+    def sample(name: str, slo: str, **labels: str) -> Optional[float]:
+        return REGISTRY.get_sample_value(
+            name, {"route": "/slo/{item_id}", "slo": slo, **labels}
+        )
+
+    assert sample("fastapi_slo_objective", SLO_AVAILABILITY) == 0.9
+    assert sample("fastapi_slo_objective", SLO_LATENCY) == 0.99
+    # 1 in 4 failed against a budget of 1 in 10
+    assert sample(
+        "fastapi_slo_burn_rate", SLO_AVAILABILITY, window="5m"
+    ) == pytest.approx(2.5)
+    assert sample("fastapi_slo_burn_rate", SLO_LATENCY, window="6h") == 0.0
@@ -0,0 +1,80 @@
+import asyncio
+from typing import AsyncGenerator
+
+import pytest
+import pytest_asyncio
+from _pytest.logging import LogCaptureFixture
+from _pytest.monkeypatch import MonkeyPatch
+from fastapi import FastAPI
+from httpx import AsyncClient
+from prometheus_fastapi_instrumentator import Instrumentator
+from pytest_mock import MockFixture
+from she_logging import logger
+
+from fastapi_batteries_included.helpers.slow_requests import slow_request_watchdog
+
+
+async def wait_for_upstream() -> None:
+    await asyncio.sleep(0.2)
+
+
+@pytest.fixture(autouse=True)
+def configure_logging() -> None:
+    # she_logging configures logging on first use, which would replace caplog's handler
+    logger.debug("Logging configured")
+
+
+@pytest.fixture
+def app(mocker: MockFixture) -> FastAPI:
+    from fastapi_batteries_included import create_app
+
+    # p-f-i doesn't like being attached to multiple apps so stub it out
+    mocker.patch.object(Instrumentator, "instrument")
+    app = create_app(testing=False)
+
+    @app.get("/slow")
+    async def slow() -> dict:
+        await wait_for_upstream()
+        return {}
+
+    return app
+
+
+@pytest_asyncio.fixture
+async def watchdog(monkeypatch: MonkeyPatch) -> AsyncGenerator[None, None]:
+    monkeypatch.setattr(slow_request_watchdog, "threshold", 0.05)
+    slow_request_watchdog.captured.clear()
+    await slow_request_watchdog.start()
+    yield
+    await slow_request_watchdog.stop()
+
+
+@pytest.mark.asyncio
+async def test_slow_request_captured(
+    watchdog: None, client: AsyncClient, caplog: LogCaptureFixture
+) -> None:
+    response = await client.get("/slow", headers={"X-Request-ID": "slow-request-id"})
+    assert response.status_code == 200
+
+    assert len(slow_request_watchdog.captured) == 1
+    captured = slow_request_watchdog.captured[0]
+    assert captured.route == "/slow"
+    assert captured.request_id == "slow-request-id"
+    assert captured.running_seconds >= 0.05
+    assert "in wait_for_upstream" in captured.stack
+    assert "Slow request GET /slow still running" in caplog.text
+
+    response = await client.get("/debug/slow-requests")
+    assert response.status_code == 200
+    assert [r["request_id"] for r in response.json()] == ["slow-request-id"]
+
+
+@pytest.mark.asyncio
+async def test_requests_not_captured(watchdog: None, client: AsyncClient) -> None:
+    response = await client.get("/running")
+    assert response.status_code == 200
+    # Excluded from metrics
+    response = await client.get("/debug/profile", params={"seconds": 0.1})
+    assert response.status_code == 200
+    await asyncio.sleep(0.1)
+    assert not slow_request_watchdog.captured
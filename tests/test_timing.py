@@ -0,0 +1,201 @@
+import time
+from typing import Iterator
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+from prometheus_fastapi_instrumentator import Instrumentator
+from pytest_mock import MockFixture
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+
+from fastapi_batteries_included.helpers import metrics
+from fastapi_batteries_included.helpers.timing import (
+    RequestTimer,
+    current_request_timer,
+    start_request_timer,
+    stop_request_timer,
+    timed_phase,
+    track_dependency,
+)
+from fastapi_batteries_included.sqldb import (
+    _after_cursor_execute,
+    _before_cursor_execute,
+    _handle_error,
+    register_query_timing,
+)
+
+
+def test_timed_phase_outside_request() -> None:
+    assert current_request_timer() is None
+    with timed_phase("nothing"):
+        pass
+
+
+def test_timed_phase_accumulates() -> None:
+    timer, token = start_request_timer()
+    try:
+        with timed_phase("db"):
+            time.sleep(0.01)
+        with timed_phase("db"):
+            time.sleep(0.01)
+        with timed_phase("auth"):
+            pass
+    finally:
+        stop_request_timer(token)
+
+    assert current_request_timer() is None
+    assert set(timer.phases) == {"db", "auth"}
+    assert timer.phases["db"] >= 0.02
+
+
+def test_server_timing_header() -> None:
+    timer = RequestTimer()
+    timer.add("app", 0.0123)
+    timer.add("db", 0.004)
+    assert timer.server_timing() == "app;dur=12.3, db;dur=4.0"
+
+
+@pytest.fixture
+def engine() -> Iterator[Engine]:
+    engine = create_engine("sqlite://")
+    register_query_timing(engine)
+    yield engine
+    event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+    event.remove(engine, "after_cursor_execute", _after_cursor_execute)
+    event.remove(engine, "handle_error", _handle_error)
+
+
+def test_query_timing(engine: Engine) -> None:
+    timer, token = start_request_timer()
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    finally:
+        stop_request_timer(token)
+    assert timer.phases["db"] > 0
+
+
+def dependency_count(dependency: str, outcome: str) -> float:
+    return (
+        REGISTRY.get_sample_value(
+            "dependency_latency_seconds_count",
+            {"dependency": dependency, "outcome": outcome},
+        )
+        or 0
+    )
+
+
+def test_query_timing_only_registered_engine(engine: Engine) -> None:
+    other_engine = create_engine("sqlite://")
+    timer, token = start_request_timer()
+    try:
+        with other_engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    finally:
+        stop_request_timer(token)
+    assert "db" not in timer.phases
+
+
+def test_query_timing_error_outcome(engine: Engine) -> None:
+    before = dependency_count("db", "error")
+    with engine.connect() as connection, pytest.raises(Exception):
+        connection.execute(text("SELECT * FROM no_such_table"))
+    assert dependency_count("db", "error") == before + 1
+
+
+def test_track_dependency_context_manager() -> None:
+    success_before = dependency_count("crm", "success")
+    error_before = dependency_count("crm", "error")
+
+    timer, token = start_request_timer()
+    try:
+        with track_dependency("crm"):
+            time.sleep(0.01)
+        with pytest.raises(ValueError), track_dependency("crm"):
+            raise ValueError("Upstream failed")
+    finally:
+        stop_request_timer(token)
+
+    assert dependency_count("crm", "success") == success_before + 1
+    assert dependency_count("crm", "error") == error_before + 1
+    assert timer.phases["crm"] >= 0.01
+
+
+@pytest.mark.asyncio
+async def test_track_dependency_decorator() -> None:
+    @track_dependency("crm", phase="upstream")
+    def fetch_sync() -> str:
+        return "sync"
+
+    @track_dependency("crm", phase="upstream")
+    async def fetch_async() -> str:
+        async with track_dependency("cache"):
+            return "async"
+
+    before = dependency_count("crm", "success")
+    timer, token = start_request_timer()
+    try:
+        assert fetch_sync() == "sync"
+        assert await fetch_async() == "async"
+    finally:
+        stop_request_timer(token)
+
+    assert dependency_count("crm", "success") == before + 2
+    assert set(timer.phases) == {"upstream", "cache"}
+
+
+class TestServerTiming:
+    @pytest.fixture
+    def app(self, mocker: MockFixture) -> FastAPI:
+        from fastapi_batteries_included import create_app, init_metrics
+
+        # p-f-i doesn't like being attached to multiple apps so stub it out
+        mocker.patch.object(Instrumentator, "instrument")
+
+        app = create_app(testing=True)
+        init_metrics(app)
+
+        @app.get("/timed")
+        def timed() -> dict:
+            # Sync endpoints run in the threadpool
+            with timed_phase("work"):
+                time.sleep(0.01)
+            return {}
+
+        return app
+
+    @pytest.mark.asyncio
+    async def test_server_timing(
+        self, client: AsyncClient, mocker: MockFixture
+    ) -> None:
+        mocker.patch.object(metrics.metrics_settings, "SERVER_TIMING_ENABLED", True)
+        before = (
+            REGISTRY.get_sample_value(
+                "fastapi_request_phase_seconds_count",
+                {"route": "/timed", "phase": "work"},
+            )
+            or 0
+        )
+        response = await client.get("/timed")
+        assert response.status_code == 200
+        phases = dict(
+            item.split(";dur=")
+            for item in response.headers["server-timing"].split(", ")
+        )
+        assert set(phases) == {"work", "app"}
+        assert float(phases["work"]) >= 10.0
+        assert REGISTRY.get_sample_value(
+            "fastapi_request_phase_seconds_count",
+            {"route": "/timed", "phase": "work"},
+        ) == (before + 1)
+
+    @pytest.mark.asyncio
+    async def test_server_timing_disabled(
+        self, client: AsyncClient, mocker: MockFixture
+    ) -> None:
+        mocker.patch.object(metrics.metrics_settings, "SERVER_TIMING_ENABLED", False)
+        response = await client.get("/timed")
+        assert response.status_code == 200
+        assert "server-timing" not in response.headers